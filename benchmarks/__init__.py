@@ -0,0 +1,291 @@
+"""
+Benchmarks for the entity and backend hot paths.
+Each benchmark is run against every backend on a freshly built database, and results are reported as JSON so runs can be compared between releases.
+"""
+import os
+import platform
+import shutil
+import tempfile
+import time
+import timeit
+
+from .. import entity
+from .. import structs
+from ..impl import sqlitedb
+from ..impl import mysqldb
+from . import fakemysql
+from .fakemysql import connector as fakemysqlconnector
+
+timer = timeit.default_timer
+
+class BenchAuthor(entity.Entity):
+    TABLE = "bench_author"
+    PRIMARY = ("author_id",)
+    FIELDS = {"author_id": structs.Field(structs.Types.INT, attributes=(structs.Attributes.NOT_NULL,)),
+              "name": structs.Field(structs.Types.VARCHAR, length=64)}
+
+class BenchPost(entity.Entity):
+    TABLE = "bench_post"
+    PRIMARY = ("post_id",)
+    FIELDS = {"post_id": structs.Field(structs.Types.INT, attributes=(structs.Attributes.NOT_NULL,)),
+              "title": structs.Field(structs.Types.VARCHAR, length=128),
+              "views": structs.Field(structs.Types.INT, default=0),
+              "body": structs.Field(structs.Types.TEXT)}
+
+class BenchComment(entity.Entity):
+    TABLE = "bench_comment"
+    PRIMARY = ("comment_id",)
+    FIELDS = {"comment_id": structs.Field(structs.Types.INT, attributes=(structs.Attributes.NOT_NULL,)),
+              "text": structs.Field(structs.Types.VARCHAR, length=255)}
+    REFERENCES = {"post": structs.FieldReference(BenchPost)}
+
+ENTITY_CLASSES = (BenchAuthor, BenchPost, BenchComment)
+
+def _postValues(i):
+    """
+    Private function returning the field values of the i-th post.
+    """
+    return {"post_id": i, "title": "Post %d" % i, "views": i % 100, "body": "Lorem ipsum dolor sit amet. " * 8}
+
+def _seed(db, rows):
+    """
+    Private function filling the benchmark tables with rows posts and rows comments.
+    """
+    for i in range(rows):
+        db.insert(BenchPost.TABLE, _postValues(i))
+        db.insert(BenchComment.TABLE, {"comment_id": i, "text": "Comment %d" % i, "post_id": i})
+    db.refresh()
+
+def _clearIdentityMaps():
+    """
+    Private function emptying the identity maps of the benchmark entities.
+    """
+    for entityClass in ENTITY_CLASSES:
+        entityClass._ENTITIES.clear()
+
+def benchConstruct(db, rows):
+    """
+    Constructs rows distinct entities through EntityMetaclass.__call__, each missing the identity map.
+    """
+    for i in range(rows):
+        BenchPost(db, **_postValues(i))
+    return rows, {}
+
+def benchConstructCached(db, rows):
+    """
+    Constructs the same entity rows times through EntityMetaclass.__call__, each hitting the identity map.
+    """
+    values = _postValues(0)
+    BenchPost(db, **values)
+    for i in range(rows):
+        BenchPost(db, **values)
+    return rows, {}
+
+def benchSelect(db, rows):
+    """
+    Selects and hydrates every post.
+    """
+    return len(BenchPost.select(db)), {}
+
+def benchSelectColumns(db, rows):
+    """
+    Selects every post's id, views and title into typed column arrays.
+    """
+    return len(BenchPost.selectColumns(db, ["post_id", "views", "title"])["post_id"]), {}
+
+def benchSelectReferences(db, rows):
+    """
+    Selects and hydrates every comment, joining on and hydrating its referenced post.
+    """
+    return len(BenchComment.select(db)), {}
+
+def benchInsertSingle(db, rows):
+    """
+    Inserts rows entities one at a time through Entity.insert(), committing after each.
+    """
+    for i in range(rows):
+        BenchPost(db, **_postValues(i)).insert()
+        db.refresh()
+    return rows, {}
+
+def benchInsertGroupCommit(db, rows):
+    """
+    Inserts rows entities one at a time through Entity.insert(), refreshing after each with group commit of up to 100 refreshes.
+    """
+    db.setGroupCommit(maxCommits=100)
+    for i in range(rows):
+        BenchPost(db, **_postValues(i)).insert()
+        db.refresh()
+    db.setGroupCommit()
+    return rows, {"commits": db.getCommitStatistics()["commits"]}
+
+def benchInsertBulk(db, rows):
+    """
+    Inserts rows rows through the backend within a single commit.
+    """
+    for i in range(rows):
+        db.insert(BenchPost.TABLE, _postValues(i))
+    db.refresh()
+    return rows, {}
+
+def benchBulkLoad(db, rows):
+    """
+    Loads rows rows through Entity.bulkLoad().
+    """
+    return BenchPost.bulkLoad(db, (_postValues(i) for i in range(rows)))["rows"], {}
+
+def benchUpdate(db, rows):
+    """
+    Selects every post, then changes a field on each and updates it through Entity.update().
+    """
+    posts = BenchPost.select(db)
+    for post in posts:
+        post.views = post.views + 1
+        post.update()
+    db.refresh()
+    return len(posts), {}
+
+def benchDelete(db, rows):
+    """
+    Selects every post, then deletes each through Entity.delete().
+    """
+    posts = BenchPost.select(db)
+    for post in posts:
+        post.delete()
+    db.refresh()
+    return len(posts), {}
+
+def benchIdentityMap(db, rows):
+    """
+    Selects every post twice and keyed posts once more, reporting how many constructions were served by the identity map.
+    """
+    constructed = 0
+    for i in range(2):
+        constructed += len(BenchPost.select(db))
+    for i in range(0, rows, 10):
+        constructed += len(BenchPost.select(db, [structs.Conditional("post_id", i)]))
+    hits = constructed - len(BenchPost._ENTITIES)
+    return constructed, {"identityMapHitRate": float(hits) / constructed if constructed > 0 else 0.0}
+
+"""
+List of (name, seeded, function) tuples. Seeded benchmarks run against tables filled by _seed().
+"""
+BENCHMARKS = [("entity_construct", False, benchConstruct),
+              ("entity_construct_cached", False, benchConstructCached),
+              ("select", True, benchSelect),
+              ("select_columns", True, benchSelectColumns),
+              ("select_references", True, benchSelectReferences),
+              ("insert_single", False, benchInsertSingle),
+              ("insert_group_commit", False, benchInsertGroupCommit),
+              ("insert_bulk", False, benchInsertBulk),
+              ("bulk_load", False, benchBulkLoad),
+              ("update", True, benchUpdate),
+              ("delete", True, benchDelete),
+              ("identity_map", True, benchIdentityMap)]
+
+class _DiskSQLite(object):
+    """
+    Private factory for SQLite databases stored in a temporary directory.
+    """
+    def __init__(self):
+        self._directory = None
+        self._count = 0
+
+    def __call__(self):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="ezdb-bench-")
+        self._count += 1
+        return sqlitedb.SQLite(os.path.join(self._directory, "bench%d.db" % self._count))
+
+    def cleanup(self):
+        if self._directory is not None:
+            shutil.rmtree(self._directory, True)
+            self._directory = None
+
+def _memorySQLite():
+    return sqlitedb.SQLite(":memory:")
+
+def _fakeMySQL():
+    return mysqldb.MySQL(":memory:", "bench", implementation=fakemysql.__name__)
+
+def _fakeMySQLPrepared():
+    return mysqldb.MySQL(":memory:", "bench", implementation=fakemysqlconnector.__name__, preparedCacheSize=64)
+
+def getBackends():
+    """
+    Returns a list of (name, factory) tuples for the backends benchmarked by default.
+    """
+    return [("sqlite-memory", _memorySQLite),
+            ("sqlite-disk", _DiskSQLite()),
+            ("mysql-fake", _fakeMySQL),
+            ("mysql-fake-prepared", _fakeMySQLPrepared)]
+
+def runBenchmark(function, factory, rows, seeded, repeat):
+    """
+    Runs a benchmark repeat times, each on a freshly built database, returning the best time along with the operation count and extras of that run.
+    """
+    best = None
+    for i in range(repeat):
+        db = factory()
+        for entityClass in ENTITY_CLASSES:
+            entityClass.buildTable(db)
+        if seeded:
+            _seed(db, rows)
+        _clearIdentityMaps()
+        start = timer()
+        operations, extras = function(db, rows)
+        seconds = timer() - start
+        db.close()
+        _clearIdentityMaps()
+        if best is None or seconds < best[0]:
+            best = (seconds, operations, extras)
+    return best
+
+def runBenchmarks(rows=1000, repeat=3, names=None, backends=None):
+    """
+    Runs the benchmarks against each backend, returning a JSON-serializable dictionary of results.
+    """
+    if backends is None:
+        backends = getBackends()
+    results = []
+    for backendName, factory in backends:
+        try:
+            for name, seeded, function in BENCHMARKS:
+                if names is not None and name not in names:
+                    continue
+                seconds, operations, extras = runBenchmark(function, factory, rows, seeded, repeat)
+                result = {"name": name,
+                          "backend": backendName,
+                          "operations": operations,
+                          "seconds": seconds,
+                          "operationsPerSecond": operations / seconds if seconds > 0 else 0.0,
+                          "microsecondsPerOperation": seconds * 1000000.0 / operations if operations > 0 else 0.0}
+                result.update(extras)
+                results.append(result)
+        finally:
+            if hasattr(factory, "cleanup"):
+                factory.cleanup()
+    return {"meta": {"python": platform.python_version(),
+                     "implementation": platform.python_implementation(),
+                     "platform": platform.platform(),
+                     "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                     "rows": rows,
+                     "repeat": repeat},
+            "results": results}
+
+def compareResults(baseline, current, tolerance=0.1):
+    """
+    Compares two result dictionaries, returning a list of (name, backend, baselineSeconds, currentSeconds) for benchmarks that became slower by more than tolerance.
+    Timings are normalised per operation, so runs with different row counts can be compared.
+    """
+    baselineTimes = {}
+    for result in baseline["results"]:
+        baselineTimes[(result["name"], result["backend"])] = result["microsecondsPerOperation"]
+    regressions = []
+    for result in current["results"]:
+        key = (result["name"], result["backend"])
+        if key not in baselineTimes or baselineTimes[key] <= 0:
+            continue
+        if result["microsecondsPerOperation"] > baselineTimes[key] * (1.0 + tolerance):
+            regressions.append((result["name"], result["backend"], baselineTimes[key], result["microsecondsPerOperation"]))
+    return regressions
@@ -0,0 +1,40 @@
+"""
+Command line entry point for the benchmarks, e.g.:
+    python -m ezdb.benchmarks --rows 1000 --output results.json --compare baseline.json
+"""
+import argparse
+import json
+import sys
+
+from . import BENCHMARKS, runBenchmarks, compareResults
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the entity and backend hot paths.")
+    parser.add_argument("--rows", type=int, default=1000, help="number of rows per benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs per benchmark, the best of which is reported")
+    parser.add_argument("--only", action="append", choices=map(lambda x: x[0], BENCHMARKS), help="benchmark to run (repeatable)")
+    parser.add_argument("--output", help="file to write the JSON results to (defaults to stdout)")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative slowdown reported as a regression")
+    options = parser.parse_args(argv)
+
+    results = runBenchmarks(options.rows, options.repeat, options.only)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output is None:
+        sys.stdout.write(output + "\n")
+    else:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(baseline, results, options.tolerance)
+        for name, backend, before, after in regressions:
+            sys.stderr.write("REGRESSION %s [%s]: %.2f us -> %.2f us per operation\n" % (name, backend, before, after))
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
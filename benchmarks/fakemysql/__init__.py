@@ -0,0 +1,54 @@
+"""
+A fake DB-API driver standing in for pymysql/MySQLdb, so the MySQL backend can be exercised without a server.
+Statements are translated from the MySQL paramstyle and executed against SQLite, and the connection counts the statements it runs and prepares.
+The connector submodule stands in for mysql.connector in the same way, including its server-side prepared statement cursors.
+"""
+import sqlite3
+
+from . import cursors
+
+def connect(host=None, user=None, passwd=None, db=":memory:", cursorclass=cursors.Cursor):
+    """
+    Opens a fake connection. The database name is used as the SQLite database, defaulting to an in-memory database.
+    """
+    return Connection(db, cursorclass)
+
+class Connection(object):
+    """
+    A fake connection wrapping an SQLite connection.
+    Like a MySQL connection without autocommit, a transaction is begun implicitly by the first statement after a commit or rollback.
+    """
+    executeCount = 0
+    prepareCount = 0
+    def __init__(self, database, cursorclass):
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        self._connection.isolation_level = None
+        self._inTransaction = False
+        self._cursorclass = cursorclass
+
+    def cursor(self, cursor=None):
+        if cursor is None:
+            cursor = self._cursorclass
+        return cursor(self)
+
+    def _translate(self, query):
+        """
+        Private method for translating MySQL parameter tokens to SQLite parameter tokens, beginning a transaction if none is active.
+        """
+        if not self._inTransaction:
+            self._connection.execute("BEGIN")
+            self._inTransaction = True
+        return query.replace("%s", "?")
+
+    def commit(self):
+        if self._inTransaction:
+            self._connection.execute("COMMIT")
+            self._inTransaction = False
+
+    def rollback(self):
+        if self._inTransaction:
+            self._connection.execute("ROLLBACK")
+            self._inTransaction = False
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,23 @@
+"""
+A fake DB-API driver standing in for mysql.connector, with the same connect() arguments and cursor() options,
+including dictionary and server-side prepared statement cursors. It has no cursors module, like mysql.connector.
+"""
+from . import Connection
+from . import cursors
+
+def connect(host=None, user=None, password="", database=":memory:"):
+    """
+    Opens a fake connection. The database name is used as the SQLite database, defaulting to an in-memory database.
+    """
+    return ConnectorConnection(database, cursors.Cursor)
+
+class ConnectorConnection(Connection):
+    """
+    A fake connection with mysql.connector's cursor() options.
+    """
+    def cursor(self, buffered=None, raw=None, prepared=None, cursor_class=None, dictionary=None, named_tuple=None):
+        if prepared:
+            return cursors.PreparedCursor(self)
+        if dictionary:
+            return cursors.DictCursor(self)
+        return cursors.Cursor(self)
@@ -0,0 +1,64 @@
+class Cursor(object):
+    """
+    A fake cursor returning rows as tuples.
+    """
+    description = None
+    rowcount = -1
+    closed = False
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection._connection.cursor()
+
+    def execute(self, query, args=()):
+        self._connection.executeCount += 1
+        self._cursor.execute(self._connection._translate(query), tuple(args or ()))
+        self.description = self._cursor.description
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, query, args):
+        self._connection.executeCount += 1
+        self._cursor.executemany(self._connection._translate(query), args)
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def _convertRow(self, row):
+        """
+        Private method for converting a row from the underlying SQLite cursor.
+        """
+        return row
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            return None
+        return self._convertRow(row)
+
+    def fetchmany(self, size=1):
+        return map(self._convertRow, self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return map(self._convertRow, self._cursor.fetchall())
+
+    def close(self):
+        self._cursor.close()
+        self.closed = True
+
+class DictCursor(Cursor):
+    """
+    A fake cursor returning rows as dictionaries, like pymysql.cursors.DictCursor.
+    """
+    def _convertRow(self, row):
+        return dict(zip(map(lambda x: x[0], self.description), row))
+
+class PreparedCursor(Cursor):
+    """
+    A fake server-side prepared statement cursor, like mysql.connector's, returning rows as tuples.
+    A statement is prepared when the cursor first executes it, and re-executing the same statement reuses the preparation.
+    """
+    _statement = None
+    def execute(self, query, args=()):
+        if query != self._statement:
+            self._connection.prepareCount += 1
+            self._statement = query
+        return super(PreparedCursor, self).execute(query, args)
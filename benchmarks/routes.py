@@ -0,0 +1,76 @@
+"""
+Microbenchmark for PageManager.resolvePath(), e.g.:
+    python -m ezdb.benchmarks.routes --routes 500 --lookups 20000
+"""
+import argparse
+import json
+import re
+import sys
+import timeit
+
+from .. import page
+
+timer = timeit.default_timer
+
+def buildRoutes(count):
+    """
+    Returns a page collection class with count anchored routes, each capturing one numeric group.
+    """
+    pages = map(lambda x: ("^/section%d/item/(\\d+)$" % x, "handler%d" % x), range(count))
+    return type("BenchPages%d" % count, (object,), {"PAGES": pages})
+
+def linearResolve(pageCollection, path):
+    """
+    Resolves a path the way PageManager did before routes were compiled, as a baseline.
+    """
+    for route in pageCollection.PAGES:
+        match = re.search(route[0], path)
+        if match is not None:
+            return route[1], match.groups()
+    return None, None
+
+def _time(function, paths):
+    start = timer()
+    for path in paths:
+        function(path)
+    return timer() - start
+
+def runRouteBenchmarks(routes=500, lookups=20000, distinctPaths=500):
+    """
+    Times path resolution over routes routes, returning a JSON-serializable dictionary of results.
+    Lookups cycle through distinctPaths paths spread evenly over the routes.
+    """
+    pageCollection = buildRoutes(routes)
+    paths = map(lambda x: "/section%d/item/%d" % (x % routes, x), range(distinctPaths))
+    lookupPaths = map(lambda x: paths[x % distinctPaths], range(lookups))
+
+    manager = page.PageManager()
+    manager.registerPageCollection(pageCollection)
+    uncached = page.PageManager()
+    uncached.ROUTE_CACHE_SIZE = 0
+    uncached.registerPageCollection(pageCollection)
+
+    timings = [("linear", _time(lambda x: linearResolve(pageCollection, x), lookupPaths)),
+               ("compiled", _time(uncached.resolvePath, lookupPaths)),
+               ("compiled_cached", _time(manager.resolvePath, lookupPaths))]
+    results = []
+    for name, seconds in timings:
+        results.append({"name": name,
+                        "backend": "routes-%d" % routes,
+                        "operations": lookups,
+                        "seconds": seconds,
+                        "operationsPerSecond": lookups / seconds if seconds > 0 else 0.0,
+                        "microsecondsPerOperation": seconds * 1000000.0 / lookups})
+    return {"meta": {"routes": routes, "lookups": lookups, "distinctPaths": distinctPaths}, "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PageManager.resolvePath().")
+    parser.add_argument("--routes", type=int, default=500, help="number of registered routes")
+    parser.add_argument("--lookups", type=int, default=20000, help="number of paths resolved")
+    parser.add_argument("--distinct", type=int, default=500, help="number of distinct paths resolved")
+    options = parser.parse_args(argv)
+    sys.stdout.write(json.dumps(runRouteBenchmarks(options.routes, options.lookups, options.distinct), indent=2, sort_keys=True) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+
+DEFAULT_CHUNK_SIZE = 65536
+
+class BlobReader(object):
+    """
+    A file-like class reading a BLOB value a range at a time, as returned by DBInterface.openBlob(), so the value is never held whole in memory.
+    Ranges are read with readRange(offset, size), and close, if given, is called once the reader is closed.
+    Besides read(), readinto() fills a caller's buffer through a memoryview, iterating yields chunks of chunkSize bytes,
+    and copyTo() streams the rest of the value to a file or socket.
+    """
+    length = 0
+    chunkSize = DEFAULT_CHUNK_SIZE
+    def __init__(self, readRange, length, chunkSize=DEFAULT_CHUNK_SIZE, close=None):
+        self.length = length
+        self.chunkSize = chunkSize
+        self._readRange = readRange
+        self._close = close
+        self._position = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunkSize)
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        """
+        Returns up to size bytes from the current position, or the rest of the value if size is negative.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed blob")
+        remaining = self.length - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        data = self._readRange(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        """
+        Reads up to len(buffer) bytes into a writable buffer (e.g. a bytearray reused across reads), returning the number of bytes read.
+        """
+        view = memoryview(buffer)
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Moves the position to offset, relative to the start, the current position or the end.
+        """
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self._position = max(0, min(offset, self.length))
+        return self._position
+
+    def tell(self):
+        """
+        Returns the current position.
+        """
+        return self._position
+
+    def copyTo(self, target):
+        """
+        Writes the rest of the value to a file-like object (with write()) or a socket (with sendall()) chunk by chunk, returning the number of bytes written.
+        """
+        write = getattr(target, "sendall", None) or target.write
+        count = 0
+        for chunk in self:
+            write(chunk)
+            count += len(chunk)
+        return count
+
+    def close(self):
+        """
+        Closes the reader.
+        """
+        if not self.closed:
+            self.closed = True
+            if self._close is not None:
+                self._close()
+
+def getSourceLength(source):
+    """
+    Returns the number of bytes a source for DBInterface.writeBlob() will provide: the length of a bytes-like object,
+    or the bytes left in a seekable file-like object, or None if it cannot be known without reading it.
+    """
+    if not hasattr(source, "read"):
+        return len(source)
+    try:
+        position = source.tell()
+        source.seek(0, os.SEEK_END)
+        end = source.tell()
+        source.seek(position)
+    except (AttributeError, IOError, OSError):
+        return None
+    return end - position
+
+def toBytes(chunk):
+    """
+    Returns a chunk yielded by iterSourceChunks(), or a BLOB value as returned by a driver (e.g. a buffer on Python 2), as bytes,
+    copying memoryview slices.
+    """
+    if isinstance(chunk, memoryview):
+        return chunk.tobytes()
+    if isinstance(chunk, bytes):
+        return chunk
+    return bytes(chunk)
+
+def iterSourceChunks(source, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Generator yielding a source for DBInterface.writeBlob() in chunks of up to chunkSize bytes.
+    Bytes-like sources are sliced through a memoryview, so no chunk is copied, and file-like sources are read a chunk at a time.
+    """
+    if not hasattr(source, "read"):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunkSize):
+            yield view[offset:offset + chunkSize]
+        return
+    while True:
+        chunk = source.read(chunkSize)
+        if len(chunk) == 0:
+            return
+        yield chunk
@@ -0,0 +1,81 @@
+import array
+import collections
+
+import structs
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    array.array("q")
+    _INT_TYPECODE = "q"
+except ValueError:
+    _INT_TYPECODE = "l"
+
+_NAN = float("nan")
+
+class Column(object):
+    """
+    A class accumulating the values of one column, chunk by chunk, into a typed array.
+    With numpy available, INT columns become int64 arrays, FLOAT columns float64 arrays, and other columns object arrays.
+    Otherwise INT and FLOAT columns become array.array instances, and other columns lists.
+    Numeric columns holding NULLs become float columns, with NULLs as NaN.
+    """
+    fieldType = None
+    def __init__(self, fieldType):
+        self.fieldType = fieldType
+        self._numeric = fieldType in (structs.Types.INT, structs.Types.FLOAT)
+        self._float = fieldType == structs.Types.FLOAT
+        self._chunks = []
+        if numpy is None:
+            self._values = array.array("d" if self._float else _INT_TYPECODE) if self._numeric else []
+
+    def _promote(self):
+        """
+        Private method turning an integer column into a float column, once a NULL has been seen.
+        """
+        self._float = True
+        if numpy is None:
+            self._values = array.array("d", self._values)
+
+    def extend(self, values):
+        """
+        Appends a sequence of values to the column.
+        """
+        if self._numeric and not self._float and None in values:
+            self._promote()
+        if numpy is not None:
+            if not self._numeric:
+                self._chunks.append(numpy.array(values, dtype=object))
+            else:
+                #numpy converts None to NaN for float arrays.
+                self._chunks.append(numpy.array(values, dtype=numpy.float64 if self._float else numpy.int64))
+            return
+        if self._float and None in values:
+            values = [_NAN if x is None else x for x in values]
+        self._values.extend(values)
+
+    def getValues(self):
+        """
+        Returns the array of the values appended so far.
+        """
+        if numpy is None:
+            return self._values
+        if len(self._chunks) == 0:
+            return numpy.array([], dtype=numpy.float64 if self._float else (numpy.int64 if self._numeric else object))
+        values = numpy.concatenate(self._chunks)
+        self._chunks = [values]
+        return values
+
+def buildColumns(fieldTypes, chunks):
+    """
+    Builds a column for each of a list of (name, field type) tuples from an iterator over lists of row tuples, returning an ordered dictionary of name to array.
+    Rows are transposed a chunk at a time, so no per-row objects are built.
+    """
+    columns = [Column(x[1]) for x in fieldTypes]
+    for rows in chunks:
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return collections.OrderedDict(zip(map(lambda x: x[0], fieldTypes), map(lambda x: x.getValues(), columns)))
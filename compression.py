@@ -0,0 +1,118 @@
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import structs
+
+_RAW_TAG = b"\x00"
+_ZLIB_TAG = b"z"
+_LZMA_TAG = b"x"
+
+class Codec(object):
+    """
+    Base class of field codecs, set as a Field's codec to store its values compressed. Values of at least threshold bytes are compressed,
+    unless that would not make them smaller, and others are stored as they are. Stored values start with a tag naming how they were compressed,
+    so a field's codec can be changed without rewriting its existing rows.
+    """
+    TAG = None
+    threshold = 1024
+    def __init__(self, threshold=1024):
+        self.threshold = threshold
+
+    def _compress(self, data):
+        """
+        Private method compressing bytes, implemented by each codec.
+        """
+        raise NotImplementedError()
+
+    def encode(self, data):
+        """
+        Returns the stored form of bytes.
+        """
+        if len(data) >= self.threshold:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                return self.TAG + compressed
+        return _RAW_TAG + data
+
+class ZlibCodec(Codec):
+    """
+    A codec compressing values with zlib at a compression level.
+    """
+    TAG = _ZLIB_TAG
+    level = 6
+    def __init__(self, threshold=1024, level=6):
+        super(ZlibCodec, self).__init__(threshold)
+        self.level = level
+
+    def _compress(self, data):
+        return zlib.compress(data, self.level)
+    _compress.__doc__ = Codec._compress.__doc__
+
+class LzmaCodec(Codec):
+    """
+    A codec compressing values with lzma at a preset, slower than zlib but usually smaller. Requires the lzma module (backports.lzma on Python 2).
+    """
+    TAG = _LZMA_TAG
+    preset = 6
+    def __init__(self, threshold=1024, preset=6):
+        if lzma is None:
+            raise ImportError("LzmaCodec requires the lzma module")
+        super(LzmaCodec, self).__init__(threshold)
+        self.preset = preset
+
+    def _compress(self, data):
+        return lzma.compress(data, preset=self.preset)
+    _compress.__doc__ = Codec._compress.__doc__
+
+def decode(data):
+    """
+    Returns the bytes a stored value was encoded from, by any codec.
+    """
+    tag = data[:1]
+    if tag == _RAW_TAG:
+        return data[1:]
+    elif tag == _ZLIB_TAG:
+        return zlib.decompress(data[1:])
+    elif tag == _LZMA_TAG:
+        if lzma is None:
+            raise ImportError("Decoding an lzma-compressed value requires the lzma module")
+        return lzma.decompress(data[1:])
+    raise ValueError("Unknown codec tag %r" % tag)
+
+class EncodedValue(object):
+    """
+    A class holding a stored value of a codec field until it is first accessed, so values that are loaded but never read are never decoded.
+    """
+    __slots__ = ("data", "fieldType")
+    def __init__(self, data, fieldType):
+        self.data = bytes(data)
+        self.fieldType = fieldType
+
+    def decode(self):
+        """
+        Returns the decoded value, as unicode for TEXT fields and bytes otherwise.
+        """
+        value = decode(self.data)
+        if self.fieldType == structs.Types.TEXT:
+            return value.decode("utf-8")
+        return value
+
+def encodeValue(codec, fieldType, value):
+    """
+    Returns the stored form of a value of a codec field, encoding unicode as UTF-8 first.
+    """
+    if isinstance(value, EncodedValue):
+        return value.data
+    if not isinstance(value, bytes):
+        if fieldType != structs.Types.TEXT:
+            value = bytes(value)
+        else:
+            value = value.encode("utf-8")
+    return codec.encode(value)
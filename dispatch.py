@@ -0,0 +1,238 @@
+import collections
+import contextlib
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+import structs
+
+"""
+Enum of the policies applied when a dispatcher's pending event limit is reached:
+BLOCK waits for room, INLINE delivers the event in the calling thread, and DROP discards it.
+"""
+Overflow = structs.enum(BLOCK="block", INLINE="inline", DROP="drop")
+
+_logger = logging.getLogger("ezdb.dispatch")
+
+def _deliver(event, obj, values):
+    """
+    Private function delivering an event to an entity's callbacks, logging rather than propagating errors raised by callbacks.
+    """
+    try:
+        obj._deliverEvent(event, values)
+    except Exception:
+        _logger.exception("Error in '%s' callback for %r", event, obj)
+
+class Dispatcher(object):
+    """
+    Base class for entity event dispatchers, which decide when and where entity callbacks run.
+    This implementation delivers every event synchronously and inline, as it happens.
+    """
+    def dispatch(self, event, obj, values=None):
+        """
+        Dispatches an event for an entity. Change events carry a dictionary of the changed values.
+        """
+        obj._deliverEvent(event, values)
+
+    def flush(self):
+        """
+        Delivers any pending events, returning once they have been delivered.
+        """
+        pass
+
+    def close(self):
+        """
+        Delivers any pending events and releases the dispatcher's resources.
+        """
+        self.flush()
+
+"""
+The dispatcher used by entity classes that do not set DISPATCHER.
+"""
+defaultDispatcher = Dispatcher()
+
+class CoalescingDispatcher(Dispatcher):
+    """
+    A dispatcher which holds events until flush() is called (e.g. after committing), delivering them in a batch through a target dispatcher.
+    Repeated events for the same entity are coalesced into one, with the values of change events merged.
+    If more than maxPending entities have events pending, the pending events are flushed immediately.
+    Insert, update and delete events dispatched within a transaction() are only held once it commits, and discarded if it is rolled back.
+    """
+    maxPending = None
+    def __init__(self, target=None, maxPending=10000):
+        self.maxPending = maxPending
+        self._target = target if target is not None else defaultDispatcher
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def dispatch(self, event, obj, values=None):
+        if event != "change" and obj._db.inTransaction():
+            obj._db.getCommitBuffer(self._dispatchCommitted).append((event, obj, values))
+            return
+        key = (id(obj), event)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = [obj, None if values is None else dict(values)]
+            elif values is not None:
+                if pending[1] is None:
+                    pending[1] = {}
+                pending[1].update(values)
+            overflow = self.maxPending is not None and len(self._pending) > self.maxPending
+        if overflow:
+            self.flush()
+
+    def _dispatchCommitted(self, events):
+        """
+        Private method holding the events of a committed transaction.
+        """
+        for event, obj, values in events:
+            self.dispatch(event, obj, values)
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+        for key, (obj, values) in pending.items():
+            self._target.dispatch(key[1], obj, values)
+        self._target.flush()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        A context manager which flushes the events dispatched within it on exit.
+        """
+        try:
+            yield self
+        finally:
+            self.flush()
+
+class ThreadPoolDispatcher(Dispatcher):
+    """
+    A dispatcher which delivers events on a pool of worker threads, so slow callbacks do not add to write latency.
+    At most maxPending events are queued; beyond that the overflow policy applies (see Overflow).
+    Callbacks must be thread-safe, and errors they raise are logged to the 'ezdb.dispatch' logger.
+    """
+    overflow = Overflow.BLOCK
+    def __init__(self, workers=4, maxPending=1000, overflow=Overflow.BLOCK):
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = queue.Queue(maxPending)
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name="ezdb-dispatch-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        """
+        Private method run by each worker thread, delivering queued events until a None sentinel is received.
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                _deliver(*item)
+            finally:
+                self._queue.task_done()
+
+    def dispatch(self, event, obj, values=None):
+        item = (event, obj, values)
+        if self.overflow == Overflow.BLOCK:
+            self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow == Overflow.INLINE:
+                _deliver(*item)
+            else:
+                self.dropped += 1
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+class AsyncioDispatcher(Dispatcher):
+    """
+    A dispatcher which delivers events on an asyncio event loop, scheduled with loop.call_soon_threadsafe().
+    At most maxPending events are scheduled at once; beyond that the overflow policy applies (see Overflow).
+    Events dispatched from the loop's own thread are delivered inline when the limit is reached, as blocking there would never return.
+    """
+    overflow = Overflow.BLOCK
+    def __init__(self, loop, maxPending=1000, overflow=Overflow.BLOCK):
+        self.overflow = overflow
+        self.dropped = 0
+        self._loop = loop
+        self._loopThread = None
+        self._slots = threading.BoundedSemaphore(maxPending)
+        self._idle = threading.Condition()
+        self._scheduled = 0
+
+    def _deliver(self, event, obj, values):
+        """
+        Private method run on the event loop, delivering an event and releasing its slot.
+        """
+        self._loopThread = threading.current_thread()
+        try:
+            _deliver(event, obj, values)
+        finally:
+            self._slots.release()
+            with self._idle:
+                self._scheduled -= 1
+                if self._scheduled == 0:
+                    self._idle.notify_all()
+
+    def _isLoopThread(self):
+        """
+        Private method returning whether the calling thread is running the event loop, known without waiting for a delivery to have run on it.
+        """
+        if self._loopThread is not None:
+            return threading.current_thread() is self._loopThread
+        if not self._loop.is_running():
+            return False
+        #asyncio loops record the id of the thread running them.
+        threadID = getattr(self._loop, "_thread_id", None)
+        if threadID is not None:
+            return threadID == threading.current_thread().ident
+        getRunningLoop = getattr(asyncio, "_get_running_loop", None)
+        return getRunningLoop is not None and getRunningLoop() is self._loop
+
+    def dispatch(self, event, obj, values=None):
+        if not self._slots.acquire(False):
+            if self.overflow == Overflow.DROP:
+                self.dropped += 1
+                return
+            if self.overflow == Overflow.INLINE or self._isLoopThread():
+                _deliver(event, obj, values)
+                return
+            self._slots.acquire()
+        with self._idle:
+            self._scheduled += 1
+        self._loop.call_soon_threadsafe(self._deliver, event, obj, values)
+
+    def flush(self):
+        """
+        Waits until every scheduled event has been delivered. Must not be called from the event loop's thread.
+        """
+        with self._idle:
+            while self._scheduled > 0:
+                self._idle.wait()
@@ -1,14 +1,28 @@
 import copy
+import csv
+import itertools
 import structs
 import interface
+import instrumentation
+import blobs
+import columnar
+import compression
+import dispatch
+import events
 import view
 import re
+import scan
 
 """
 Enum defining the different flags for an entity.
 """
 EntityFlags = structs.enum(NEW=1, DIRTY=2, DELETED=4, CLOSED=8)
 
+"""
+Enum defining the different events an entity dispatches to its callbacks.
+"""
+EntityEvents = structs.enum(INSERT="insert", CHANGE="change", UPDATE="update", DELETE="delete")
+
 class EntityManager(object):
     """
     A class managing the registration and distribution of class objects that inherit from Entity.
@@ -33,8 +47,30 @@ class EntityManager(object):
             return self._entityClasses[name]
         return super(EntityManager, self).__getitem__(self, name)           
 
+    def precompileViews(self):
+        """
+        Compiles and caches every template referenced in the VIEWS of the registered entity classes.
+        """
+        for entityClass in self._entityClasses.values():
+            for entityView in entityClass.VIEWS.values():
+                view.preloadTemplates(entityView.getTemplateNames())
+
 entities = EntityManager()
 
+_BULK_CONVERTERS = {structs.Types.INT: int, structs.Types.FLOAT: float}
+
+class _NullLock(object):
+    """
+    A stand-in for a lock, for entities whose changes need no serializing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        return False
+
+_NULL_LOCK = _NullLock()
+
 class EntityMetaclass(type):
     """
     A metaclass for entities which will automatically populate FIELDS with additional fields given the reference definitions set in REFERENCES.
@@ -52,7 +88,13 @@ class EntityMetaclass(type):
                     field.attributes = filter(lambda x: x != structs.Attributes.AUTOINCREMENT, field.attributes)
                     dct["FIELDS"][primaryKey] = field
         dct["_ENTITIES"] = {}
+        #Each class gets its own type callback lists, so callbacks registered on one entity type are not run for every other type.
+        for callbackList in ("_INSERT_CALLBACKS", "_CHANGE_CALLBACKS", "_UPDATE_CALLBACKS", "_DELETE_CALLBACKS"):
+            dct.setdefault(callbackList, [])
         classObject = type.__new__(cls, name, bases, dct)
+        classObject._TYPE_HIERARCHY = tuple(filter(lambda x: "_INSERT_CALLBACKS" in x.__dict__, classObject.__mro__))
+        classObject._CODEC_FIELDS = tuple(filter(lambda x: classObject.FIELDS[x].codec is not None, classObject.FIELDS))
+        classObject._BINARY_FIELDS = tuple(filter(lambda x: classObject.FIELDS[x].fieldType == structs.Types.BLOB and classObject.FIELDS[x].codec is None, classObject.FIELDS))
         entities.registerEntityClass(classObject)
         return classObject
         
@@ -72,16 +114,28 @@ class Entity(object):
     
     TABLE = None
     PRIMARY = ()
+    SHARD_KEY = None
     UNIQUE = ()
+    FULLTEXT = ()
     FIELDS = {}
     REFERENCES = {}
     VIEWS = {}
+    VIEW_CACHE = None
+    DISPATCHER = None
+    EVENT_BUS = None
+    WRITE_BEHIND = None
+    VERSION_FIELD = None
+    CACHED_LOOKUPS = False
+    SHARED_CACHE = None
     
     _ENTITIES = {}
     _INSERT_CALLBACKS = []
     _CHANGE_CALLBACKS = []
     _UPDATE_CALLBACKS = []
     _DELETE_CALLBACKS = []
+    _TYPE_HIERARCHY = ()
+    _CODEC_FIELDS = ()
+    _BINARY_FIELDS = ()
 
     @classmethod
     def _getFromLocalCache(cls, obj):
@@ -118,6 +172,8 @@ class Entity(object):
         super(Entity, self).__setattr__('_data', {})
         super(Entity, self).__setattr__('_values', {})
         super(Entity, self).__setattr__('_referenceValues', {})
+        super(Entity, self).__setattr__('_deferredFields', set())
+        super(Entity, self).__setattr__('_changedFields', set())
         super(Entity, self).__setattr__('_flags', EntityFlags.NEW)
         super(Entity, self).__setattr__('_insertCallbacks', [])
         super(Entity, self).__setattr__('_changeCallbacks', [])
@@ -133,17 +189,22 @@ class Entity(object):
                 return                   
         self._isNew = False         
     
+    def _onLoad(self):
+        """
+        Invoked when the entity has been built from values selected from the database.
+        """
+        #Remove the NEW flag
+        self._flags = self._flags & (~EntityFlags.NEW)
+
     def _onInsert(self):
         """
         Invoked when the entity has been inserted into the database.
         """
         #Remove the NEW flag
         self._flags = self._flags & (~EntityFlags.NEW)
-        #Do callbacks
-        for callback in self._insertCallbacks:
-            callback(self)
-        self._onInsertType(self)
-        Entity._onInsertType(self)
+        self._changedFields.clear()
+        self._publishChange(EntityEvents.INSERT, self._values.keys())
+        self._dispatchEvent(EntityEvents.INSERT)
     
     @classmethod
     def _onInsertType(cls, obj):
@@ -153,18 +214,25 @@ class Entity(object):
         for callback in cls._INSERT_CALLBACKS:
             callback(obj)                    
     
+    def _getChangeLock(self):
+        """
+        Private method returning the lock serializing changes to the entity with the completion of its buffered writes, which runs on the
+        WRITE_BEHIND buffer's thread (see WriteBehindBuffer.entityLock), or a stand-in if it has no WRITE_BEHIND.
+        """
+        return self.WRITE_BEHIND.entityLock if self.WRITE_BEHIND is not None else _NULL_LOCK
+
     def _onChange(self, values):
         """
         Invoked when the entity has been changed locally.
         """
         if not self.isNew():
-            #Add the DIRTY flag
-            self._flags = self._flags | EntityFlags.DIRTY
-            #Do callbacks
-            for callback in self._changeCallbacks:
-                callback(self, values)
-            self._onChangeType(self, values)            
-            Entity._onChangeType(self, values)
+            with self._getChangeLock():
+                #Add the DIRTY flag
+                self._flags = self._flags | EntityFlags.DIRTY
+                self._changedFields.update(filter(lambda x: x in self.FIELDS or x in self.REFERENCES, values))
+            if self.VIEW_CACHE is not None:
+                self.VIEW_CACHE.evict(self)
+            self._dispatchEvent(EntityEvents.CHANGE, values)
     
     @classmethod
     def _onChangeType(cls, obj, values):
@@ -174,18 +242,58 @@ class Entity(object):
         for callback in cls._CHANGE_CALLBACKS:
             callback(obj, values)
 
-    def _onUpdate(self):
+    def _onUpdate(self, committed=False):
         """
-        Invoked when the entity has been updated in the database.
+        Invoked when the entity has been updated in the database, with committed set if the update is known to have been committed already.
         """
-        #Remove the DIRTY flag
-        self._flags = self._flags & (~EntityFlags.DIRTY)
-        #Do callbacks
-        for callback in self._updateCallbacks:
-            callback(self)
-        self._onUpdateType(self)
-        Entity._onUpdateType(self)
-    
+        with self._getChangeLock():
+            #Remove the DIRTY flag
+            self._flags = self._flags & (~EntityFlags.DIRTY)
+            changedFields = set(self._changedFields)
+            self._changedFields.clear()
+        self._notifyUpdate(changedFields, committed)
+
+    def _onWritten(self, values):
+        """
+        Invoked when the entity has been updated in the database with values copied from it earlier (e.g. by a write-behind buffer).
+        Fields changed since then are left to be written, so the entity stays DIRTY if there are any.
+        Runs under the change lock, so a field set on another thread meanwhile is either left to be written or set once the entity is marked updated.
+        """
+        with self._getChangeLock():
+            changed = set(filter(lambda x: x not in values or self._isChangedSince(x, values[x]), self._values.keys()))
+            changedFields = self._changedFields - changed
+            self._changedFields.clear()
+            if len(changed) > 0:
+                self._flags = self._flags | EntityFlags.DIRTY
+                self._changedFields.update(changed)
+            else:
+                #Remove the DIRTY flag
+                self._flags = self._flags & (~EntityFlags.DIRTY)
+        self._notifyUpdate(changedFields, True)
+
+    def _isChangedSince(self, name, value):
+        """
+        Private method returning whether a field's value differs from an earlier copy of it, a codec field decoded since it was copied not counting as changed.
+        """
+        current = self._values[name]
+        if current is value:
+            return False
+        if isinstance(value, compression.EncodedValue) and not isinstance(current, compression.EncodedValue):
+            return value.decode() != current
+        return current != value
+
+    def _notifyUpdate(self, changedFields, committed):
+        """
+        Private method evicting the updated entity from the caches, then publishing the fields changed and dispatching the update event.
+        """
+        if self.VIEW_CACHE is not None:
+            self.VIEW_CACHE.evict(self)
+        if self.SHARED_CACHE is not None:
+            self._invalidateShared(committed)
+        if len(changedFields) > 0:
+            self._publishChange(EntityEvents.UPDATE, changedFields)
+        self._dispatchEvent(EntityEvents.UPDATE)
+
     @classmethod
     def _onUpdateType(cls, obj):
         """
@@ -198,13 +306,14 @@ class Entity(object):
         """
         Invoked when the entity has been deleted from the database.
         """
+        if self.VIEW_CACHE is not None:
+            self.VIEW_CACHE.evict(self)
+        if self.SHARED_CACHE is not None:
+            self._invalidateShared()
         #Remove the NEW flag
         self._flags = self._flags & (~EntityFlags.NEW)
-        #Do callbacks
-        for callback in self._deleteCallbacks:
-            callback(self)
-        self._onDeleteType(self)
-        Entity._onDeleteType(self)
+        self._publishChange(EntityEvents.DELETE)
+        self._dispatchEvent(EntityEvents.DELETE)
     
     @classmethod
     def _onDeleteType(cls, obj):
@@ -214,12 +323,68 @@ class Entity(object):
         for callback in cls._DELETE_CALLBACKS:
             callback(obj)          
 
+    def _dispatchEvent(self, event, values=None):
+        """
+        Hands an event to the entity class' DISPATCHER (or dispatch.defaultDispatcher), which decides when and where the callbacks run.
+        """
+        dispatcher = self.DISPATCHER if self.DISPATCHER is not None else dispatch.defaultDispatcher
+        dispatcher.dispatch(event, self, values)
+
+    def _deliverEvent(self, event, values=None):
+        """
+        Runs the instance and type callbacks registered for an event. Invoked by the dispatcher.
+        """
+        if event == EntityEvents.INSERT:
+            for callback in self._insertCallbacks:
+                callback(self)
+            for classObject in self._TYPE_HIERARCHY:
+                classObject._onInsertType(self)
+        elif event == EntityEvents.CHANGE:
+            for callback in self._changeCallbacks:
+                callback(self, values)
+            for classObject in self._TYPE_HIERARCHY:
+                classObject._onChangeType(self, values)
+        elif event == EntityEvents.UPDATE:
+            for callback in self._updateCallbacks:
+                callback(self)
+            for classObject in self._TYPE_HIERARCHY:
+                classObject._onUpdateType(self)
+        elif event == EntityEvents.DELETE:
+            for callback in self._deleteCallbacks:
+                callback(self)
+            for classObject in self._TYPE_HIERARCHY:
+                classObject._onDeleteType(self)
+
+    def _invalidateShared(self, committed=False):
+        """
+        Private method removing the entity from the SHARED_CACHE, and again once its change is committed (unless it already is),
+        as other processes may cache the row as it was until then.
+        """
+        self.SHARED_CACHE.invalidate(type(self), self.uniqueID)
+        if not committed:
+            self._db.getCommitBuffer(self.SHARED_CACHE.invalidateEntries).append((type(self), self.uniqueID))
+
+    def _publishChange(self, event, fields=()):
+        """
+        Publishes a change record to the entity class' EVENT_BUS (or events.changes), if anything is subscribed to this entity type.
+        Within a transaction, the record is published once it commits.
+        """
+        bus = self.EVENT_BUS if self.EVENT_BUS is not None else events.changes
+        if bus.hasSubscribers(type(self)):
+            bus.publish(events.ChangeRecord(type(self), self._getPrimaries(), event, fields), self._db)
+
     def _getPrimaries(self):
         """
         Returns the current entity's primary field values
         """
         return dict(filter(lambda x: x[0] in self.PRIMARY, self._values.items()))
     
+    def _getPrimaryConditionals(self):
+        """
+        Returns a list of conditionals matching the current entity's primary field values.
+        """
+        return map(lambda x: structs.Conditional(x[0], x[1]), self._getPrimaries().items())
+
     def _getNonAutoPrimaries(self):
         """
         Returns the current entity's primary field values, ignoring fields that AUTOINCREMENT.
@@ -230,11 +395,47 @@ class Entity(object):
         """
         Returns a local unique ID based upon an entity's unique field values and non-auto primary field values.
         """
-        localUniques = self._getLocalUniques()        
+        return self._buildUniqueID(self._values)
+
+    @classmethod
+    def _buildUniqueID(cls, values):
+        """
+        Returns the local unique ID of an entity of 'cls' type with the given values, without building the entity.
+        """
+        localUniques = filter(lambda x: x in cls.UNIQUE or (x in cls.PRIMARY and not structs.Attributes.AUTOINCREMENT in cls.FIELDS[x].attributes), values)
         try:
-            return "__".join(map(lambda x: self._values[x], localUniques))
+            return "__".join(map(lambda x: "%s" % values[x], sorted(localUniques)))
         except:
             return ""
+
+    @classmethod
+    def _getCachedByConditionals(cls, db, conditionals):
+        """
+        Returns the cached entity matching conditionals, if they select a single entity by EQUAL on every local unique field, or None.
+        The identity map is searched if CACHED_LOOKUPS is set, then the SHARED_CACHE, whose values are built into an entity for db.
+        """
+        if conditionals is None:
+            return None
+        if isinstance(conditionals, structs.Conditional):
+            conditionals = [conditionals]
+        values = {}
+        for conditional in conditionals:
+            if not isinstance(conditional, structs.Conditional) or conditional.argument != structs.Condition.EQUAL:
+                return None
+            values[conditional.field] = conditional.value
+        localUniques = filter(lambda x: x in cls.UNIQUE or (x in cls.PRIMARY and not structs.Attributes.AUTOINCREMENT in cls.FIELDS[x].attributes), cls.FIELDS)
+        if len(localUniques) == 0 or sorted(values) != sorted(localUniques):
+            return None
+        uniqueID = cls._buildUniqueID(values)
+        obj = cls._ENTITIES.get(uniqueID) if cls.CACHED_LOOKUPS else None
+        if obj is None and cls.SHARED_CACHE is not None:
+            sharedValues = cls.SHARED_CACHE.get(cls, uniqueID)
+            if sharedValues is not None:
+                obj = cls(db, **cls._wrapEncodedValues(cls._wrapBinaryValues(db, sharedValues)))
+                obj._onLoad()
+        if obj is None or obj.isDeleted() or obj.isClosed():
+            return None
+        return obj
             
     def _getUniques(self):
         """
@@ -250,13 +451,20 @@ class Entity(object):
 
     def __getattr__(self, name):
         """
-        Retrieves an attribute.
+        Retrieves an attribute. The values attribute is the dictionary of the entity's field values, with codec fields decoded.
         """
         if name == "uniqueID":
             return self._getLocalUniqueID()
         elif name == "values":
-            return self._values
+            return self._decodeValues()
         elif name in self._values:
+            value = self._values[name]
+            if isinstance(value, compression.EncodedValue):
+                #Codec fields are decoded on first access only.
+                value = self._values[name] = value.decode()
+            return value
+        elif name in self._deferredFields:
+            self._loadDeferredValues()
             return self._values[name]
         elif name in self._referenceValues:
             return self._referenceValues[name]
@@ -281,7 +489,10 @@ class Entity(object):
             if name in (self.PRIMARY + self.UNIQUE):
                 raise AttributeError("Cannot set a primary or unique attribute value.")
                 return
-            self._values[name] = value
+            with self._getChangeLock():
+                self._values[name] = value
+                #A value set locally is no longer deferred, so loading the other deferred fields must not overwrite it.
+                self._deferredFields.discard(name)
         elif name in self.REFERENCES:
             expectedType = self.REFERENCES[name].referenceType
             actualType = type(value)
@@ -304,7 +515,9 @@ class Entity(object):
             raise Exception("Cannot set attributes - entity is closed.")
             return            
         if name in self.FIELDS:
-            self._values[name] = value
+            with self._getChangeLock():
+                self._values[name] = value
+                self._deferredFields.discard(name)
         elif name in self.REFERENCES:
             expectedType = self.REFERENCES[name].referenceType
             actualType = type(value)
@@ -326,13 +539,13 @@ class Entity(object):
         """
         Retrieves an item.
         """
-        return self.__getattr__(self, name)
+        return self.__getattr__(name)
     
     def __setitem__(self, name, value):
         """
         Sets an item.
         """
-        self.__setattr__(self, name, value)
+        self.__setattr__(name, value)
 
     def __delitem__(self, name):
         """
@@ -347,9 +560,112 @@ class Entity(object):
         uniques = self._getLocalUniques()
         conditions = []
         for k,v in uniques.items():
-            conditions.append(Conditional(k, v))                
+            conditions.append(structs.Conditional(k, v))                
         return self.selectOneBasic(self._db, conditions)
+
+    def _deferMissingValues(self):
+        """
+        Marks any fields not loaded by a projected select as deferred, so they are fetched on first access.
+        """
+        self._deferredFields.update(filter(lambda x: x not in self._values, self.FIELDS))
+
+    @instrumentation.entityScoped
+    def _loadDeferredValues(self):
+        """
+        Fetches all deferred fields in a single query, using the entity's primary field values as conditions.
+        Only fields still deferred once the query returns are merged, so values set locally in the meantime are kept.
+        """
+        keys = self._getPrimaries()
+        if len(keys) == 0:
+            keys = self._getLocalUniques()
+        if self.isClosed() or len(keys) == 0:
+            raise AttributeError("Cannot load deferred fields %s - entity has no primary or unique values." % ", ".join(self._deferredFields))
+        conditions = map(lambda x: structs.Conditional(x[0], x[1]), keys.items())
+        results = self._db.select(self.TABLE, list(self._deferredFields), conditions, None, 0, 1)
+        if len(results) == 0:
+            raise AttributeError("Cannot load deferred fields %s - entity no longer exists in the database." % ", ".join(self._deferredFields))
+        values = self._wrapEncodedValues(results[0])
+        self._values.update(filter(lambda x: x[0] in self._deferredFields, values.items()))
+        self._deferredFields.clear()
         
+    @classmethod
+    def _wrapEncodedValues(cls, values):
+        """
+        Private class method wrapping the stored values of codec fields in a dictionary of database values, so they are decoded on first access.
+        """
+        for name in cls._CODEC_FIELDS:
+            value = values.get(name)
+            if value is not None and not isinstance(value, compression.EncodedValue):
+                values[name] = compression.EncodedValue(value, cls.FIELDS[name].fieldType)
+        return values
+
+    def _decodeValues(self):
+        """
+        Private method decoding every codec field not yet accessed, returning the entity's values.
+        """
+        for name in self._CODEC_FIELDS:
+            value = self._values.get(name)
+            if isinstance(value, compression.EncodedValue):
+                self._values[name] = value.decode()
+        return self._values
+
+    @classmethod
+    def _getBinaryBytes(cls, values):
+        """
+        Private class method returning a dictionary of values with the values of BLOB fields as bytes, for pickling,
+        as drivers may return them as types which cannot be unpickled (e.g. buffers on Python 2).
+        """
+        if len(cls._BINARY_FIELDS) == 0:
+            return values
+        values = dict(values)
+        for name in cls._BINARY_FIELDS:
+            if values.get(name) is not None:
+                values[name] = blobs.toBytes(values[name])
+        return values
+
+    @classmethod
+    def _wrapBinaryValues(cls, db, values):
+        """
+        Private class method wrapping the values of BLOB fields in a dictionary of values stored as bytes (e.g. by a cache) as db returns them.
+        """
+        for name in cls._BINARY_FIELDS:
+            if values.get(name) is not None:
+                values[name] = db.binary(values[name])
+        return values
+
+    def _getEncodedValues(self):
+        """
+        Private method returning the entity's values with the values of codec fields encoded, and wrapped as they are when loaded.
+        """
+        if len(self._CODEC_FIELDS) == 0:
+            return self._values
+        values = dict(self._values)
+        for name in self._CODEC_FIELDS:
+            value = values.get(name)
+            if value is not None and not isinstance(value, compression.EncodedValue):
+                field = self.FIELDS[name]
+                values[name] = compression.EncodedValue(compression.encodeValue(field.codec, field.fieldType, value), field.fieldType)
+        return values
+
+    def _getStorageValues(self, changedOnly=False):
+        """
+        Private method returning the entity's values as written to the database, with the values of codec fields encoded.
+        If changedOnly is set, codec fields that have not been decoded since they were loaded are left out, as they cannot have changed.
+        """
+        if len(self._CODEC_FIELDS) == 0:
+            return self._values
+        values = dict(self._values)
+        for name in self._CODEC_FIELDS:
+            value = values.get(name)
+            if value is None:
+                continue
+            if changedOnly and isinstance(value, compression.EncodedValue):
+                del values[name]
+            else:
+                field = self.FIELDS[name]
+                values[name] = self._db.binary(compression.encodeValue(field.codec, field.fieldType, value))
+        return values
+
     def _mergeValues(self, dbValues):
         """
         Method for merging local values with database values upon first insert/update.
@@ -391,19 +707,101 @@ class Entity(object):
                 self._values[primaryKey] = referenceValue[primaryKey]           
     
     @classmethod
+    @instrumentation.entityScoped
     def buildTable(cls, db):
         """
         Build up a table in the database according to the Entity's definition.
         """
-        db.buildTable(cls.TABLE, cls.FIELDS, cls.PRIMARY, cls.UNIQUE)
+        db.buildTable(cls.TABLE, cls.FIELDS, cls.PRIMARY, cls.UNIQUE, cls.FULLTEXT)
         
     @classmethod
+    @instrumentation.entityScoped
     def dropTable(cls, db):
         """
         Drop the table in the database according to the Entity's definition.
         """
         db.dropTable(cls.TABLE)    
         
+    @classmethod
+    @instrumentation.entityScoped
+    def bulkLoad(cls, db, source, fields=None, chunkSize=10000):
+        """
+        Loads many rows straight into the Entity's table, without building entities, so no callbacks or change events are fired.
+        Source is either the path of a CSV file whose header row names the fields, or an iterable of dictionaries or of sequences of values for fields.
+        Dictionaries must all have the same keys (those of the first, unless fields is given), and a ValueError is raised for any that differs or names no field.
+        Values are validated against FIELDS (INT and FLOAT values are converted, with empty strings as NULL) and inserted with db.bulkInsert() in chunks of chunkSize rows.
+        Returns a dictionary with the number of rows loaded, the seconds taken and the rows loaded per second.
+        """
+        start = instrumentation.timer()
+        csvFile = None
+        if isinstance(source, basestring):
+            csvFile = open(source, "rb")
+            rows = csv.reader(csvFile)
+            fields = next(rows, None) if fields is None else fields
+        else:
+            rows = iter(source)
+        try:
+            first = next(rows, None)
+            if first is None:
+                count = 0
+            else:
+                if isinstance(first, dict):
+                    fields = sorted(first) if fields is None else fields
+                    rows = cls._iterDictRows(fields, itertools.chain((first,), rows))
+                else:
+                    rows = itertools.chain((first,), rows)
+                if fields is None:
+                    raise ValueError("Fields must be given to load rows of values")
+                count = db.bulkInsert(cls.TABLE, fields, cls._iterBulkRows(db, fields, rows), chunkSize)
+        finally:
+            if csvFile is not None:
+                csvFile.close()
+        seconds = instrumentation.timer() - start
+        return {"rows": count, "seconds": seconds, "rowsPerSecond": count / seconds if seconds > 0 else 0.0}
+
+    @staticmethod
+    def _iterDictRows(fields, rows):
+        """
+        Private generator turning dictionaries into sequences of values for fields, for bulkLoad(), raising ValueError if one's keys differ from fields.
+        """
+        for number, row in enumerate(rows):
+            if len(row) != len(fields) or not all(field in row for field in fields):
+                raise ValueError("Row %d has fields %s, expecting %s" % (number, ", ".join(sorted(row)), ", ".join(sorted(fields))))
+            yield map(row.__getitem__, fields)
+
+    @classmethod
+    def _iterBulkRows(cls, db, fields, rows):
+        """
+        Private generator validating and converting rows of values for fields against FIELDS, for bulkLoad(), encoding the values of codec fields for db.
+        """
+        converters = []
+        for field in fields:
+            if field not in cls.FIELDS:
+                raise ValueError("No field defined named '%s'" % field)
+            definition = cls.FIELDS[field]
+            notNull = structs.Attributes.NOT_NULL in definition.attributes and structs.Attributes.AUTOINCREMENT not in definition.attributes
+            converters.append((field, _BULK_CONVERTERS.get(definition.fieldType), notNull, definition if definition.codec is not None else None))
+        for number, row in enumerate(rows):
+            if len(row) != len(fields):
+                raise ValueError("Row %d has %d values for %d fields" % (number, len(row), len(fields)))
+            values = []
+            for (field, converter, notNull, codecField), value in zip(converters, row):
+                if converter is not None:
+                    if value == "":
+                        value = None
+                    if value is not None:
+                        try:
+                            value = converter(value)
+                        except ValueError:
+                            raise ValueError("Row %d has an invalid value %r for field '%s'" % (number, value, field))
+                if value is None and notNull:
+                    raise ValueError("Row %d has no value for NOT NULL field '%s'" % (number, field))
+                if codecField is not None and value is not None:
+                    value = db.binary(compression.encodeValue(codecField.codec, codecField.fieldType, value))
+                values.append(value)
+            yield values
+
+    @instrumentation.entityScoped
     def insert(self):
         """
         Inserts the entity into the database.
@@ -415,15 +813,16 @@ class Entity(object):
         except:        
             return False               
         try:
-            self._db.insert(self.TABLE, self._values)
-            self._values = self._pullDatabaseValues()
+            self._db.insert(self.TABLE, self._getStorageValues())
+            self._values = self._wrapEncodedValues(self._pullDatabaseValues())
         except:
-            self._mergeValues(self._pullDatabaseValues())
+            self._mergeValues(self._wrapEncodedValues(self._pullDatabaseValues()))
         finally:
             self._onInsert()        
             self._onUpdate()
             return True
         
+    @instrumentation.entityScoped
     def update(self):
         """
         Updates the entity in the database.
@@ -434,13 +833,22 @@ class Entity(object):
             self.insert()
         elif self.isDirty():
             try:
-                self._dereferenceValues()
+                with self._getChangeLock():
+                    self._dereferenceValues()
             except:
                 return False
-            self._db.update(self.TABLE, self._values, self._getPrimaries())
+            if self.WRITE_BEHIND is not None:
+                if not self._db.inTransaction():
+                    #The write is buffered, and the entity stays DIRTY until it is flushed.
+                    self.WRITE_BEHIND.add(self)
+                    return True
+                #Within a transaction the write (with any buffered changes) is made now, so it commits or rolls back with the transaction.
+                self.WRITE_BEHIND.discard(self)
+            self._db.update(self.TABLE, self._getStorageValues(True), self._getPrimaryConditionals())
         self._onUpdate()
         return True
     
+    @instrumentation.entityScoped
     def delete(self):
         """
         Deletes the entity from the database.
@@ -448,7 +856,9 @@ class Entity(object):
         if self.isDeleted() or self.isClosed():
             return False
         if not self.isNew():
-            self._db.delete(self.TABLE, self._getPrimaries())
+            if self.WRITE_BEHIND is not None:
+                self.WRITE_BEHIND.discard(self)
+            self._db.delete(self.TABLE, self._getPrimaryConditionals())
             self._onDelete()
             return self.close()
             
@@ -462,20 +872,102 @@ class Entity(object):
         self._flags = self._flags | EntityFlags.CLOSED
         self._removeFromLocalCache(self)
         return True
+
+    def _checkBlobField(self, field):
+        """
+        Private method raising an error unless a field can be streamed - a stored BLOB field without a codec.
+        """
+        if field not in self.FIELDS or self.FIELDS[field].fieldType != structs.Types.BLOB:
+            raise AttributeError("No BLOB field defined named '%s'" % field)
+        if self.FIELDS[field].codec is not None:
+            raise AttributeError("Cannot stream field '%s' - it is stored encoded by a codec." % field)
+        if self.isNew() or self.isDeleted() or self.isClosed():
+            raise Exception("Cannot stream field '%s' - entity is not stored." % field)
+
+    @instrumentation.entityScoped
+    def openBlob(self, field, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Opens a blobs.BlobReader over the stored value of a BLOB field, which reads it a chunk at a time rather than loading it into the entity.
+        Select entities with a projection leaving the field out (see select()) so it is not loaded with them either. Returns None if the value is NULL.
+        """
+        self._checkBlobField(field)
+        return self._db.openBlob(self.TABLE, field, self._getPrimaryConditionals(), chunkSize)
+
+    def copyBlobTo(self, field, target, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Streams the stored value of a BLOB field to a file-like object or a socket a chunk at a time, returning the number of bytes copied.
+        """
+        reader = self.openBlob(field, chunkSize)
+        if reader is None:
+            return 0
+        with reader:
+            return reader.copyTo(target)
+
+    @instrumentation.entityScoped
+    def writeBlob(self, field, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Writes the value of a BLOB field from a bytes-like or file-like source straight to the database a chunk at a time (see DBInterface.writeBlob()),
+        returning the number of bytes written. The field's value is then deferred, so it is only loaded again if accessed.
+        """
+        self._checkBlobField(field)
+        count = self._db.writeBlob(self.TABLE, field, self._getPrimaryConditionals(), source, chunkSize)
+        self._values.pop(field, None)
+        self._deferredFields.add(field)
+        if self.VIEW_CACHE is not None:
+            self.VIEW_CACHE.evict(self)
+        if self.SHARED_CACHE is not None:
+            self._invalidateShared()
+        return count
     
     @classmethod
-    def _buildJoinRecursive(cls):
+    def _buildProjection(cls, fields):
+        """
+        Returns the list of field names to select for the given projection, always including PRIMARY and UNIQUE fields so the entity can be identified and lazily completed.
+        Returns None if no projection was given, meaning every field is selected.
+        """
+        if fields is None:
+            return None
+        for field in fields:
+            if field not in cls.FIELDS:
+                raise AttributeError("No field defined named '%s'" % field)
+        required = tuple(fields) + cls.PRIMARY + cls.UNIQUE
+        return filter(lambda x: x in required, cls.FIELDS)
+
+    @classmethod
+    def _splitJoinProjection(cls, fields):
+        """
+        Splits a join projection into a dictionary of field names per table.
+        Unqualified names apply to the base table, while names of the form 'TABLE.field' apply to a referenced table.
+        Tables that are not mentioned have all of their fields selected.
+        """
+        if fields is None:
+            return None
+        projections = {}
+        for field in fields:
+            if "." in field:
+                table, field = field.split(".", 1)
+            else:
+                table = cls.TABLE
+            projections.setdefault(table, []).append(field)
+        return projections
+
+    @classmethod
+    def _buildJoinRecursive(cls, projections=None):
         """
         Method that recursively iterates over class REFERENCES, adding in field & table joins according to their PRIMARY fields.
+        If projections is given, only the projected fields of each mentioned table are selected.
         """
         joins = []
         fields = []
-        for field in cls.FIELDS:
+        projection = None
+        if projections is not None and cls.TABLE in projections:
+            projection = cls._buildProjection(projections[cls.TABLE])
+        for field in (cls.FIELDS if projection is None else projection):
             fields.append(structs.FieldIdentifier(cls.TABLE, field))            
         for key, value in cls.REFERENCES.items():
             fieldJoins = map(lambda x: structs.FieldJoin(x), value.referenceType.PRIMARY)
             joins.append(structs.TableJoin(cls.TABLE, value.referenceType.TABLE, fieldJoins))
-            newJoins, newFields = value.referenceType._buildJoinRecursive()
+            newJoins, newFields = value.referenceType._buildJoinRecursive(projections)
             joins = joins + newJoins
             fields = fields + newFields
         return joins, fields 
@@ -514,41 +1006,56 @@ class Entity(object):
         return (cls,) + tuple(map(lambda x: x.referenceType._buildReferenceList(), cls.REFERENCES.values()))
     
     @classmethod
-    def _buildObject(cls, db, values):
+    def _buildObject(cls, db, values, partial=False):
         """
         Start of a recursive method that builds objects hierarchically from a reference chain and a selectJoin query.
         """    
         chain = cls._buildReferenceChain()
-        object = Entity._buildObjectRecursive(db, chain, values)
+        object = Entity._buildObjectRecursive(db, chain, values, partial)
         return object
     
     @staticmethod
-    def _buildObjectRecursive(db, chain, values):
+    def _buildObjectRecursive(db, chain, values, partial=False):
         """
         Takes a chain, and builds up a set of field values for the current chain position and creates an entity object accordingly.
         Will build child objects first by recursively calling this method, which will be used to populate parent objects fully.
+        If partial is set, any fields missing from the values are deferred until first access.
         """
         classObject = chain[0]
         classValues = values[classObject.TABLE]
         for reference in chain[1]:
             fieldName = reference[0]
-            fieldValue = Entity._buildObjectRecursive(db, reference[1], values)
+            fieldValue = Entity._buildObjectRecursive(db, reference[1], values, partial)
             classValues[fieldName] = fieldValue
-        return classObject(db, **classValues)
+        object = classObject(db, **classObject._wrapEncodedValues(classValues))
+        object._onLoad()
+        if partial:
+            object._deferMissingValues()
+        return object
         
     @classmethod
-    def select(cls, db, conditionals=None, orderFields=None, offset=0, count=0):
+    def select(cls, db, conditionals=None, orderFields=None, offset=0, count=0, fields=None):
         """
         Class method which will return a list of entities of 'cls' type given certain options.
+        If fields is given, only those fields (plus PRIMARY and UNIQUE fields) are selected, and any other field is fetched on first access.
         """
         objects = []
+        partial = fields is not None
         if cls.REFERENCES is None or len(cls.REFERENCES) == 0:                
-            results = cls.selectBasic(db, conditionals, orderFields, offset, count)
+            #Taken before selecting, so rows invalidated while the query runs are not cached.
+            generation = cls.SHARED_CACHE.getGeneration() if cls.SHARED_CACHE is not None and not partial else None
+            results = cls.selectBasic(db, conditionals, orderFields, offset, count, fields)
             for result in results:
+                cls._wrapEncodedValues(result)
+                if generation is not None:
+                    cls.SHARED_CACHE.set(cls, result, generation)
                 newObject = cls(db, **result)
+                newObject._onLoad()
+                if partial:
+                    newObject._deferMissingValues()
                 objects.append(newObject)                
         else:
-            results = cls.selectJoinBasic(db, conditionals, orderFields, offset, count)
+            results = cls.selectJoinBasic(db, conditionals, orderFields, offset, count, fields)
             referenceList = cls._buildReferenceList()
             aliasMatch = re.compile("(.*)__(.*)")
             for result in results:
@@ -558,46 +1065,143 @@ class Entity(object):
                     if not matchResult[0] in values:
                         values[matchResult[0]] = {}
                     values[matchResult[0]][matchResult[1]] = value
-                objects.append(cls._buildObject(db, values))
+                objects.append(cls._buildObject(db, values, partial))
         return objects
     
     @classmethod
-    def selectOne(cls, db, conditionals=None):
+    def selectOne(cls, db, conditionals=None, fields=None):
         """
         Just like select(), but returns only the first result.
-        """
-        return cls.select(db, conditionals, None, 0, 1)[0]
+        If CACHED_LOOKUPS is set and the conditionals identify an entity already in the identity map (e.g. loaded from a snapshot), it is returned without a query,
+        as is an entity found in the SHARED_CACHE, if set.
+        """
+        if cls.CACHED_LOOKUPS or cls.SHARED_CACHE is not None:
+            obj = cls._getCachedByConditionals(db, conditionals)
+            if obj is not None:
+                return obj
+        return cls.select(db, conditionals, None, 0, 1, fields)[0]
     
     @classmethod
-    def selectBasic(cls, db, conditionals=None, orderFields=None, offset=0, count=0):
+    @instrumentation.entityScoped
+    def selectBasic(cls, db, conditionals=None, orderFields=None, offset=0, count=0, fields=None):
         """
         A method which will return a list of dictionaries given certain options.
         This does not automatically build up entities, so is useful only when working with lots of data in a raw manner.
+        If fields is given, only those fields (plus PRIMARY and UNIQUE fields) are selected.
         """
-        return db.select(cls.TABLE, None, conditionals, orderFields, offset, count)
+        return db.select(cls.TABLE, cls._buildProjection(fields), conditionals, orderFields, offset, count)
             
     @classmethod
-    def selectOneBasic(cls, db, conditionals=None):
+    def selectOneBasic(cls, db, conditionals=None, fields=None):
         """
         A method like selectBasic(), but returns only the first result.
         """
-        return cls.selectBasic(db, conditionals, None, 0, 1)[0]                  
+        return cls.selectBasic(db, conditionals, None, 0, 1, fields)[0]                  
     
     @classmethod
-    def selectJoinBasic(cls, db, conditionals=None, orderFields=None, offset=0, count=0):
+    @instrumentation.entityScoped
+    def selectJoinBasic(cls, db, conditionals=None, orderFields=None, offset=0, count=0, fields=None):
         """
         A method which will return a list of dictionaries given certain options, automatically joining on reference fields.
         This does not automatically build up entities, so is useful only when working with lots of data in a raw manner.
+        If fields is given, unqualified names restrict the base table's fields, and names of the form 'TABLE.field' restrict a referenced table's fields.
         """
-        joins, fields = cls._buildJoinRecursive()
-        return db.selectJoin(cls.TABLE, joins, fields, conditionals, orderFields, offset, count)            
+        joins, selectFields = cls._buildJoinRecursive(cls._splitJoinProjection(fields))
+        return db.selectJoin(cls.TABLE, joins, selectFields, conditionals, orderFields, offset, count)            
     
     @classmethod
-    def selectJoinOneBasic(cls, db, conditionals=None):
+    @instrumentation.entityScoped
+    def selectColumns(cls, db, fields=None, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        """
+        A method which will return an ordered dictionary of field name to a typed array of that field's values (see columnar.Column), given certain options.
+        Rows are fetched from the cursor in chunks of chunkSize and transposed straight into the arrays, so no dictionaries or entities are built,
+        which suits analytics over large tables. If fields is not given, every field is selected. The values of codec fields are decoded.
+        """
+        if fields is None:
+            fields = sorted(cls.FIELDS)
+        for field in fields:
+            if field not in cls.FIELDS:
+                raise AttributeError("No field defined named '%s'" % field)
+        chunks = db.selectTuples(cls.TABLE, fields, conditionals, orderFields, offset, count, chunkSize)
+        if len(filter(lambda x: x in cls._CODEC_FIELDS, fields)) > 0:
+            chunks = cls._iterDecodedChunks(fields, chunks)
+        return columnar.buildColumns(map(lambda x: (x, cls.FIELDS[x].fieldType), fields), chunks)
+
+    @classmethod
+    def _iterDecodedChunks(cls, fields, chunks):
+        """
+        Private class generator decoding the stored values of codec fields in chunks of row tuples of fields values.
+        """
+        codecIndices = filter(lambda x: fields[x] in cls._CODEC_FIELDS, range(len(fields)))
+        for rows in chunks:
+            decodedRows = []
+            for row in rows:
+                row = list(row)
+                for index in codecIndices:
+                    if row[index] is not None:
+                        row[index] = compression.EncodedValue(row[index], cls.FIELDS[fields[index]].fieldType).decode()
+                decodedRows.append(row)
+            yield decodedRows
+
+    @classmethod
+    def matchConditional(cls, query):
+        """
+        Returns a Condition.MATCH conditional matching a full-text query against the Entity's FULLTEXT fields, for use among the conditionals of select().
+        """
+        if len(cls.FULLTEXT) == 0:
+            raise AttributeError("Entity class '%s' declares no FULLTEXT fields" % cls.__name__)
+        return structs.Conditional(structs.FullTextIdentifier(cls.TABLE, cls.FULLTEXT), query, structs.Condition.MATCH)
+
+    @classmethod
+    @instrumentation.entityScoped
+    def search(cls, db, query, conditionals=None, offset=0, count=0, fields=None):
+        """
+        Class method which will return a list of entities of 'cls' type whose FULLTEXT fields match a full-text query, along with certain conditions,
+        most relevant first. Matches are found through the table's full-text index (see DBInterface.search()) rather than by scanning it as Condition.CONTAINS does.
+        If fields is given, only those fields (plus PRIMARY and UNIQUE fields) are selected, and any other field is fetched on first access.
+        """
+        cls.matchConditional(query)
+        partial = fields is not None
+        if cls.REFERENCES is None or len(cls.REFERENCES) == 0:
+            objects = []
+            for result in db.search(cls.TABLE, cls.FULLTEXT, query, cls._buildProjection(fields), conditionals, offset, count):
+                result.pop(db.RELEVANCE_FIELD, None)
+                newObject = cls(db, **cls._wrapEncodedValues(result))
+                newObject._onLoad()
+                if partial:
+                    newObject._deferMissingValues()
+                objects.append(newObject)
+            return objects
+        #Entities with references are selected with their joins by the primary values of the ranked matches, then put back in rank order.
+        ranked = db.search(cls.TABLE, cls.FULLTEXT, query, list(cls.PRIMARY), conditionals, offset, count)
+        if len(ranked) == 0:
+            return []
+        keys = map(lambda row: tuple(map(lambda x: row[x], cls.PRIMARY)), ranked)
+        if len(cls.PRIMARY) == 1:
+            keyConditionals = [structs.Conditional(cls.PRIMARY[0], map(lambda x: x[0], keys), structs.Condition.IN)]
+        else:
+            keyConditionals = [structs.ConditionalGroup(map(lambda key: structs.ConditionalGroup(map(structs.Conditional, cls.PRIMARY, key)), keys), structs.Condition.OR)]
+        ranks = dict(map(lambda x: (x[1], x[0]), enumerate(keys)))
+        objects = cls.select(db, keyConditionals, fields=fields)
+        return sorted(objects, key=lambda obj: ranks.get(tuple(map(lambda x: obj._values.get(x), cls.PRIMARY)), len(ranks)))
+
+    @classmethod
+    def parallelScan(cls, dbFactory, function, partitions=4, combine=None, conditionals=None, chunkSize=1000):
+        """
+        A method which scans the Entity's table across partitions worker processes, each given a range of the (INT) first PRIMARY field,
+        so row decoding and entity building use as many cores. Each worker opens its own database with dbFactory() (e.g. a read-only SQLite),
+        and calls function with an iterator over the entities of its range matching conditionals, selected chunkSize at a time.
+        The functions' results are returned as a list in key order, or passed to combine, whose result is returned.
+        dbFactory, function and the results must be picklable - module-level functions, for example.
+        """
+        return scan.parallelScan(cls, dbFactory, function, partitions, combine, conditionals, chunkSize)
+
+    @classmethod
+    def selectJoinOneBasic(cls, db, conditionals=None, fields=None):
         """
         A method like selectJoinBasic(), but returns only the first result.
         """
-        return cls.selectJoinBasic(db, conditionals, None, 0, 1)[0]    
+        return cls.selectJoinBasic(db, conditionals, None, 0, 1, fields)[0]    
     
     def view(self, viewMode):
         """
@@ -611,16 +1215,30 @@ class Entity(object):
         A private method for returning a view of an entity in a specific view mode.
         """
         if viewMode in cls.VIEWS:
+            if cls.VIEW_CACHE is not None:
+                return cls.VIEW_CACHE.render(obj, viewMode, lambda: cls.VIEWS[viewMode].invoke(obj))
             return cls.VIEWS[viewMode].invoke(obj)
         return ""        
     
+    @classmethod
+    def viewMany(cls, entities, viewMode, stream=False, chunkSize=None):
+        """
+        A method for returning the views of many entities of 'cls' type in a specific view mode, resolving the view once for the whole batch.
+        If stream is set, a generator of output chunks is returned instead of a string (see View.iterInvokeMany()).
+        """
+        if viewMode not in cls.VIEWS:
+            return iter(()) if stream else ""
+        if stream:
+            return cls.VIEWS[viewMode].iterInvokeMany(entities, chunkSize, cls.VIEW_CACHE, viewMode)
+        return cls.VIEWS[viewMode].invokeMany(entities, cls.VIEW_CACHE, viewMode)
+
     @classmethod
     def addToViewMode(cls, viewMode, viewCallback):
         """
         A public method for adding a callback to a specific view mode.
         """
         if viewMode not in cls.VIEWS:
-            cls.VIEWS[viewMode] = [viewCallback]
+            cls.VIEWS[viewMode] = view.View([viewCallback])
         else:
             cls.VIEWS[viewMode].viewCallbacks.append(viewCallback)
         
@@ -726,4 +1344,20 @@ class Entity(object):
         """
         Unregisters a 'delete' of 'cls' type callback.
         """
-        cls._DELETE_CALLBACKS.remove(callback)
\ No newline at end of file
+        cls._DELETE_CALLBACKS.remove(callback)
+
+    @classmethod
+    def subscribeChanges(cls, callback):
+        """
+        Subscribes a callback to batches of change records (see events.ChangeRecord) for entities of 'cls' type, published on the class' event bus.
+        """
+        bus = cls.EVENT_BUS if cls.EVENT_BUS is not None else events.changes
+        bus.subscribe(callback, (cls,))
+
+    @classmethod
+    def unsubscribeChanges(cls, callback):
+        """
+        Unsubscribes a change record callback.
+        """
+        bus = cls.EVENT_BUS if cls.EVENT_BUS is not None else events.changes
+        bus.unsubscribe(callback)
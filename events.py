@@ -0,0 +1,172 @@
+import collections
+import contextlib
+import logging
+import threading
+
+_logger = logging.getLogger("ezdb.events")
+
+class ChangeRecord(object):
+    """
+    A class that describes a change made to a row in the database: an insert, update or delete of an entity.
+    Fields holds the names of the fields written, which for updates is only those changed since the entity was last stored.
+    """
+    entityClass = None
+    table = None
+    primary = None
+    event = None
+    fields = ()
+    def __init__(self, entityClass, primary, event, fields=()):
+        self.entityClass = entityClass
+        self.table = entityClass.TABLE
+        self.primary = primary
+        self.event = event
+        self.fields = frozenset(fields)
+
+    def getKey(self):
+        """
+        Returns a key identifying the changed row.
+        """
+        return (self.entityClass, tuple(sorted(self.primary.items())))
+
+    def __repr__(self):
+        return "<ChangeRecord %s %s %r %s>" % (self.event, self.table, self.primary, sorted(self.fields))
+
+def _coalesce(previous, record):
+    """
+    Private function combining two records for the same row into one, or None if they cancel out.
+    """
+    if previous.event == "insert":
+        if record.event == "delete":
+            return None
+        return ChangeRecord(record.entityClass, record.primary, "insert", previous.fields | record.fields)
+    if record.event == "delete":
+        return record
+    return ChangeRecord(record.entityClass, record.primary, "update", previous.fields | record.fields)
+
+class EventBus(object):
+    """
+    A class publishing change records to subscribers, filtered by entity class.
+    Within batch() (e.g. around a transaction), records are buffered per thread and coalesced per row, and on exit each subscriber receives one list of the records it is interested in.
+    Outside of a batch, each record is delivered as soon as it is published.
+    Records published with a database in a transaction() are held until it commits, and delivered as one batch then, or discarded if it is rolled back.
+    """
+    def __init__(self):
+        self._subscribers = {}
+        self._allSubscribers = ()
+        self._state = threading.local()
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, entityClasses=None):
+        """
+        Subscribes a callback, invoked with a list of change records, to changes of the given entity classes (and their subclasses), or of all entities if None.
+        """
+        with self._lock:
+            if entityClasses is None:
+                self._allSubscribers = self._allSubscribers + (callback,)
+                return
+            for entityClass in entityClasses:
+                self._subscribers[entityClass] = self._subscribers.get(entityClass, ()) + (callback,)
+
+    def unsubscribe(self, callback):
+        """
+        Unsubscribes a callback from every entity class it was subscribed to.
+        """
+        with self._lock:
+            self._allSubscribers = tuple(filter(lambda x: x is not callback, self._allSubscribers))
+            for entityClass, callbacks in self._subscribers.items():
+                callbacks = tuple(filter(lambda x: x is not callback, callbacks))
+                if len(callbacks) > 0:
+                    self._subscribers[entityClass] = callbacks
+                else:
+                    del self._subscribers[entityClass]
+
+    def _getSubscribers(self, entityClass):
+        """
+        Private method returning the callbacks subscribed to an entity class.
+        """
+        subscribers = self._allSubscribers
+        for klass in entityClass.__mro__:
+            if klass in self._subscribers:
+                subscribers = subscribers + self._subscribers[klass]
+        return subscribers
+
+    def hasSubscribers(self, entityClass):
+        """
+        Returns whether any callback is subscribed to changes of an entity class, so publishers can skip building records nobody receives.
+        """
+        if len(self._allSubscribers) > 0:
+            return True
+        for klass in entityClass.__mro__:
+            if klass in self._subscribers:
+                return True
+        return False
+
+    def publish(self, record, db=None):
+        """
+        Publishes a change record, made through db if given, in which case it is held until the transaction db is in (if any) commits.
+        """
+        if db is not None and db.inTransaction():
+            db.getCommitBuffer(self._publishCommitted).append(record)
+            return
+        pending = getattr(self._state, "pending", None)
+        if pending is None:
+            self._deliver([record])
+            return
+        key = record.getKey()
+        if key in pending:
+            record = _coalesce(pending.pop(key), record)
+            if record is None:
+                return
+        pending[key] = record
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        A context manager buffering the records published on this thread within it, delivering them coalesced on exit.
+        Batches may be nested, in which case delivery happens when the outermost one exits. If it exits with an exception, the buffered records are discarded.
+        """
+        outermost = getattr(self._state, "pending", None) is None
+        if outermost:
+            self._state.pending = collections.OrderedDict()
+        try:
+            yield self
+        except:
+            if outermost:
+                self._state.pending = None
+            raise
+        if outermost:
+            pending = self._state.pending
+            self._state.pending = None
+            self._deliver(pending.values())
+
+    def _publishCommitted(self, records):
+        """
+        Private method publishing the records of a committed transaction as one batch.
+        """
+        with self.batch():
+            for record in records:
+                self.publish(record)
+
+    def _deliver(self, records):
+        """
+        Private method delivering records to their subscribers, one list per subscriber.
+        """
+        batches = []
+        for record in records:
+            for callback in self._getSubscribers(record.entityClass):
+                for batch in batches:
+                    if batch[0] is callback:
+                        batch[1].append(record)
+                        break
+                else:
+                    batches.append((callback, [record]))
+        for callback, batch in batches:
+            try:
+                callback(batch)
+            except Exception:
+                _logger.exception("Error in change subscriber %r", callback)
+
+"""
+The event bus used by entity classes that do not set EVENT_BUS.
+"""
+changes = EventBus()
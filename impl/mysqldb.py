@@ -1,24 +1,123 @@
+import collections
+
+from .. import blobs
 from .. import interface
 from .. import structs
 
 class MySQL(interface.DBInterface):
     """
     MySQL DB Implementation
+    The driver is given by implementation: pymysql, MySQLdb, or mysql.connector, which is told apart by having no cursors module,
+    and is connected with its own keyword arguments and asked for dictionary cursors with cursor(dictionary=True).
+    If preparedCacheSize is set, data statements are executed as server-side prepared statements, keeping up to preparedCacheSize statement handles
+    per connection (least recently used first out), which requires a driver whose connections provide cursor(prepared=True), that is mysql.connector.
     """
+    CONDITION_CACHE_SIZE = 1024
+    MULTI_ROW_INSERT_SIZE = 500
+    _PREPARABLE = ("SELECT", "INSERT", "UPDATE", "DELETE")
+    _conditionCache = {}
     _dbConnector = None
-    def __init__(self, implementation="pymysql", database, user, password=None, host="localhost"):
+    preparedCacheSize = 0
+    def __init__(self, database, user, password=None, host="localhost", implementation="pymysql", preparedCacheSize=0):
         """
         Initializer.
         """
         
         mysql = __import__(implementation, fromlist=['connect'])
-        cursors = __import__("%s.cursors" % implementation, fromlist=['DictCursor'])
+        try:
+            cursors = __import__("%s.cursors" % implementation, fromlist=['DictCursor'])
+        except ImportError:
+            cursors = None
+
+        if cursors is not None:
+            self._connect = lambda: mysql.connect(host=host,
+                                                  user=user,
+                                                  passwd=password,
+                                                  db=database,
+                                                  cursorclass=cursors.DictCursor)
+            self._cursorArguments = {}
+            #Tuples are streamed from the server rather than buffered where the driver offers an unbuffered cursor.
+            self._tupleCursorClass = getattr(cursors, "SSCursor", None) or getattr(cursors, "Cursor")
+        else:
+            self._connect = lambda: mysql.connect(host=host,
+                                                  user=user,
+                                                  password=password if password is not None else "",
+                                                  database=database)
+            self._cursorArguments = {"dictionary": True}
+            #mysql.connector cursors are unbuffered unless asked otherwise, so tuples are streamed from the server.
+            self._tupleCursorClass = None
+        self._dbConnector = self._connect()
+        self.preparedCacheSize = preparedCacheSize
+        self._preparedCursors = {}
+        if preparedCacheSize > 0:
+            try:
+                self._dbConnector.cursor(prepared=True).close()
+            except TypeError:
+                raise ValueError("Driver '%s' does not support server-side prepared statements" % implementation)
+
+    def _openConnector(self):
+        """
+        Private method opening a further connection for gathered calls.
+        """
+        return self._connect()
+
+    def _openCursor(self):
+        """
+        Private method opening a cursor returning rows as dictionaries.
+        """
+        return self._getConnector().cursor(**self._cursorArguments)
+
+    def _openTupleCursor(self):
+        """
+        Private method opening a cursor returning rows as tuples.
+        """
+        if self._tupleCursorClass is None:
+            return self._getConnector().cursor()
+        return self._getConnector().cursor(self._tupleCursorClass)
+
+    def _getPreparedCursor(self, connector, query):
+        """
+        Private method returning the prepared statement cursor for a query on a connection, evicting the least recently used one if the cache is full.
+        """
+        cursors = self._preparedCursors.get(id(connector))
+        if cursors is None:
+            cursors = collections.OrderedDict()
+            self._preparedCursors[id(connector)] = cursors
+        cursor = cursors.pop(query, None)
+        if cursor is None:
+            cursor = connector.cursor(prepared=True)
+            if len(cursors) >= self.preparedCacheSize:
+                cursors.popitem(False)[1].close()
+        cursors[query] = cursor
+        return cursor
+
+    def _closePreparedCursors(self, connector):
+        """
+        Private method closing the prepared statement cursors of a connection.
+        """
+        for cursor in self._preparedCursors.pop(id(connector), {}).values():
+            cursor.close()
 
-        self._dbConnector = mysql.connect(host=host,
-                                          user=user,
-                                          passwd=password, 
-                                          db=database,
-                                          cursorclass=cursors.DictCursor)
+    def _executeQuery(self, query, queryArguments, fetch):
+        """
+        Private method for executing a query, as a prepared statement if enabled, returning the fetched rows (or None) and the row count.
+        """
+        if self.preparedCacheSize <= 0 or not query.startswith(MySQL._PREPARABLE):
+            return super(MySQL, self)._executeQuery(query, queryArguments, fetch)
+        connector = self._getConnector()
+        cursor = self._getPreparedCursor(connector, query)
+        try:
+            cursor.execute(query, tuple(queryArguments))
+        except:
+            self._preparedCursors[id(connector)].pop(query, None)
+            cursor.close()
+            raise
+        if fetch:
+            #Prepared statement cursors return tuples, so rows are converted as DictCursor would.
+            columns = map(lambda x: x[0], cursor.description)
+            rows = map(lambda x: dict(zip(columns, x)), cursor.fetchall())
+            return rows, len(rows)
+        return None, cursor.rowcount
         
     @staticmethod
     def _getToken(value):
@@ -34,7 +133,7 @@ class MySQL(interface.DBInterface):
         """
         fields = []
         for k, v in values.items():
-            fieldType = v.fieldType
+            fieldType = v.getStorageType()
             if v.length is not None:
                 fieldType = "%s(%d)" % (fieldType, v.length)                            
             attributes = " ".join(v.attributes)
@@ -62,24 +161,32 @@ class MySQL(interface.DBInterface):
         """
         return "UNIQUE KEY `%s` (%s)" % ("_".join(unique), ", ".join(unique))
       
-    def buildTable(self, table, fields, primary, unique):
+    @staticmethod
+    def _getMatchExpression(fullText):
+        """
+        Private static method for returning SQL matching the FULLTEXT index over fullText fields against a query argument.
+        """
+        return "MATCH (%s) AGAINST (%s IN NATURAL LANGUAGE MODE)" % (", ".join(map(lambda x: "`%s`" % x, fullText)), MySQL._getToken(None))
+
+    def buildTable(self, table, fields, primary, unique, fullText=None):
+        """
+        Method for building a table definition, with a full-text index over the fullText fields if given (see search()).
+        The full-text index is a FULLTEXT key, which is only created along with the table.
+        """
         definitions = []
         definitions.append(MySQL._getFieldDefinition(fields))        
         if primary is not None and len(primary) > 0:        
             definitions.append(MySQL._getPrimaryDefinition(primary))
         if unique is not None and len(unique) > 0:
             definitions.append(MySQL._getUniqueDefinition(unique))        
+        if fullText is not None and len(fullText) > 0:
+            definitions.append("FULLTEXT KEY `%s_fulltext` (%s)" % (table, ", ".join(map(lambda x: "`%s`" % x, fullText))))
         query = "CREATE TABLE IF NOT EXISTS `%s` (%s)" % (table, ", ".join(definitions))
-        cursor = self._dbConnector.cursor()                
-        cursor.execute(query)
-        cursor.close()
-    buildTable.__doc__ = interface.DBInterface.buildTable.__doc__        
+        self._runQuery(query)
     
     def dropTable(self, table):
         query = "DROP TABLE IF EXISTS `%s`" % table
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query)
-        cursor.close()      
+        self._runQuery(query)
     dropTable.__doc__ = interface.DBInterface.dropTable.__doc__                    
 
     @staticmethod
@@ -112,6 +219,27 @@ class MySQL(interface.DBInterface):
         """
         return ", ".join(map(lambda x: "`%s` %s" % x, orderValues.items()))                
                         
+    @staticmethod
+    def _buildConditionalString(conditional):
+        """
+        Private static method for returning SQL of a single field conditional statement.
+        """
+        if isinstance(conditional, structs.ConditionalGroup):
+            if len(conditional.conditionals) == 0:
+                return "1=1" if conditional.condition == structs.Condition.AND else "0=1"
+            return "(%s)" % MySQL._buildConditionString(conditional.conditionals, " %s " % conditional.condition)
+        if conditional.argument in (structs.Condition.IN, structs.Condition.NOT_IN):
+            if len(conditional.value) == 0:
+                return "0=1" if conditional.argument == structs.Condition.IN else "1=1"
+            return "`%s` %s (%s)" % (conditional.field, conditional.argument, MySQL._buildValueTokenString(conditional.value))
+        if conditional.argument == structs.Condition.BETWEEN:
+            return "`%s` BETWEEN %s AND %s" % (conditional.field, MySQL._getToken(conditional.value[0]), MySQL._getToken(conditional.value[1]))
+        if conditional.argument in (structs.Condition.IS_NULL, structs.Condition.IS_NOT_NULL):
+            return "`%s` %s" % (conditional.field, conditional.argument)
+        if conditional.argument == structs.Condition.MATCH:
+            return MySQL._getMatchExpression(conditional.field.fieldNames)
+        return "`%s` %s %s" % (conditional.field, conditional.argument, MySQL._getToken(conditional.value))
+
     @staticmethod
     def _buildConditionString(conditionalValues, condition=" AND "):
         """
@@ -119,11 +247,24 @@ class MySQL(interface.DBInterface):
         """
         if conditionalValues is None:
             return ""
-        conditionals = []
-        for conditional in conditionalValues:
-            token = MySQL._getToken(conditional.value)
-            conditionals.append("`%s` %s %s" % (conditional.field, conditional.argument, token))
-        return condition.join(conditionals)    
+        return condition.join(map(MySQL._buildConditionalString, conditionalValues))
+
+    @staticmethod
+    def _buildConditions(conditionalValues):
+        """
+        Private static method for returning SQL of field conditional statements along with their query arguments.
+        The SQL is compiled once per conditional shape and cached, so only the arguments are rebuilt for repeated queries.
+        """
+        if isinstance(conditionalValues, (structs.Conditional, structs.ConditionalGroup)):
+            conditionalValues = [conditionalValues]
+        shape = structs.getConditionalShape(conditionalValues)
+        conditions = MySQL._conditionCache.get(shape)
+        if conditions is None:
+            if len(MySQL._conditionCache) >= MySQL.CONDITION_CACHE_SIZE:
+                MySQL._conditionCache.clear()
+            conditions = MySQL._buildConditionString(conditionalValues)
+            MySQL._conditionCache[shape] = conditions
+        return conditions, structs.getConditionalArguments(conditionalValues)
         
     def insert(self, table, values, *a):        
         queryArguments = []
@@ -132,53 +273,132 @@ class MySQL(interface.DBInterface):
         fields = MySQL._buildFieldString(values.keys())
         valuetokens = MySQL._buildValueTokenString(values.values())        
         query = "INSERT %s INTO `%s` (%s) VALUES (%s)" % (" ".join(a), table, fields, valuetokens)        
-        cursor = self._dbConnector.cursor()                
-        cursor.execute(query, queryArguments)
-        cursor.close()
+        self._runQuery(query, queryArguments)
     insert.__doc__ = interface.DBInterface.insert.__doc__                        
         
-    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+    def bulkInsert(self, table, fields, rows, chunkSize=10000):
+        """
+        Method for inserting many rows into a table, each a sequence of values for fields, committing every chunkSize rows (unless within a transaction()).
+        Returns the number of rows inserted. Rows are sent as multi-row INSERT statements of up to MULTI_ROW_INSERT_SIZE rows each.
+        """
+        fieldString = MySQL._buildFieldString(fields)
+        rowTokens = "(%s)" % MySQL._buildValueTokenString(fields)
+        queries = {}
+        count = 0
+        for chunk in MySQL._iterChunks(rows, chunkSize):
+            for i in range(0, len(chunk), self.MULTI_ROW_INSERT_SIZE):
+                statementRows = chunk[i:i + self.MULTI_ROW_INSERT_SIZE]
+                query = queries.get(len(statementRows))
+                if query is None:
+                    query = "INSERT INTO `%s` (%s) VALUES %s" % (table, fieldString, ", ".join([rowTokens] * len(statementRows)))
+                    queries[len(statementRows)] = query
+                queryArguments = []
+                for row in statementRows:
+                    queryArguments.extend(row)
+                self._runQuery(query, queryArguments)
+            if not self.inTransaction():
+                self._commit()
+            count += len(chunk)
+        return count
+
+    @staticmethod
+    def _buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count):
+        """
+        Private static method for returning the SQL of a select along with its query arguments.
+        """
         queryArguments = []
-        fields = MySQL._buildFieldString(selectFields)                
-        query = "SELECT %s FROM `%s`" % (fields, table)                  
-        
+        fields = MySQL._buildFieldString(selectFields)
+        query = "SELECT %s FROM `%s`" % (fields, table)
+
         if conditionals != None:
-            for conditional in conditionals:
-                queryArguments.append(conditional.value)                
-            conditions = MySQL._buildConditionString(conditionals)
-            query = "%s WHERE %s" % (query, conditions)
-                        
+            conditions, conditionArguments = MySQL._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                query = "%s WHERE %s" % (query, conditions)
+
         if orderFields is not None:
             orders = MySQL._buildOrderString(orderFields)
             query = "%s ORDER BY %s" % (query, orders)
-                        
+
         if offset > 0 or count > 0:
             query = "%s LIMIT %d, %d" % (query, int(offset), int(count))
-        
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)        
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows         
+        return query, queryArguments
+
+    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+        query, queryArguments = MySQL._buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count)
+        return self._runQuery(query, queryArguments, True)
     select.__doc__ = interface.DBInterface.select.__doc__
+
+    def selectTuples(self, table, selectFields, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        query, queryArguments = MySQL._buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count)
+        return self._iterQuery(query, queryArguments, chunkSize)
+    selectTuples.__doc__ = interface.DBInterface.selectTuples.__doc__
+
+    def search(self, table, fullText, query, selectFields=None, conditionals=None, offset=0, count=0):
+        """
+        Method for selecting the rows of a table whose full-text indexed fullText fields match a full-text query, along with certain conditions,
+        ordered by relevance (most relevant first). Each row's relevance is returned in its RELEVANCE_FIELD value, higher being more relevant.
+        The query is matched in natural language mode, so fullText must be the fields of the table's FULLTEXT key.
+        """
+        match = MySQL._getMatchExpression(fullText)
+        fields = MySQL._buildFieldString(selectFields)
+        queryArguments = [query, query]
+        sql = "SELECT %s, %s AS `%s` FROM `%s` WHERE %s" % (fields, match, self.RELEVANCE_FIELD, table, match)
+        if conditionals != None:
+            conditions, conditionArguments = MySQL._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                sql = "%s AND %s" % (sql, conditions)
+        sql = "%s ORDER BY `%s` DESC" % (sql, self.RELEVANCE_FIELD)
+        if offset > 0 or count > 0:
+            sql = "%s LIMIT %d, %d" % (sql, int(offset), int(count))
+        return self._runQuery(sql, queryArguments, True)
+
+    def openBlob(self, table, field, conditionals, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method opening a blobs.BlobReader over the BLOB value of a field in the first row of a table matching certain conditions,
+        which reads the value a range of up to chunkSize bytes at a time instead of loading it whole. Returns None if no row matches or the value is NULL.
+        Ranges are read with SUBSTRING() queries, so only a range at a time is sent by the server.
+        """
+        conditions, conditionArguments = MySQL._buildConditions(conditionals)
+        rows = self._runQuery("SELECT LENGTH(`%s`) AS `length` FROM `%s` WHERE %s LIMIT 1" % (field, table, conditions), conditionArguments, True)
+        if len(rows) == 0 or rows[0]["length"] is None:
+            return None
+        query = "SELECT SUBSTRING(`%s`, %%s, %%s) AS `chunk` FROM `%s` WHERE %s LIMIT 1" % (field, table, conditions)
+        return blobs.BlobReader(lambda offset, size: bytes(self._runQuery(query, [offset + 1, size] + conditionArguments, True)[0]["chunk"]), int(rows[0]["length"]), chunkSize)
+
+    def writeBlob(self, table, field, conditionals, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method writing the BLOB value of a field in the rows of a table matching certain conditions from a source, written chunkSize bytes at a time.
+        The source is a bytes-like object, sliced without copying, or a file-like object, read a chunk at a time. Returns the number of bytes written.
+        The value is emptied and each chunk appended with CONCAT(), so max_allowed_packet need only fit a chunk rather than the whole value.
+        """
+        conditions, conditionArguments = MySQL._buildConditions(conditionals)
+        self._runQuery("UPDATE `%s` SET `%s`='' WHERE %s" % (table, field, conditions), conditionArguments)
+        query = "UPDATE `%s` SET `%s`=CONCAT(`%s`, %%s) WHERE %s" % (table, field, field, conditions)
+        count = 0
+        for chunk in blobs.iterSourceChunks(source, chunkSize):
+            self._runQuery(query, [self.binary(blobs.toBytes(chunk))] + conditionArguments)
+            count += len(chunk)
+        return count
     
     def selectJoin(self, baseTable, joins, selectFields, conditionals=None, orderFields=None, offset=0, count=0):
         queryArguments = []
         fields = MySQL._buildFieldString(selectFields)                
-        query = "SELECT %s FROM `%s`" % (fields, table)
+        query = "SELECT %s FROM `%s`" % (fields, baseTable)
         
         if joins is not None and len(joins) > 0:
             joinElements = []
             for join in joins:
                 tableJoinStatement = "%s `%s` ON " % (join.joinType, join.rightTable)
                 joinElements.append(tableJoinStatement + (" AND ".join(map(lambda x: "`%s`.`%s`%s`%s`.`%s`" % (join.leftTable, x.leftField, x.argument, join.rightTable, x.rightField), join.fieldJoins))))
-            query = "%s %s" % (query, joinElements)                    
+            query = "%s %s" % (query, " ".join(joinElements))                    
         
         if conditionals != None:
-            for conditional in conditionals:
-                queryArguments.append(conditional.value)                
-            conditions = MySQL._buildConditionString(conditionals)
-            query = "%s WHERE %s" % (query, conditions)
+            conditions, conditionArguments = MySQL._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                query = "%s WHERE %s" % (query, conditions)
                         
         if orderFields is not None:
             orders = MySQL._buildOrderString(orderFields)
@@ -187,43 +407,35 @@ class MySQL(interface.DBInterface):
         if offset > 0 or count > 0:
             query = "%s LIMIT %d, %d" % (query, int(offset), int(count))
         
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)        
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows           
+        return self._runQuery(query, queryArguments, True)
     selectJoin.__doc__ = interface.DBInterface.selectJoin.__doc__                                
         
     def update(self, table, values, conditionals):
         queryArguments = []
         for value in values.values():
             queryArguments.append(value)
-        for conditional in conditionals:
-            queryArguments.append(conditional.value)
+        conditions, conditionArguments = MySQL._buildConditions(conditionals)
+        queryArguments.extend(conditionArguments)
         assignments = MySQL._buildAssignmentString(values)
-        conditions = MySQL._buildConditionString(conditionals)
         query = "UPDATE `%s` SET %s WHERE %s" % (table, assignments, conditions)
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)
-        cursor.close()        
+        self._runQuery(query, queryArguments)
     update.__doc__ = interface.DBInterface.update.__doc__                        
         
     def delete(self, table, conditionals):
-        queryArguments = []
-        for conditional in conditionals:
-            queryArguments.append(conditional.value)
-        conditions = MySQL._buildConditionString(conditionals)
+        conditions, queryArguments = MySQL._buildConditions(conditionals)
         query = "DELETE FROM `%s` WHERE %s" % (table, conditions)
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)
-        cursor.close()        
+        self._runQuery(query, queryArguments)
     delete.__doc__ = interface.DBInterface.delete.__doc__                        
         
     def refresh(self):
-        self._dbConnector.commit()
+        self._requestCommit()
     refresh.__doc__ = interface.DBInterface.refresh.__doc__                        
         
     def close(self):
-        self._dbConnector.commit()
+        self._closePreparedCursors(self._dbConnector)
+        #Closing the pooled connections releases their statement handles.
+        self._closeConnectors()
+        self._preparedCursors.clear()
+        self._commit()
         self._dbConnector.close()
     close.__doc__ = interface.DBInterface.close.__doc__                                        
\ No newline at end of file
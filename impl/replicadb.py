@@ -0,0 +1,188 @@
+import contextlib
+import itertools
+import threading
+
+from .. import blobs
+from .. import interface
+from .. import instrumentation
+from .. import structs
+
+"""
+Enum of the policies for choosing the replica serving a read:
+ROUND_ROBIN cycles through the replicas, and LEAST_LOADED picks the one with the fewest reads in progress.
+"""
+Selection = structs.enum(ROUND_ROBIN="roundrobin", LEAST_LOADED="leastloaded")
+
+class ReplicaRouter(interface.DBInterface):
+    """
+    Read-replica routing DB Implementation, wrapping a primary database and any number of replicas of it.
+    Writes go to the primary, and reads go to a replica chosen by the selection policy (see Selection).
+    Reads issued on the same thread (session) within readYourWritesWindow seconds of a write go to the primary, so a session always sees its own writes
+    despite replication lag. A window of None keeps the session on the primary for good once it has written.
+    """
+    selection = Selection.ROUND_ROBIN
+    readYourWritesWindow = None
+    def __init__(self, primary, replicas, selection=Selection.ROUND_ROBIN, readYourWritesWindow=1.0):
+        """
+        Initializer.
+        """
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.selection = selection
+        self.readYourWritesWindow = readYourWritesWindow
+        self._roundRobin = itertools.cycle(range(len(self.replicas)))
+        self._load = [0] * len(self.replicas)
+        self._lock = threading.Lock()
+        self._session = threading.local()
+
+    def _getDatabases(self):
+        """
+        Private method returning the primary and every replica.
+        """
+        return [self.primary] + self.replicas
+
+    def _markWrite(self):
+        """
+        Private method recording that this session has written to the primary.
+        """
+        self._session.lastWrite = instrumentation.timer()
+
+    def _readsFromPrimary(self):
+        """
+        Private method returning whether this session's reads must go to the primary.
+        """
+        if len(self.replicas) == 0 or getattr(self._session, "pinned", 0) > 0:
+            return True
+        lastWrite = getattr(self._session, "lastWrite", None)
+        if lastWrite is None:
+            return False
+        if self.readYourWritesWindow is None:
+            return True
+        return instrumentation.timer() - lastWrite < self.readYourWritesWindow
+
+    def _read(self, method, *a):
+        """
+        Private method calling a read method on the primary or a replica, as this session and the selection policy dictate.
+        """
+        if self._readsFromPrimary():
+            return getattr(self.primary, method)(*a)
+        with self._lock:
+            if self.selection == Selection.LEAST_LOADED:
+                index = min(range(len(self.replicas)), key=lambda x: self._load[x])
+            else:
+                index = next(self._roundRobin)
+            self._load[index] += 1
+        try:
+            return getattr(self.replicas[index], method)(*a)
+        finally:
+            with self._lock:
+                self._load[index] -= 1
+
+    def _write(self, method, *a):
+        """
+        Private method calling a write method on the primary.
+        """
+        self._markWrite()
+        return getattr(self.primary, method)(*a)
+
+    @contextlib.contextmanager
+    def usePrimary(self):
+        """
+        A context manager sending every read this session issues within it to the primary.
+        """
+        self._session.pinned = getattr(self._session, "pinned", 0) + 1
+        try:
+            yield self
+        finally:
+            self._session.pinned -= 1
+
+    def forgetWrites(self):
+        """
+        Ends this session's read-your-writes window, e.g. once its writes are known to have replicated.
+        """
+        self._session.lastWrite = None
+
+    def buildTable(self, table, fields, primary=None, unique=None, fullText=None):
+        return self._write("buildTable", table, fields, primary, unique, fullText)
+
+    def dropTable(self, table):
+        return self._write("dropTable", table)
+
+    def insert(self, table, values):
+        return self._write("insert", table, values)
+
+    def bulkInsert(self, table, fields, rows, chunkSize=10000):
+        return self._write("bulkInsert", table, fields, rows, chunkSize)
+
+    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+        return self._read("select", table, selectFields, conditionals, orderFields, offset, count)
+
+    def selectJoin(self, baseTable, joins, selectFields, conditionals=None, orderFields=None, offset=0, count=0):
+        return self._read("selectJoin", baseTable, joins, selectFields, conditionals, orderFields, offset, count)
+
+    def selectTuples(self, table, selectFields, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        return self._read("selectTuples", table, selectFields, conditionals, orderFields, offset, count, chunkSize)
+
+    def search(self, table, fullText, query, selectFields=None, conditionals=None, offset=0, count=0):
+        return self._read("search", table, fullText, query, selectFields, conditionals, offset, count)
+
+    def update(self, table, values, conditionals):
+        return self._write("update", table, values, conditionals)
+
+    def delete(self, table, conditionals):
+        return self._write("delete", table, conditionals)
+
+    def openBlob(self, table, field, conditionals, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        return self._read("openBlob", table, field, conditionals, chunkSize)
+
+    def writeBlob(self, table, field, conditionals, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        return self._write("writeBlob", table, field, conditionals, source, chunkSize)
+
+    def refresh(self):
+        for db in self._getDatabases():
+            db.refresh()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A context manager running a transaction on the primary (see DBInterface.transaction), with this session's reads sent to the primary within it.
+        """
+        self._markWrite()
+        with self.primary.transaction():
+            with self.usePrimary():
+                yield self
+        self._markWrite()
+
+    def inTransaction(self):
+        return self.primary.inTransaction()
+
+    def getCommitBuffer(self, callback):
+        return self.primary.getCommitBuffer(callback)
+
+    def _runPooled(self, function):
+        return self.primary._runPooled(function)
+    _runPooled.__doc__ = interface.DBInterface._runPooled.__doc__
+
+    def binary(self, data):
+        return self.primary.binary(data)
+
+    def setGroupCommit(self, maxCommits=None, maxDelay=None):
+        self.primary.setGroupCommit(maxCommits, maxDelay)
+
+    def flushCommits(self):
+        self.primary.flushCommits()
+
+    def getCommitStatistics(self):
+        return self.primary.getCommitStatistics()
+
+    def close(self):
+        for db in self._getDatabases():
+            db.close()
+
+    def registerQueryHook(self, hook):
+        for db in self._getDatabases():
+            db.registerQueryHook(hook)
+
+    def unregisterQueryHook(self, hook):
+        for db in self._getDatabases():
+            db.unregisterQueryHook(hook)
@@ -0,0 +1,344 @@
+import contextlib
+import sys
+import threading
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from .. import blobs
+from .. import interface
+from .. import instrumentation
+from .. import structs
+
+class ShardedDB(interface.DBInterface):
+    """
+    Sharding DB Implementation, partitioning every table across several databases (e.g. SQLite or MySQL instances).
+    Rows are placed by a hash of their shard key, which is the SHARD_KEY of the entity owning the table (its PRIMARY by default), or given per table with shardKeys.
+    Inserts, updates setting the shard key fields, and updates, deletes and selects whose conditionals fix every shard key field with EQUAL, go to a single shard.
+    Shard key fields cannot be changed, as that would move rows between shards.
+    Other statements fan out to every shard in parallel, with selects merged to respect orderFields, offset and count.
+    Joins are run on each shard independently, so joined tables must be sharded so that related rows are on the same shard.
+    SQLite shards must be opened with checkSameThread=False, as fanned-out statements run on worker threads.
+    """
+    def __init__(self, shards, shardKeys=None):
+        """
+        Initializer.
+        """
+        self.shards = list(shards)
+        self._shardKeys = dict(shardKeys) if shardKeys is not None else {}
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pooledState = threading.local()
+
+    def registerEntity(self, entityClass):
+        """
+        Registers the shard key of an entity class' table.
+        """
+        self._shardKeys[entityClass.TABLE] = tuple(entityClass.SHARD_KEY if entityClass.SHARD_KEY is not None else entityClass.PRIMARY)
+
+    def _getShardKey(self, table):
+        """
+        Private method returning the shard key fields of a table, or None if it is not known.
+        The entity class issuing the current statement is registered on first use.
+        """
+        shardKey = self._shardKeys.get(table)
+        if shardKey is None:
+            entityClass = instrumentation.getEntityClass()
+            if entityClass is not None and entityClass.TABLE == table:
+                self.registerEntity(entityClass)
+                shardKey = self._shardKeys[table]
+        return shardKey
+
+    def getShardIndex(self, keyValues):
+        """
+        Returns the index of the shard holding the row with the given shard key values.
+        Values are hashed as UTF-8, so unicode keys with non-ASCII characters are placed like any other.
+        """
+        keyParts = map(lambda x: x if isinstance(x, bytes) else (u"%s" % x).encode("utf-8"), keyValues)
+        return (zlib.crc32(b"\x1f".join(keyParts)) & 0xffffffff) % len(self.shards)
+
+    def _getValuesShard(self, table, values):
+        """
+        Private method returning the shard a row's values place it on.
+        """
+        shardKey = self._getShardKey(table)
+        if shardKey is None or len(shardKey) == 0:
+            raise ValueError("No shard key is known for table '%s'" % table)
+        missing = filter(lambda x: values.get(x) is None, shardKey)
+        if len(missing) > 0:
+            raise ValueError("Shard key fields %s of table '%s' must be set to insert" % (", ".join(missing), table))
+        return self.shards[self.getShardIndex(map(lambda x: values[x], shardKey))]
+
+    def _getConditionalsShard(self, table, conditionals):
+        """
+        Private method returning the single shard that rows matching conditionals can be on, or None if they may be on any shard.
+        """
+        shardKey = self._getShardKey(table)
+        if shardKey is None or len(shardKey) == 0 or conditionals is None:
+            return None
+        if isinstance(conditionals, (structs.Conditional, structs.ConditionalGroup)):
+            conditionals = [conditionals]
+        keyValues = {}
+        for conditional in conditionals:
+            if isinstance(conditional, structs.Conditional) and conditional.argument == structs.Condition.EQUAL and conditional.field in shardKey:
+                keyValues[conditional.field] = conditional.value
+        if len(keyValues) < len(shardKey):
+            return None
+        return self.shards[self.getShardIndex(map(lambda x: keyValues[x], shardKey))]
+
+    def _fanOut(self, method, *a):
+        """
+        Private method calling a method on every shard in parallel, returning the list of their results.
+        """
+        return self._mapShards(lambda x: getattr(x, method)(*a))
+
+    def _mapShards(self, function):
+        """
+        Private method calling a function with every shard in parallel, returning the list of its results.
+        """
+        if len(self.shards) == 1 or getattr(self._pooledState, "active", False):
+            return map(function, self.shards)
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(len(self.shards))
+        return self._pool.map(function, self.shards)
+
+    @staticmethod
+    def _mergeRows(results, orderFields, offset, count, getValue=lambda row, field: row.get(field)):
+        """
+        Private static method merging rows selected from each shard, applying the ordering, offset and count across all of them.
+        """
+        rows = []
+        for result in results:
+            rows.extend(result)
+        if orderFields is not None:
+            #Stable sorts from the least to the most significant field give the combined ordering.
+            for field, ordering in reversed(list(orderFields.items())):
+                rows.sort(key=lambda x: getValue(x, field), reverse=("%s" % ordering).upper() == structs.Ordering.DESCENDING)
+        if offset > 0 or count > 0:
+            rows = rows[int(offset):int(offset) + int(count)]
+        return rows
+
+    def _selectAll(self, method, table, conditionals, orderFields, offset, count, *a):
+        """
+        Private method running a select on the one shard the conditionals allow, or on every shard with the results merged.
+        """
+        shard = self._getConditionalsShard(table, conditionals)
+        if shard is not None:
+            return getattr(shard, method)(table, *(a + (conditionals, orderFields, offset, count)))
+        #Each shard must return enough rows to fill the requested page after merging.
+        shardCount = int(offset) + int(count) if count > 0 else 0
+        results = self._fanOut(method, table, *(a + (conditionals, orderFields, 0, shardCount)))
+        return ShardedDB._mergeRows(results, orderFields, offset, count)
+
+    def buildTable(self, table, fields, primary=None, unique=None, fullText=None):
+        if self._getShardKey(table) is None and primary is not None and len(primary) > 0:
+            self._shardKeys[table] = tuple(primary)
+        self._fanOut("buildTable", table, fields, primary, unique, fullText)
+    buildTable.__doc__ = interface.DBInterface.buildTable.__doc__
+
+    def dropTable(self, table):
+        self._fanOut("dropTable", table)
+    dropTable.__doc__ = interface.DBInterface.dropTable.__doc__
+
+    def insert(self, table, values):
+        self._getValuesShard(table, values).insert(table, values)
+    insert.__doc__ = interface.DBInterface.insert.__doc__
+
+    def bulkInsert(self, table, fields, rows, chunkSize=10000):
+        shardKey = self._getShardKey(table)
+        if shardKey is None or len(shardKey) == 0:
+            raise ValueError("No shard key is known for table '%s'" % table)
+        missing = filter(lambda x: x not in fields, shardKey)
+        if len(missing) > 0:
+            raise ValueError("Shard key fields %s of table '%s' must be set to insert" % (", ".join(missing), table))
+        keyIndices = map(lambda x: list(fields).index(x), shardKey)
+        count = 0
+        for chunk in ShardedDB._iterChunks(rows, chunkSize):
+            shardRows = dict(map(lambda x: (x, []), self.shards))
+            for row in chunk:
+                shardRows[self.shards[self.getShardIndex(map(lambda x: row[x], keyIndices))]].append(row)
+            self._mapShards(lambda x: x.bulkInsert(table, fields, shardRows[x], chunkSize) if len(shardRows[x]) > 0 else 0)
+            count += len(chunk)
+        return count
+    bulkInsert.__doc__ = interface.DBInterface.bulkInsert.__doc__
+
+    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+        return self._selectAll("select", table, conditionals, orderFields, offset, count, selectFields)
+    select.__doc__ = interface.DBInterface.select.__doc__
+
+    def selectJoin(self, baseTable, joins, selectFields, conditionals=None, orderFields=None, offset=0, count=0):
+        return self._selectAll("selectJoin", baseTable, conditionals, orderFields, offset, count, joins, selectFields)
+    selectJoin.__doc__ = interface.DBInterface.selectJoin.__doc__
+
+    def selectTuples(self, table, selectFields, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        shard = self._getConditionalsShard(table, conditionals)
+        if shard is not None:
+            return shard.selectTuples(table, selectFields, conditionals, orderFields, offset, count, chunkSize)
+        if orderFields is None and offset == 0 and count == 0:
+            return self._chainTuples(table, selectFields, conditionals, chunkSize)
+        return self._mergeTuples(table, selectFields, conditionals, orderFields, offset, count, chunkSize)
+    selectTuples.__doc__ = interface.DBInterface.selectTuples.__doc__
+
+    def search(self, table, fullText, query, selectFields=None, conditionals=None, offset=0, count=0):
+        """
+        Method for selecting the rows of a table whose full-text indexed fullText fields match a full-text query, along with certain conditions,
+        ordered by relevance (most relevant first). Each row's relevance is returned in its RELEVANCE_FIELD value, higher being more relevant.
+        Rows from several shards are merged by relevance, which each shard scores against its own rows only.
+        """
+        shard = self._getConditionalsShard(table, conditionals)
+        if shard is not None:
+            return shard.search(table, fullText, query, selectFields, conditionals, offset, count)
+        shardCount = int(offset) + int(count) if count > 0 else 0
+        results = self._fanOut("search", table, fullText, query, selectFields, conditionals, 0, shardCount)
+        return ShardedDB._mergeRows(results, {self.RELEVANCE_FIELD: structs.Ordering.DESCENDING}, offset, count)
+
+    def _chainTuples(self, table, selectFields, conditionals, chunkSize):
+        """
+        Private generator streaming unordered tuples from each shard in turn.
+        """
+        for shard in self.shards:
+            for rows in shard.selectTuples(table, selectFields, conditionals, None, 0, 0, chunkSize):
+                yield rows
+
+    def _mergeTuples(self, table, selectFields, conditionals, orderFields, offset, count, chunkSize):
+        """
+        Private generator merging ordered or limited tuples from every shard, which requires holding each shard's rows in memory.
+        Order fields must be among selectFields.
+        """
+        shardCount = int(offset) + int(count) if count > 0 else 0
+        fieldIndices = dict(map(lambda x: (x[1], x[0]), enumerate(selectFields)))
+        results = self._mapShards(lambda x: [row for rows in x.selectTuples(table, selectFields, conditionals, orderFields, 0, shardCount, chunkSize) for row in rows])
+        rows = ShardedDB._mergeRows(results, orderFields, offset, count, lambda row, field: row[fieldIndices[field]])
+        for i in range(0, len(rows), chunkSize):
+            yield rows[i:i + chunkSize]
+
+    def update(self, table, values, conditionals):
+        shard = self._getConditionalsShard(table, conditionals)
+        shardKey = self._getShardKey(table)
+        if shardKey is not None and len(filter(lambda x: x in values, shardKey)) > 0:
+            #Shard key values are assumed to be unchanged (as when an entity writes back all of its values), which places the rows on their shard.
+            valuesShard = self._getValuesShard(table, values)
+            if shard is not None and valuesShard is not shard:
+                raise ValueError("Updates to table '%s' cannot move rows between shards" % table)
+            shard = valuesShard
+        if shard is not None:
+            shard.update(table, values, conditionals)
+        else:
+            self._fanOut("update", table, values, conditionals)
+    update.__doc__ = interface.DBInterface.update.__doc__
+
+    def delete(self, table, conditionals):
+        shard = self._getConditionalsShard(table, conditionals)
+        if shard is not None:
+            shard.delete(table, conditionals)
+        else:
+            self._fanOut("delete", table, conditionals)
+    delete.__doc__ = interface.DBInterface.delete.__doc__
+
+    def openBlob(self, table, field, conditionals, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        shard = self._getConditionalsShard(table, conditionals)
+        for shard in ([shard] if shard is not None else self.shards):
+            reader = shard.openBlob(table, field, conditionals, chunkSize)
+            if reader is not None:
+                return reader
+        return None
+    openBlob.__doc__ = interface.DBInterface.openBlob.__doc__
+
+    def writeBlob(self, table, field, conditionals, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        shard = self._getConditionalsShard(table, conditionals)
+        if shard is not None:
+            return shard.writeBlob(table, field, conditionals, source, chunkSize)
+        if hasattr(source, "read"):
+            #Every shard is written, so a file-like source is read once up front.
+            source = b"".join(map(blobs.toBytes, blobs.iterSourceChunks(source, chunkSize)))
+        return max(self._fanOut("writeBlob", table, field, conditionals, source, chunkSize))
+    writeBlob.__doc__ = interface.DBInterface.writeBlob.__doc__
+
+    def refresh(self):
+        self._fanOut("refresh")
+    refresh.__doc__ = interface.DBInterface.refresh.__doc__
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A context manager running a transaction on every shard (see DBInterface.transaction).
+        The shards are committed one after another, so a transaction is atomic on each shard but not across shards.
+        """
+        transactions = []
+        try:
+            for shard in self.shards:
+                shardTransaction = shard.transaction()
+                shardTransaction.__enter__()
+                transactions.append(shardTransaction)
+            yield self
+        except:
+            exceptionInfo = sys.exc_info()
+            for shardTransaction in reversed(transactions):
+                try:
+                    shardTransaction.__exit__(*exceptionInfo)
+                except Exception:
+                    pass
+            raise
+        for shardTransaction in transactions:
+            shardTransaction.__exit__(None, None, None)
+
+    def inTransaction(self):
+        return self.shards[0].inTransaction()
+
+    def getCommitBuffer(self, callback):
+        #The last shard commits last, so its buffers are handed over once every shard has committed.
+        return self.shards[-1].getCommitBuffer(callback)
+
+    def _runPooled(self, function):
+        """
+        Private method calling function with the statements it issues on this thread run on a pooled connection of each shard (see DBInterface._runPooled).
+        Statements fanned out within it run on the calling thread, as pooled connections are held per thread.
+        """
+        def run(shards):
+            if len(shards) == 0:
+                self._pooledState.active = True
+                try:
+                    function()
+                finally:
+                    self._pooledState.active = False
+                return True
+            ran = []
+            if not shards[0]._runPooled(lambda: ran.append(run(shards[1:]))):
+                return False
+            return ran[0]
+        return run(self.shards)
+
+    def binary(self, data):
+        return self.shards[0].binary(data)
+
+    def setGroupCommit(self, maxCommits=None, maxDelay=None):
+        for shard in self.shards:
+            shard.setGroupCommit(maxCommits, maxDelay)
+
+    def flushCommits(self):
+        for shard in self.shards:
+            shard.flushCommits()
+
+    def getCommitStatistics(self):
+        statistics = {"refreshes": 0, "commits": 0, "pending": 0}
+        for shard in self.shards:
+            for key, value in shard.getCommitStatistics().items():
+                statistics[key] += value
+        return statistics
+
+    def close(self):
+        self._fanOut("close")
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+    close.__doc__ = interface.DBInterface.close.__doc__
+
+    def registerQueryHook(self, hook):
+        for shard in self.shards:
+            shard.registerQueryHook(hook)
+
+    def unregisterQueryHook(self, hook):
+        for shard in self.shards:
+            shard.unregisterQueryHook(hook)
@@ -1,5 +1,6 @@
 import sqlite3
 
+from .. import blobs
 from .. import interface
 from .. import structs
 
@@ -7,14 +8,73 @@ class SQLite(interface.DBInterface):
     """
     SQLite DB Implementation
     """
+    CONDITION_CACHE_SIZE = 1024
+    _conditionCache = {}
     _dbConnector = None
-    def __init__(self, database):
+    def __init__(self, database, checkSameThread=True, readOnly=False):
         """
         Initializer.
+        If checkSameThread is not set, the connection may be used from threads other than the one creating it, which must then serialize its use.
+        If readOnly is set, connections refuse to change the database (with the query_only pragma), as suits scanning workers.
         """
-        self._dbConnector = sqlite3.connect(database)
-        self._dbConnector.row_factory = SQLite._sqliteRowFactory
+        self._database = database
+        self._readOnly = readOnly
+        self._commitsFromAnyThread = not checkSameThread
+        self._dbConnector = self._connect(checkSameThread)
+
+    def _connect(self, checkSameThread):
+        """
+        Private method opening a connection returning rows as dictionaries.
+        """
+        connector = sqlite3.connect(self._database, check_same_thread=checkSameThread)
+        connector.row_factory = SQLite._sqliteRowFactory
+        if self._readOnly:
+            connector.execute("PRAGMA query_only=ON")
+        return connector
+
+    def _beginTransaction(self):
+        """
+        Private method beginning a transaction. The connection is switched to autocommit mode for its duration, so the sqlite3 module does not
+        implicitly commit before SAVEPOINT statements, and the transaction is begun explicitly.
+        """
+        self._commit()
+        self._isolationLevel = self._dbConnector.isolation_level
+        self._dbConnector.isolation_level = None
+        self._runQuery("BEGIN")
+
+    def _commitTransaction(self):
+        try:
+            self._runQuery("COMMIT")
+        finally:
+            self._dbConnector.isolation_level = self._isolationLevel
+        self._commitCount += 1
+
+    def _rollbackTransaction(self):
+        try:
+            self._runQuery("ROLLBACK")
+        finally:
+            self._dbConnector.isolation_level = self._isolationLevel
+
+    def _openConnector(self):
+        """
+        Private method opening a further connection for gathered calls. In-memory databases cannot be shared between connections, so None is returned for them.
+        """
+        if self._database == ":memory:" or self._database == "":
+            return None
+        return self._connect(False)
         
+    def _openTupleCursor(self):
+        """
+        Private method opening a cursor returning rows as tuples, bypassing the dictionary row factory.
+        """
+        cursor = self._getConnector().cursor()
+        cursor.row_factory = None
+        return cursor
+
+    def binary(self, data):
+        return sqlite3.Binary(data)
+    binary.__doc__ = interface.DBInterface.binary.__doc__
+
     @staticmethod
     def _sqliteRowFactory(cursor, row):
         """
@@ -32,7 +92,7 @@ class SQLite(interface.DBInterface):
         """
         fields = []
         for k, v in values.items():
-            fieldType = v.fieldType
+            fieldType = v.getStorageType()
             if v.length is not None:
                 fieldType = "%s(%d)" % (fieldType, v.length)                
             attributes = []
@@ -65,7 +125,35 @@ class SQLite(interface.DBInterface):
         """
         return "UNIQUE (%s)" % ("_".join(unique), ", ".join(unique))
       
-    def buildTable(self, table, fields, primary, unique):
+    @staticmethod
+    def _getFullTextTable(table):
+        """
+        Private static method returning the name of a table's FTS5 shadow table.
+        """
+        return "%s__fts" % table
+
+    def _buildFullText(self, table, fullText):
+        """
+        Private method creating a table's FTS5 shadow table over the fullText fields, which indexes the table's own rows (as an external content table),
+        along with triggers keeping it in sync with inserts, updates and deletes. A new shadow table is built from the rows already in the table.
+        """
+        ftsTable = SQLite._getFullTextTable(table)
+        if len(self._runQuery("SELECT `name` FROM `sqlite_master` WHERE `type`='table' AND `name`=?", (ftsTable,), True)) > 0:
+            return
+        columns = ", ".join(map(lambda x: "`%s`" % x, fullText))
+        insertNew = "INSERT INTO `%s` (`rowid`, %s) VALUES (new.`rowid`, %s);" % (ftsTable, columns, ", ".join(map(lambda x: "new.`%s`" % x, fullText)))
+        deleteOld = "INSERT INTO `%s` (`%s`, `rowid`, %s) VALUES ('delete', old.`rowid`, %s);" % (ftsTable, ftsTable, columns, ", ".join(map(lambda x: "old.`%s`" % x, fullText)))
+        self._runQuery("CREATE VIRTUAL TABLE `%s` USING fts5(%s, content='%s')" % (ftsTable, columns, table))
+        self._runQuery("CREATE TRIGGER `%s_insert` AFTER INSERT ON `%s` BEGIN %s END" % (ftsTable, table, insertNew))
+        self._runQuery("CREATE TRIGGER `%s_delete` AFTER DELETE ON `%s` BEGIN %s END" % (ftsTable, table, deleteOld))
+        self._runQuery("CREATE TRIGGER `%s_update` AFTER UPDATE ON `%s` BEGIN %s %s END" % (ftsTable, table, deleteOld, insertNew))
+        self._runQuery("INSERT INTO `%s` (`%s`) VALUES ('rebuild')" % (ftsTable, ftsTable))
+
+    def buildTable(self, table, fields, primary, unique, fullText=None):
+        """
+        Method for building a table definition, with a full-text index over the fullText fields if given (see search()).
+        The full-text index is an FTS5 table named after the table with a '__fts' suffix, kept in sync by triggers.
+        """
         definitions = []
         definitions.append(SQLite._getFieldDefinition(fields))        
         if primary is not None and len(primary) > 0:        
@@ -73,16 +161,14 @@ class SQLite(interface.DBInterface):
         if unique is not None and len(unique) > 0:
             definitions.append(SQLite._getUniqueDefinition(unique))        
         query = "CREATE TABLE IF NOT EXISTS `%s` (%s)" % (table, ", ".join(definitions))
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query)
-        cursor.close()        
-    buildTable.__doc__ = interface.DBInterface.buildTable.__doc__        
+        self._runQuery(query)
+        if fullText is not None and len(fullText) > 0:
+            self._buildFullText(table, fullText)
     
     def dropTable(self, table):
+        self._runQuery("DROP TABLE IF EXISTS `%s`" % SQLite._getFullTextTable(table))
         query = "DROP TABLE IF EXISTS `%s`" % table
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query)
-        cursor.close()
+        self._runQuery(query)
     dropTable.__doc__ = interface.DBInterface.dropTable.__doc__        
         
     @staticmethod
@@ -122,6 +208,28 @@ class SQLite(interface.DBInterface):
         """
         return ", ".join(map(lambda x: "`%s` %s" % x, orderValues.items()))                
                         
+    @staticmethod
+    def _buildConditionalString(conditional):
+        """
+        Private static method for returning SQL of a single field conditional statement.
+        """
+        if isinstance(conditional, structs.ConditionalGroup):
+            if len(conditional.conditionals) == 0:
+                return "1=1" if conditional.condition == structs.Condition.AND else "0=1"
+            return "(%s)" % SQLite._buildConditionString(conditional.conditionals, " %s " % conditional.condition)
+        if conditional.argument in (structs.Condition.IN, structs.Condition.NOT_IN):
+            if len(conditional.value) == 0:
+                return "0=1" if conditional.argument == structs.Condition.IN else "1=1"
+            return "`%s` %s (%s)" % (conditional.field, conditional.argument, SQLite._buildValueTokenString(conditional.value))
+        if conditional.argument == structs.Condition.BETWEEN:
+            return "`%s` BETWEEN %s AND %s" % (conditional.field, SQLite._getToken(conditional.value[0]), SQLite._getToken(conditional.value[1]))
+        if conditional.argument in (structs.Condition.IS_NULL, structs.Condition.IS_NOT_NULL):
+            return "`%s` %s" % (conditional.field, conditional.argument)
+        if conditional.argument == structs.Condition.MATCH:
+            ftsTable = SQLite._getFullTextTable(conditional.field.tableName)
+            return "`%s`.`rowid` IN (SELECT `rowid` FROM `%s` WHERE `%s` MATCH %s)" % (conditional.field.tableName, ftsTable, ftsTable, SQLite._getToken(conditional.value))
+        return "`%s` %s %s" % (conditional.field, conditional.argument, SQLite._getToken(conditional.value))
+
     @staticmethod
     def _buildConditionString(conditionalValues, condition=" AND "):
         """
@@ -129,11 +237,24 @@ class SQLite(interface.DBInterface):
         """
         if conditionalValues is None:
             return ""
-        conditionals = []
-        for conditional in conditionalValues:
-            token = SQLite._getToken(conditional.value)
-            conditionals.append("`%s`%s%s" % (conditional.field, conditional.argument, token))
-        return condition.join(conditionals)         
+        return condition.join(map(SQLite._buildConditionalString, conditionalValues))
+
+    @staticmethod
+    def _buildConditions(conditionalValues):
+        """
+        Private static method for returning SQL of field conditional statements along with their query arguments.
+        The SQL is compiled once per conditional shape and cached, so only the arguments are rebuilt for repeated queries.
+        """
+        if isinstance(conditionalValues, (structs.Conditional, structs.ConditionalGroup)):
+            conditionalValues = [conditionalValues]
+        shape = structs.getConditionalShape(conditionalValues)
+        conditions = SQLite._conditionCache.get(shape)
+        if conditions is None:
+            if len(SQLite._conditionCache) >= SQLite.CONDITION_CACHE_SIZE:
+                SQLite._conditionCache.clear()
+            conditions = SQLite._buildConditionString(conditionalValues)
+            SQLite._conditionCache[shape] = conditions
+        return conditions, structs.getConditionalArguments(conditionalValues)
         
     def insert(self, table, values, *a):
         queryArguments = []
@@ -142,35 +263,163 @@ class SQLite(interface.DBInterface):
         fields = SQLite._buildFieldString(values.keys())
         valuetokens = SQLite._buildValueTokenString(values.values())
         query = "INSERT %s INTO `%s` (%s) VALUES (%s)" % (" ".join(a), table, fields, valuetokens)
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)
-        cursor.close()        
+        self._runQuery(query, queryArguments)
     insert.__doc__ = interface.DBInterface.insert.__doc__                        
         
-    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+    def bulkInsert(self, table, fields, rows, chunkSize=10000, deferIndexes=True):
+        """
+        Method for inserting many rows into a table, each a sequence of values for fields, committing every chunkSize rows. Returns the number of rows inserted.
+        While loading, synchronous is turned off and the rollback journal kept in memory (so a crash mid-load can corrupt the database), and if deferIndexes
+        is set, the table's explicitly created indexes are dropped and rebuilt once all rows are in.
+        Within a transaction(), rows are only inserted, leaving the commit (and database settings) to the transaction.
+        """
+        query = "INSERT INTO `%s` (%s) VALUES (%s)" % (table, SQLite._buildFieldString(fields), SQLite._buildValueTokenString(fields))
+        count = 0
+        if self.inTransaction():
+            for chunk in SQLite._iterChunks(rows, chunkSize):
+                self._runQueryMany(query, chunk)
+                count += len(chunk)
+            return count
+        self._commit()
+        synchronous = self._runQuery("PRAGMA synchronous", (), True)[0]["synchronous"]
+        journalMode = self._runQuery("PRAGMA journal_mode", (), True)[0]["journal_mode"]
+        indexes = []
+        if deferIndexes:
+            indexes = self._runQuery("SELECT `name`, `sql` FROM `sqlite_master` WHERE `type`='index' AND `tbl_name`=? AND `sql` IS NOT NULL", (table,), True)
+        self._runQuery("PRAGMA synchronous=OFF")
+        if journalMode.lower() != "wal":
+            self._runQuery("PRAGMA journal_mode=MEMORY", (), True)
+        try:
+            for index in indexes:
+                self._runQuery("DROP INDEX `%s`" % index["name"])
+            for chunk in SQLite._iterChunks(rows, chunkSize):
+                self._runQueryMany(query, chunk)
+                self._commit()
+                count += len(chunk)
+        finally:
+            self._commit()
+            for index in indexes:
+                self._runQuery(index["sql"])
+            self._commit()
+            if journalMode.lower() != "wal":
+                self._runQuery("PRAGMA journal_mode=%s" % journalMode, (), True)
+            self._runQuery("PRAGMA synchronous=%d" % synchronous)
+        return count
+
+    @staticmethod
+    def _buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count):
+        """
+        Private static method for returning the SQL of a select along with its query arguments.
+        """
         queryArguments = []
-        fields = SQLite._buildFieldString(selectFields)                
-        query = "SELECT %s FROM `%s`" % (fields, baseTable)                            
+        fields = SQLite._buildFieldString(selectFields)
+        query = "SELECT %s FROM `%s`" % (fields, table)
 
         if conditionals != None:
-            for conditional in conditionals:
-                queryArguments.append(conditional.value)                
-            conditions = SQLite._buildConditionString(conditionals)
-            query = "%s WHERE %s" % (query, conditions)
-                        
+            conditions, conditionArguments = SQLite._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                query = "%s WHERE %s" % (query, conditions)
+
         if orderFields is not None:
             orders = SQLite._buildOrderString(orderFields)
             query = "%s ORDER BY %s" % (query, orders)
-                        
+
         if offset > 0 or count > 0:
             query = "%s LIMIT %d, %d" % (query, int(offset), int(count))
-            
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)                
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows
+        return query, queryArguments
+
+    def select(self, table, selectFields=None, conditionals=None, orderFields=None, offset=0, count=0):
+        query, queryArguments = SQLite._buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count)
+        return self._runQuery(query, queryArguments, True)
     select.__doc__ = interface.DBInterface.select.__doc__
+
+    def selectTuples(self, table, selectFields, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        query, queryArguments = SQLite._buildSelectQuery(table, selectFields, conditionals, orderFields, offset, count)
+        return self._iterQuery(query, queryArguments, chunkSize)
+    selectTuples.__doc__ = interface.DBInterface.selectTuples.__doc__
+
+    def search(self, table, fullText, query, selectFields=None, conditionals=None, offset=0, count=0):
+        """
+        Method for selecting the rows of a table whose full-text indexed fullText fields match a full-text query, along with certain conditions,
+        ordered by relevance (most relevant first). Each row's relevance is returned in its RELEVANCE_FIELD value, higher being more relevant.
+        The query is an FTS5 query, matched against every field of the table's full-text index, and relevance is the negated bm25 rank.
+        """
+        ftsTable = SQLite._getFullTextTable(table)
+        fields = ("`%s`.*" % table) if selectFields is None else SQLite._buildFieldString(selectFields)
+        queryArguments = [query]
+        sql = "SELECT %s, -`ranked`.`rank` AS `%s` FROM `%s` JOIN (SELECT `rowid`, `rank` FROM `%s` WHERE `%s` MATCH ?) AS `ranked` ON `ranked`.`rowid`=`%s`.`rowid`" % (fields, self.RELEVANCE_FIELD, table, ftsTable, ftsTable, table)
+        if conditionals != None:
+            conditions, conditionArguments = SQLite._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                sql = "%s WHERE %s" % (sql, conditions)
+        sql = "%s ORDER BY `ranked`.`rank`" % sql
+        if offset > 0 or count > 0:
+            sql = "%s LIMIT %d, %d" % (sql, int(offset), int(count))
+        return self._runQuery(sql, queryArguments, True)
+
+    def _selectBlobRow(self, table, field, conditionals):
+        """
+        Private method returning the rowid and BLOB length of the first row matching conditionals, or None if no row matches.
+        """
+        conditions, queryArguments = SQLite._buildConditions(conditionals)
+        query = "SELECT `rowid`, LENGTH(`%s`) AS `length` FROM `%s` WHERE %s LIMIT 1" % (field, table, conditions)
+        rows = self._runQuery(query, queryArguments, True)
+        return rows[0] if len(rows) > 0 else None
+
+    def openBlob(self, table, field, conditionals, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method opening a blobs.BlobReader over the BLOB value of a field in the first row of a table matching certain conditions,
+        which reads the value a range of up to chunkSize bytes at a time instead of loading it whole. Returns None if no row matches or the value is NULL.
+        Where the sqlite3 module offers incremental BLOB I/O (Python 3.11 onwards) ranges are read through a blob handle, and otherwise with SUBSTR() queries.
+        """
+        row = self._selectBlobRow(table, field, conditionals)
+        if row is None or row["length"] is None:
+            return None
+        connector = self._getConnector()
+        if hasattr(connector, "blobopen"):
+            blob = connector.blobopen(table, field, row["rowid"], readonly=True)
+            def readRange(offset, size):
+                blob.seek(offset)
+                return blob.read(size)
+            return blobs.BlobReader(readRange, row["length"], chunkSize, blob.close)
+        query = "SELECT SUBSTR(`%s`, ?, ?) AS `chunk` FROM `%s` WHERE `rowid`=?" % (field, table)
+        return blobs.BlobReader(lambda offset, size: bytes(self._runQuery(query, (offset + 1, size, row["rowid"]), True)[0]["chunk"]), row["length"], chunkSize)
+
+    def writeBlob(self, table, field, conditionals, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method writing the BLOB value of a field in the rows of a table matching certain conditions from a source, written chunkSize bytes at a time.
+        The source is a bytes-like object, sliced without copying, or a file-like object, read a chunk at a time. Returns the number of bytes written.
+        Where the sqlite3 module offers incremental BLOB I/O (Python 3.11 onwards) and the length of the source is known, a zeroblob of that length is written
+        and filled in through a blob handle. Otherwise the value is emptied and each chunk appended with an update, so only a chunk is held in memory,
+        but SQLite rewrites the value so far for each chunk, making large values with small chunks slow to write.
+        Other matching rows are then given a copy of the first one's value.
+        """
+        conditions, conditionArguments = SQLite._buildConditions(conditionals)
+        rowIDs = [x["rowid"] for x in self._runQuery("SELECT `rowid` FROM `%s` WHERE %s" % (table, conditions), conditionArguments, True)]
+        if len(rowIDs) == 0:
+            return 0
+        length = blobs.getSourceLength(source)
+        if length is None or not hasattr(self._getConnector(), "blobopen"):
+            self._runQuery("UPDATE `%s` SET `%s`=? WHERE `rowid`=?" % (table, field), (self.binary(b""), rowIDs[0]))
+            #|| concatenates BLOBs as text, so the result is cast back.
+            query = "UPDATE `%s` SET `%s`=CAST(`%s` || ? AS BLOB) WHERE `rowid`=?" % (table, field, field)
+            length = 0
+            for chunk in blobs.iterSourceChunks(source, chunkSize):
+                self._runQuery(query, (self.binary(blobs.toBytes(chunk)), rowIDs[0]))
+                length += len(chunk)
+        else:
+            self._runQuery("UPDATE `%s` SET `%s`=zeroblob(?) WHERE `rowid`=?" % (table, field), (length, rowIDs[0]))
+            blob = self._getConnector().blobopen(table, field, rowIDs[0])
+            try:
+                for chunk in blobs.iterSourceChunks(source, chunkSize):
+                    blob.write(chunk)
+            finally:
+                blob.close()
+        for rowID in rowIDs[1:]:
+            self._runQuery("UPDATE `%s` SET `%s`=(SELECT `%s` FROM `%s` WHERE `rowid`=?) WHERE `rowid`=?" % (table, field, field, table), (rowIDs[0], rowID))
+        return length
     
     def selectJoin(self, baseTable, joins, selectFields, conditionals=None, orderFields=None, offset=0, count=0):
         if joins is None or len(joins) == 0:
@@ -187,10 +436,10 @@ class SQLite(interface.DBInterface):
         query = "%s %s" % (query, " ".join(joinElements))                             
 
         if conditionals != None:
-            for conditional in conditionals:
-                queryArguments.append(conditional.value)                
-            conditions = SQLite._buildConditionString(conditionals)
-            query = "%s WHERE %s" % (query, conditions)
+            conditions, conditionArguments = SQLite._buildConditions(conditionals)
+            if len(conditions) > 0:
+                queryArguments.extend(conditionArguments)
+                query = "%s WHERE %s" % (query, conditions)
                         
         if orderFields is not None:
             orders = SQLite._buildOrderString(orderFields)
@@ -199,44 +448,33 @@ class SQLite(interface.DBInterface):
         if offset > 0 or count > 0:
             query = "%s LIMIT %d, %d" % (query, int(offset), int(count))
             
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)                
-        rows = cursor.fetchall()
-        cursor.close()
-        return rows       
+        return self._runQuery(query, queryArguments, True)
     selectJoin.__doc__ = interface.DBInterface.selectJoin.__doc__
         
     def update(self, table, values, conditionals):
         queryArguments = []
         for value in values.values():
             queryArguments.append(value)
-        for conditional in conditionals:
-            queryArguments.append(conditional.value)
+        conditions, conditionArguments = SQLite._buildConditions(conditionals)
+        queryArguments.extend(conditionArguments)
         assignments = SQLite._buildAssignmentString(values)
-        conditions = SQLite._buildConditionString(conditionals)
         query = "UPDATE `%s` SET %s WHERE %s" % (table, assignments, conditions)
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)
-        cursor.close()        
+        self._runQuery(query, queryArguments)
     update.__doc__ = interface.DBInterface.update.__doc__                        
         
     def delete(self, table, conditionals):
-        queryArguments = []
-        for conditional in conditionals:
-            queryArguments.append(conditional.value)
-        conditions = SQLite._buildConditionString(conditionals)
+        conditions, queryArguments = SQLite._buildConditions(conditionals)
         query = "DELETE FROM `%s` WHERE %s" % (table, conditions)
-        cursor = self._dbConnector.cursor()
-        cursor.execute(query, queryArguments)
-        cursor.close()        
+        self._runQuery(query, queryArguments)
     delete.__doc__ = interface.DBInterface.delete.__doc__                        
         
     def refresh(self):
-        self._dbConnector.commit()
+        self._requestCommit()
     refresh.__doc__ = interface.DBInterface.refresh.__doc__                        
         
     def close(self):
-        self._dbConnector.commit()
+        self._closeConnectors()
+        self._commit()
         self._dbConnector.close()
     close.__doc__ = interface.DBInterface.close.__doc__                        
                                    
\ No newline at end of file
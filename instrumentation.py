@@ -0,0 +1,291 @@
+import collections
+import contextlib
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import timeit
+
+"""
+Timer used for measuring query durations.
+"""
+timer = timeit.default_timer
+
+_scope = threading.local()
+
+def _getEntityStack():
+    """
+    Private function returning the current thread's stack of entity classes issuing queries.
+    """
+    stack = getattr(_scope, "stack", None)
+    if stack is None:
+        stack = []
+        _scope.stack = stack
+    return stack
+
+def getEntityClass():
+    """
+    Returns the entity class currently issuing queries on this thread, or None if queries are issued directly.
+    """
+    stack = _getEntityStack()
+    if len(stack) == 0:
+        return None
+    return stack[-1]
+
+def entityScoped(method):
+    """
+    A decorator for entity methods and class methods, recording the entity class for any queries issued by the method.
+    """
+    @functools.wraps(method)
+    def scoped(obj, *a, **kwargs):
+        stack = _getEntityStack()
+        stack.append(obj if isinstance(obj, type) else type(obj))
+        try:
+            return method(obj, *a, **kwargs)
+        finally:
+            stack.pop()
+    return scoped
+
+class QueryRecord(object):
+    """
+    A class that describes a single executed statement.
+    The SQL is the parameterized statement, so it identifies the statement shape regardless of the values bound.
+    """
+    sql = None
+    argumentCount = 0
+    rowCount = None
+    duration = None
+    entityClass = None
+    error = None
+    def __init__(self, sql, queryArguments=()):
+        self.sql = sql
+        self.argumentCount = len(queryArguments)
+        self.entityClass = getEntityClass()
+
+class QueryHook(object):
+    """
+    Base class for query hooks, which are registered on a database with DBInterface.registerQueryHook().
+    """
+    def beforeQuery(self, record):
+        """
+        Invoked before a statement is executed.
+        """
+        pass
+
+    def afterQuery(self, record):
+        """
+        Invoked after a statement has been executed, or has failed, with its duration and row count filled in.
+        """
+        pass
+
+class StatementStatistics(object):
+    """
+    A class that accumulates timings for a single statement shape.
+    """
+    sql = None
+    count = 0
+    errors = 0
+    rowCount = 0
+    totalTime = 0.0
+    maxTime = 0.0
+    def __init__(self, sql, sampleSize):
+        self.sql = sql
+        self.entityClasses = set()
+        self._samples = collections.deque(maxlen=sampleSize)
+
+    def add(self, record):
+        """
+        Adds a record to the statistics.
+        """
+        self.count += 1
+        if record.error is not None:
+            self.errors += 1
+        if record.rowCount is not None and record.rowCount > 0:
+            self.rowCount += record.rowCount
+        self.totalTime += record.duration
+        self.maxTime = max(self.maxTime, record.duration)
+        if record.entityClass is not None:
+            self.entityClasses.add(record.entityClass.__name__)
+        self._samples.append(record.duration)
+
+    def percentile(self, percent):
+        """
+        Returns the nearest-rank percentile of the sampled durations, in seconds.
+        """
+        if len(self._samples) == 0:
+            return 0.0
+        samples = sorted(self._samples)
+        index = max(0, int(round(percent / 100.0 * len(samples))) - 1)
+        return samples[min(index, len(samples) - 1)]
+
+    def getSummary(self):
+        """
+        Returns a dictionary summarising the statistics.
+        """
+        return {"sql": self.sql,
+                "count": self.count,
+                "errors": self.errors,
+                "rows": self.rowCount,
+                "totalTime": self.totalTime,
+                "meanTime": self.totalTime / self.count if self.count > 0 else 0.0,
+                "maxTime": self.maxTime,
+                "p50": self.percentile(50),
+                "p99": self.percentile(99),
+                "entityClasses": sorted(self.entityClasses)}
+
+class QueryStatistics(QueryHook):
+    """
+    A query hook which aggregates per-statement timings, and logs statements slower than slowQueryThreshold seconds.
+    Percentiles are computed over the most recent sampleSize executions of each statement.
+    """
+    slowQueryThreshold = None
+    def __init__(self, slowQueryThreshold=None, sampleSize=1000, slowQueryLogSize=100, logger=None):
+        self.slowQueryThreshold = slowQueryThreshold
+        self.slowQueries = collections.deque(maxlen=slowQueryLogSize)
+        self._sampleSize = sampleSize
+        self._statements = {}
+        self._lock = threading.Lock()
+        self._logger = logger if logger is not None else logging.getLogger("ezdb.slowqueries")
+
+    def afterQuery(self, record):
+        with self._lock:
+            statistics = self._statements.get(record.sql)
+            if statistics is None:
+                statistics = StatementStatistics(record.sql, self._sampleSize)
+                self._statements[record.sql] = statistics
+            statistics.add(record)
+        if self.slowQueryThreshold is not None and record.duration >= self.slowQueryThreshold:
+            self.slowQueries.append(record)
+            entityName = record.entityClass.__name__ if record.entityClass is not None else "-"
+            self._logger.warning("Slow query (%.1f ms, %s, %d arguments): %s", record.duration * 1000.0, entityName, record.argumentCount, record.sql)
+
+    def getStatistics(self, sql):
+        """
+        Returns the statistics for a statement, or None if it has not been executed.
+        """
+        return self._statements.get(sql)
+
+    def getSummary(self):
+        """
+        Returns a list of statement summaries, ordered by total time spent, most expensive first.
+        """
+        with self._lock:
+            summaries = map(lambda x: x.getSummary(), self._statements.values())
+        return sorted(summaries, key=lambda x: x["totalTime"], reverse=True)
+
+    def reset(self):
+        """
+        Clears all accumulated statistics.
+        """
+        with self._lock:
+            self._statements = {}
+        self.slowQueries.clear()
+
+class RepeatedQueryReport(object):
+    """
+    A class that describes a statement repeated within one scope, typically from an N+1 access pattern.
+    """
+    entityClass = None
+    sql = None
+    count = 0
+    callSite = None
+    suggestion = None
+    def __init__(self, entityClass, sql, count, callSite, suggestion):
+        self.entityClass = entityClass
+        self.sql = sql
+        self.count = count
+        self.callSite = callSite
+        self.suggestion = suggestion
+
+    def __str__(self):
+        entityName = self.entityClass.__name__ if self.entityClass is not None else "-"
+        callSite = "%s:%d in %s" % self.callSite if self.callSite is not None else "unknown call site"
+        return "%s issued %d times from %s: %s (%s)" % (entityName, self.count, callSite, self.sql, self.suggestion)
+
+class NPlusOneDetector(QueryHook):
+    """
+    A query hook which counts statements of the same shape issued by the same entity class within a scope.
+    Once a statement reaches threshold executions, a single report is made naming the call site outside of this package and suggesting a batched alternative.
+    Counting is a dictionary increment per statement, and call sites are only resolved when a report is made, so the detector is cheap enough to leave enabled.
+    Scopes are per thread; use scope() around each request, otherwise counts accumulate for the lifetime of the thread.
+    """
+    threshold = 10
+    def __init__(self, threshold=10, reportCallback=None, reportLogSize=100, logger=None):
+        self.threshold = threshold
+        self.reports = collections.deque(maxlen=reportLogSize)
+        self._reportCallback = reportCallback
+        self._state = threading.local()
+        self._logger = logger if logger is not None else logging.getLogger("ezdb.nplusone")
+
+    def _getCounts(self):
+        """
+        Private method returning the current thread's statement counts.
+        """
+        counts = getattr(self._state, "counts", None)
+        if counts is None:
+            counts = {}
+            self._state.counts = counts
+        return counts
+
+    @contextlib.contextmanager
+    def scope(self):
+        """
+        A context manager delimiting a scope (e.g. a request), within which repeated statements are counted.
+        """
+        previous = getattr(self._state, "counts", None)
+        self._state.counts = {}
+        try:
+            yield self
+        finally:
+            self._state.counts = previous
+
+    def afterQuery(self, record):
+        counts = self._getCounts()
+        key = (record.entityClass, record.sql)
+        count = counts.get(key, 0) + 1
+        counts[key] = count
+        if count == self.threshold:
+            self._report(RepeatedQueryReport(record.entityClass, record.sql, count, _findCallSite(), _suggestBatching(record.sql)))
+
+    def _report(self, report):
+        """
+        Private method for delivering a report to the report callback, or the 'ezdb.nplusone' logger if there is none.
+        """
+        self.reports.append(report)
+        if self._reportCallback is not None:
+            self._reportCallback(report)
+        else:
+            self._logger.warning("Repeated query: %s", report)
+
+_packageDirectory = os.path.dirname(os.path.abspath(__file__))
+
+def _findCallSite():
+    """
+    Private function returning the (filename, line number, function name) of the innermost frame outside of this package.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_packageDirectory + os.sep):
+            return (filename, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+_keyConditionMatch = re.compile(r"WHERE \(?`([^`]+)` = ")
+
+def _suggestBatching(sql):
+    """
+    Private function returning a suggested batched alternative for a repeated statement.
+    """
+    statement = sql.lstrip().split(" ", 1)[0].upper()
+    if statement == "INSERT":
+        return "insert the rows within a single transaction rather than committing each one"
+    match = _keyConditionMatch.search(sql)
+    if match is None:
+        return "fetch the rows once before the loop and reuse them"
+    field = match.group(1)
+    if statement == "SELECT":
+        return "collect the '%s' values and issue a single select() with Conditional('%s', values, Condition.IN)" % (field, field)
+    return "collect the '%s' values and issue a single %s with Conditional('%s', values, Condition.IN)" % (field, statement, field)
@@ -1,16 +1,60 @@
+import collections
+import contextlib
+import itertools
+import threading
+from multiprocessing.pool import ThreadPool
+
+import blobs
+import instrumentation
+
+class GatherResults(list):
+    """
+    A list of the results of gathered calls, in the order the calls were given, along with their timings in seconds.
+    Elapsed is the wall time of the whole gather, sequential the sum of the calls' own durations (what running them back to back would have taken),
+    and saved the time the overlap saved.
+    """
+    durations = ()
+    elapsed = 0.0
+    sequential = 0.0
+    saved = 0.0
+    def __init__(self, results, durations, elapsed):
+        super(GatherResults, self).__init__(results)
+        self.durations = durations
+        self.elapsed = elapsed
+        self.sequential = sum(durations)
+        self.saved = self.sequential - elapsed
+
 class DBInterface(object):
     """
     An 'abstract' class that should be inherited to provide different database implementations that work with a simplified database API.
     """
+    RELEVANCE_FIELD = "_relevance"
+    _queryHooks = ()
+    _transactionDepth = 0
+    _commitBuffers = ()
+    _pendingCommitBuffers = None
+    _groupCommit = None
+    _pendingCommits = 0
+    _firstPendingCommit = None
+    _commitTimer = None
+    _commitLock = None
+    _commitsFromAnyThread = True
+    _refreshCount = 0
+    _commitCount = 0
+    _gatherLock = threading.Lock()
+    _gatherPool = None
+    _gatherPoolSize = 0
+    _idleConnectors = None
+    _connectorState = None
     def __init__(self):
         """
         Initializer.
         """
         raise NotImplementedError("Inheriting class should provide '__init__'")
     
-    def buildTable(self, table, fields, primary=None, unique=None):
+    def buildTable(self, table, fields, primary=None, unique=None, fullText=None):
         """
-        Method for building a table definition.
+        Method for building a table definition, with a full-text index over the fullText fields if given (see search()).
         """
         raise NotImplementedError("Inheriting class should provide 'buildTable'")
     
@@ -37,7 +81,26 @@ class DBInterface(object):
         Method for selecting rows from a table given certain options, along with joins.
         """
         raise NotImplementedError("Inheriting class should provide 'selectJoin'")
+
+    def selectTuples(self, table, selectFields, conditionals=None, orderFields=None, offset=0, count=0, chunkSize=10000):
+        """
+        Method for selecting rows from a table as tuples of selectFields values, returning an iterator over lists of up to chunkSize rows.
+        """
+        raise NotImplementedError("Inheriting class should provide 'selectTuples'")
+
+    def search(self, table, fullText, query, selectFields=None, conditionals=None, offset=0, count=0):
+        """
+        Method for selecting the rows of a table whose full-text indexed fullText fields match a full-text query, along with certain conditions,
+        ordered by relevance (most relevant first). Each row's relevance is returned in its RELEVANCE_FIELD value, higher being more relevant.
+        """
+        raise NotImplementedError("Inheriting class should provide 'search'")
         
+    def bulkInsert(self, table, fields, rows, chunkSize=10000):
+        """
+        Method for inserting many rows into a table, each a sequence of values for fields, committing every chunkSize rows. Returns the number of rows inserted.
+        """
+        raise NotImplementedError("Inheriting class should provide 'bulkInsert'")
+
     def update(self, table, values, conditionals):
         """
         Method for updating rows in a table given certain conditions.
@@ -60,4 +123,443 @@ class DBInterface(object):
         """
         Method for closing the database.
         """
-        raise NotImplementedError("Inheriting class should provide 'close'")
\ No newline at end of file
+        raise NotImplementedError("Inheriting class should provide 'close'")
+
+    def openBlob(self, table, field, conditionals, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method opening a blobs.BlobReader over the BLOB value of a field in the first row of a table matching certain conditions,
+        which reads the value a range of up to chunkSize bytes at a time instead of loading it whole. Returns None if no row matches or the value is NULL.
+        """
+        raise NotImplementedError("Inheriting class should provide 'openBlob'")
+
+    def writeBlob(self, table, field, conditionals, source, chunkSize=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Method writing the BLOB value of a field in the rows of a table matching certain conditions from a source, written chunkSize bytes at a time.
+        The source is a bytes-like object, sliced without copying, or a file-like object, read a chunk at a time. Returns the number of bytes written.
+        """
+        raise NotImplementedError("Inheriting class should provide 'writeBlob'")
+
+    def binary(self, data):
+        """
+        Method returning bytes wrapped for binding as a BLOB query argument. Drivers that bind bytes as BLOBs take them unwrapped.
+        """
+        return data
+
+    @staticmethod
+    def _iterChunks(rows, chunkSize):
+        """
+        Private static generator splitting an iterable of rows into lists of up to chunkSize rows.
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunkSize))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        A context manager running the statements issued within it as one transaction, committed on exit or rolled back if it exits with an exception.
+        Transactions may be nested, in which case inner ones are savepoints, rolled back on their own if they exit with an exception.
+        refresh() does not commit within a transaction.
+        """
+        depth = self._transactionDepth
+        savepoint = "`ezdb_savepoint_%d`" % depth
+        if depth == 0:
+            self._beginTransaction()
+        else:
+            self._runQuery("SAVEPOINT %s" % savepoint)
+        self._transactionDepth = depth + 1
+        self._commitBuffers = self._commitBuffers[:depth] + (collections.OrderedDict(),)
+        try:
+            yield self
+        except:
+            self._transactionDepth = depth
+            self._commitBuffers = self._commitBuffers[:depth]
+            if depth == 0:
+                self._rollbackTransaction()
+            else:
+                self._runQuery("ROLLBACK TO SAVEPOINT %s" % savepoint)
+                self._runQuery("RELEASE SAVEPOINT %s" % savepoint)
+            raise
+        self._transactionDepth = depth
+        buffers = self._commitBuffers[depth]
+        self._commitBuffers = self._commitBuffers[:depth]
+        if depth == 0:
+            self._commitTransaction()
+            for callback, items in buffers.items():
+                callback(items)
+        else:
+            self._runQuery("RELEASE SAVEPOINT %s" % savepoint)
+            for callback, items in buffers.items():
+                self._commitBuffers[-1].setdefault(callback, []).extend(items)
+
+    def getCommitBuffer(self, callback):
+        """
+        Returns the list of items held until the active transaction() commits, to be passed to callback (e.g. an event bus' delivery method) then.
+        Items added within a savepoint are discarded if it is rolled back, as are all of them if the transaction is.
+        Outside of a transaction, items are held until the main connection is next committed (e.g. by refresh()).
+        """
+        if self._transactionDepth == 0:
+            if self._pendingCommitBuffers is None:
+                self._pendingCommitBuffers = collections.OrderedDict()
+            return self._pendingCommitBuffers.setdefault(callback, [])
+        return self._commitBuffers[-1].setdefault(callback, [])
+
+    def inTransaction(self):
+        """
+        Returns whether a transaction() is active.
+        """
+        return self._transactionDepth > 0
+
+    def _beginTransaction(self):
+        """
+        Private method beginning a transaction, committing any work done outside of one first.
+        """
+        self._commit()
+
+    def _commitTransaction(self):
+        """
+        Private method committing a transaction.
+        """
+        self._commit()
+
+    def _rollbackTransaction(self):
+        """
+        Private method rolling back a transaction.
+        """
+        self._dbConnector.rollback()
+
+    def setGroupCommit(self, maxCommits=None, maxDelay=None):
+        """
+        Enables group commit, where refresh() only commits once maxCommits refreshes are pending, or maxDelay seconds after the first pending one.
+        Many small writes then share one commit (and one fsync), at the cost of refreshed writes not being durable until then; call flushCommits() when idle.
+        The maxDelay commit is made by a timer, so happens even if refresh() is not called again; it runs on the timer's thread, so the main connection must
+        allow use from other threads (raising ValueError if it does not, e.g. for SQLite without checkSameThread=False).
+        Passing neither disables group commit, committing anything pending.
+        """
+        if maxDelay is not None and not self._commitsFromAnyThread:
+            raise ValueError("Group commit with maxDelay needs a connection usable from other threads")
+        self.flushCommits()
+        if self._commitLock is None:
+            self._commitLock = threading.RLock()
+        self._groupCommit = (maxCommits, maxDelay) if maxCommits is not None or maxDelay is not None else None
+
+    def flushCommits(self):
+        """
+        Commits any refreshes held back by group commit.
+        """
+        if self._commitLock is None:
+            return
+        with self._commitLock:
+            if self._pendingCommits > 0 and self._transactionDepth == 0:
+                self._commit()
+
+    def getCommitStatistics(self):
+        """
+        Returns a dictionary of the number of refresh() calls, the number of commits made, and the number of refreshes pending.
+        """
+        return {"refreshes": self._refreshCount, "commits": self._commitCount, "pending": self._pendingCommits}
+
+    def _requestCommit(self):
+        """
+        Private method handling refresh(): committing, unless within a transaction or held back by group commit.
+        """
+        self._refreshCount += 1
+        if self._transactionDepth > 0:
+            return
+        if self._groupCommit is None:
+            self._commit()
+            return
+        maxCommits, maxDelay = self._groupCommit
+        with self._commitLock:
+            now = instrumentation.timer()
+            if self._pendingCommits == 0:
+                self._firstPendingCommit = now
+                if maxDelay is not None:
+                    self._commitTimer = threading.Timer(maxDelay, self.flushCommits)
+                    self._commitTimer.start()
+            self._pendingCommits += 1
+            if (maxCommits is not None and self._pendingCommits >= maxCommits) or (maxDelay is not None and now - self._firstPendingCommit >= maxDelay):
+                self._commit()
+
+    def _commit(self):
+        """
+        Private method committing the main connection, then handing over the items held for the commit (see getCommitBuffer()).
+        """
+        self._dbConnector.commit()
+        self._commitCount += 1
+        self._pendingCommits = 0
+        self._firstPendingCommit = None
+        timer = self._commitTimer
+        if timer is not None:
+            self._commitTimer = None
+            timer.cancel()
+        buffers = self._pendingCommitBuffers
+        if buffers is not None:
+            self._pendingCommitBuffers = None
+            for callback, items in buffers.items():
+                callback(items)
+
+    def registerQueryHook(self, hook):
+        """
+        Registers a query hook (see instrumentation.QueryHook), which is notified before and after every statement executed.
+        """
+        self._queryHooks = self._queryHooks + (hook,)
+
+    def unregisterQueryHook(self, hook):
+        """
+        Unregisters a query hook.
+        """
+        self._queryHooks = tuple(filter(lambda x: x is not hook, self._queryHooks))
+
+    def _runQuery(self, query, queryArguments=(), fetch=False):
+        """
+        Private method for executing a query on a new cursor, returning all rows if fetch is set.
+        Registered query hooks are notified with the statement, its duration and the number of rows returned or affected.
+        """
+        if len(self._queryHooks) == 0:
+            return self._executeQuery(query, queryArguments, fetch)[0]
+        return self._runHooked(query, queryArguments, lambda: self._executeQuery(query, queryArguments, fetch))
+
+    def _runQueryMany(self, query, argumentRows):
+        """
+        Private method for executing a query once for each of a list of argument sequences (DB-API executemany), returning the number of rows affected.
+        Registered query hooks are notified once for the whole list.
+        """
+        if len(self._queryHooks) == 0:
+            return self._executeMany(query, argumentRows)
+        def execute():
+            rowCount = self._executeMany(query, argumentRows)
+            return rowCount, rowCount
+        return self._runHooked(query, argumentRows[0] if len(argumentRows) > 0 else (), execute)
+
+    def _runHooked(self, query, queryArguments, execute):
+        """
+        Private method calling execute, which returns a result and a row count, while notifying registered query hooks. Returns the result.
+        """
+        record = instrumentation.QueryRecord(query, queryArguments)
+        for hook in self._queryHooks:
+            hook.beforeQuery(record)
+        start = instrumentation.timer()
+        try:
+            result, record.rowCount = execute()
+            return result
+        except Exception as e:
+            record.error = e
+            raise
+        finally:
+            record.duration = instrumentation.timer() - start
+            for hook in self._queryHooks:
+                hook.afterQuery(record)
+
+    def gather(self, calls, maxWorkers=4):
+        """
+        Runs several independent calls concurrently, each given this database (e.g. lambda db: Entity.select(db, ...)), returning their results in order
+        as a GatherResults list. Each call runs on a worker thread with its own pooled connection, so calls do not see changes not yet committed with refresh().
+        At most maxWorkers calls run at once; the worker threads are shared between gathers, and grown if a gather asks for more than they number.
+        Backends that cannot open further connections to the same database run the calls one after another, as does a gather issued within a gathered call
+        (or other work on a pooled connection), on that call's connection, since waiting on the shared workers from one of them could deadlock.
+        If any call raises, the first exception (in call order) is raised once every call has finished.
+        """
+        calls = list(calls)
+        start = instrumentation.timer()
+        workers = min(maxWorkers, len(calls))
+        nested = self._connectorState is not None and getattr(self._connectorState, "connector", None) is not None
+        connector = self._acquireConnector() if workers > 1 and not nested else None
+        if connector is None:
+            outcomes = map(self._runGathered, calls)
+        else:
+            self._releaseConnector(connector)
+            retired = None
+            with self._gatherLock:
+                if self._gatherPool is None or self._gatherPoolSize < workers:
+                    retired = self._gatherPool
+                    self._gatherPool = ThreadPool(workers)
+                    self._gatherPoolSize = workers
+                pool = self._gatherPool
+            if retired is not None:
+                #Lets the gathers still using the smaller pool finish, then its threads exit.
+                retired.close()
+            outcomes = [None] * len(calls)
+            indices = iter(range(len(calls)))
+            lock = threading.Lock()
+            pending = map(lambda x: pool.apply_async(self._runGatheredCalls, (calls, indices, lock, outcomes)), range(workers))
+            for result in pending:
+                result.get()
+        elapsed = instrumentation.timer() - start
+        for outcome in outcomes:
+            if outcome[2] is not None:
+                raise outcome[2]
+        return GatherResults(map(lambda x: x[0], outcomes), map(lambda x: x[1], outcomes), elapsed)
+
+    def _runGathered(self, call):
+        """
+        Private method running a gathered call, returning its result, duration and any exception raised.
+        """
+        start = instrumentation.timer()
+        try:
+            return call(self), instrumentation.timer() - start, None
+        except Exception as e:
+            return None, instrumentation.timer() - start, e
+
+    def _runGatheredCalls(self, calls, indices, lock, outcomes):
+        """
+        Private method run by a gather worker on a pooled connection, taking the index of the next call from indices (under lock) and storing its outcome,
+        until no calls are left.
+        """
+        connector = self._acquireConnector()
+        self._connectorState.connector = connector
+        try:
+            while True:
+                with lock:
+                    index = next(indices, None)
+                if index is None:
+                    return
+                outcomes[index] = self._runGathered(calls[index])
+        finally:
+            self._connectorState.connector = None
+            self._releaseConnector(connector)
+
+    def _openConnector(self):
+        """
+        Private method opening a further connection to the database for gathered calls, or returning None if the backend cannot.
+        """
+        return None
+
+    def _acquireConnector(self):
+        """
+        Private method taking an idle pooled connection, opening one if none are idle. Returns None if the backend cannot open connections.
+        """
+        with self._gatherLock:
+            if self._idleConnectors is None:
+                self._idleConnectors = []
+                self._connectorState = threading.local()
+            if len(self._idleConnectors) > 0:
+                return self._idleConnectors.pop()
+        return self._openConnector()
+
+    def _releaseConnector(self, connector):
+        """
+        Private method returning a pooled connection, committing so it holds no transaction (or stale snapshot) while idle.
+        """
+        connector.commit()
+        with self._gatherLock:
+            self._idleConnectors.append(connector)
+
+    def _runPooled(self, function):
+        """
+        Private method calling function with the statements it issues on this thread run on a pooled connection, committed once it returns
+        or rolled back if it raises. Returns whether it was called, which it is not if the backend cannot open connections.
+        """
+        connector = self._acquireConnector()
+        if connector is None:
+            return False
+        previous = getattr(self._connectorState, "connector", None)
+        self._connectorState.connector = connector
+        try:
+            function()
+        except:
+            connector.rollback()
+            raise
+        finally:
+            self._connectorState.connector = previous
+            self._releaseConnector(connector)
+        return True
+
+    def _getConnector(self):
+        """
+        Private method returning the connection for statements issued on this thread: its pooled connection within a gathered call, or the main connection.
+        """
+        if self._connectorState is not None:
+            connector = getattr(self._connectorState, "connector", None)
+            if connector is not None:
+                return connector
+        return self._dbConnector
+
+    def _closeConnectors(self):
+        """
+        Private method closing the pooled connections and worker threads used by gather().
+        """
+        with self._gatherLock:
+            connectors = self._idleConnectors or []
+            self._idleConnectors = None
+            pool = self._gatherPool
+            self._gatherPool = None
+            self._gatherPoolSize = 0
+        for connector in connectors:
+            connector.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _iterQuery(self, query, queryArguments, chunkSize):
+        """
+        Private generator for executing a query on a new tuple cursor, yielding its rows in lists of up to chunkSize rows.
+        Registered query hooks are notified once the rows are exhausted, so the duration covers the whole iteration.
+        """
+        record = None
+        if len(self._queryHooks) > 0:
+            record = instrumentation.QueryRecord(query, queryArguments)
+            for hook in self._queryHooks:
+                hook.beforeQuery(record)
+        start = instrumentation.timer()
+        rowCount = 0
+        cursor = self._openTupleCursor()
+        try:
+            cursor.execute(query, queryArguments)
+            while True:
+                rows = cursor.fetchmany(chunkSize)
+                if len(rows) == 0:
+                    break
+                rowCount += len(rows)
+                yield rows
+        except Exception as e:
+            if record is not None:
+                record.error = e
+            raise
+        finally:
+            cursor.close()
+            if record is not None:
+                record.rowCount = rowCount
+                record.duration = instrumentation.timer() - start
+                for hook in self._queryHooks:
+                    hook.afterQuery(record)
+
+    def _openTupleCursor(self):
+        """
+        Private method opening a cursor returning rows as tuples, for _iterQuery().
+        """
+        return self._getConnector().cursor()
+
+    def _openCursor(self):
+        """
+        Private method opening a cursor returning rows as dictionaries, for _executeQuery().
+        """
+        return self._getConnector().cursor()
+
+    def _executeMany(self, query, argumentRows):
+        """
+        Private method for executing a query for each of a list of argument sequences on a new cursor, returning the row count.
+        """
+        cursor = self._getConnector().cursor()
+        try:
+            cursor.executemany(query, argumentRows)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    def _executeQuery(self, query, queryArguments, fetch):
+        """
+        Private method for executing a query on a new cursor, returning the fetched rows (or None) and the row count.
+        """
+        cursor = self._openCursor()
+        try:
+            cursor.execute(query, queryArguments)
+            if fetch:
+                rows = cursor.fetchall()
+                return rows, len(rows)
+            return None, cursor.rowcount
+        finally:
+            cursor.close()
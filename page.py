@@ -1,38 +1,153 @@
+import collections
 import re
+import threading
 
 class PageManager(object):
+    """
+    A class managing the registration of page collections, and resolving paths to the pages they define.
+    Routes are compiled when a collection is registered, and resolved paths are kept in an LRU cache of ROUTE_CACHE_SIZE entries.
+    """
+    ROUTE_CACHE_SIZE = 1024
+    MAX_COMBINED_GROUPS = 100
     _pageCollections = {}
 
     def __init__(self):
         self._pageCollections = {}
-        pass
-    
-    def registerPageCollection(self, pageCollectionClass):            
-        self._pageCollections[pageCollectionClass.__name__] = pageCollectionClass
-        
+        self._pageCollectionOrder = []
+        self._routes = []
+        self._combinedRoutes = None
+        self._resolvedPaths = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def registerPageCollection(self, pageCollectionClass):
+        name = pageCollectionClass.__name__
+        if name not in self._pageCollections:
+            self._pageCollectionOrder.append(name)
+        self._pageCollections[name] = pageCollectionClass
+        self._compileRoutes()
+
     def __getattr__(self, name):
         if name in self._pageCollections:
             return self._pageCollections[name]
-        return super(PageManager, self).__getattr__(self, name)   
-    
+        return super(PageManager, self).__getattr__(self, name)
+
     def __getitem__(self, name):
         if name in self._pageCollections:
             return self._pageCollections[name]
         return super(PageManager, self).__getitem__(self, name)
-        
-    def resolvePath(self, path):
-        for pageCollection in self._pageCollections.values():
-            for page in pageManager.PAGES:     
-                match = re.search(page[0], path)
+
+    def _compileRoutes(self):
+        """
+        Private method compiling the PAGES of every registered collection, in registration order, and clearing the resolved path cache.
+        """
+        routes = []
+        for name in self._pageCollectionOrder:
+            for page in self._pageCollections[name].PAGES:
+                routes.append((page[0], re.compile(page[0]), page[1]))
+        combinedRoutes = PageManager._combineRoutes(routes)
+        with self._lock:
+            self._routes = routes
+            self._combinedRoutes = combinedRoutes
+            self._resolvedPaths.clear()
+
+    @staticmethod
+    def _combineRoutes(routes):
+        """
+        Private static method compiling routes into as few alternations as the regular expression engine's group limit allows.
+        Returns a list of (alternation, dictionary of group index to (route, group count)) tuples, to be tried in order.
+        Returns None if the routes cannot be combined without changing their meaning, i.e. unless every pattern is an anchored string
+        without backreferences, inline flags or top-level alternation (whose later branches are unanchored), in which case routes are matched one at a time.
+        """
+        if len(routes) == 0:
+            return None
+        for route in routes:
+            pattern = route[0]
+            if not isinstance(pattern, str) or not pattern.startswith("^") or _uncombinablePattern.search(pattern) is not None or _hasTopLevelAlternation(pattern):
+                return None
+        combinedRoutes = []
+        patterns = []
+        routeIndices = {}
+        groupIndex = 1
+        try:
+            for route in routes:
+                if len(patterns) > 0 and groupIndex + route[1].groups >= PageManager.MAX_COMBINED_GROUPS:
+                    combinedRoutes.append((re.compile("|".join(patterns)), routeIndices))
+                    patterns = []
+                    routeIndices = {}
+                    groupIndex = 1
+                patterns.append("(%s)" % route[0])
+                routeIndices[groupIndex] = (route, route[1].groups)
+                groupIndex += route[1].groups + 1
+            combinedRoutes.append((re.compile("|".join(patterns)), routeIndices))
+        except (re.error, AssertionError):
+            return None
+        return combinedRoutes
+
+    def _matchRoute(self, path):
+        """
+        Private method matching a path against the compiled routes, returning the page and the matched groups.
+        """
+        if self._combinedRoutes is not None:
+            for combinedRoute, routeIndices in self._combinedRoutes:
+                match = combinedRoute.match(path)
                 if match is not None:
-                    return page[1], match.groups()
+                    route, groupCount = routeIndices[match.lastindex]
+                    return route[2], match.groups()[match.lastindex:match.lastindex + groupCount]
+            return None, None
+        for route in self._routes:
+            match = route[1].search(path)
+            if match is not None:
+                return route[2], match.groups()
         return None, None
-            
+
+    def resolvePath(self, path):
+        with self._lock:
+            resolved = self._resolvedPaths.pop(path, None)
+            if resolved is not None:
+                self._resolvedPaths[path] = resolved
+                return resolved
+        resolved = self._matchRoute(path)
+        with self._lock:
+            self._resolvedPaths[path] = resolved
+            if len(self._resolvedPaths) > self.ROUTE_CACHE_SIZE:
+                self._resolvedPaths.popitem(False)
+        return resolved
+
+_uncombinablePattern = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)")
+
+def _hasTopLevelAlternation(pattern):
+    """
+    Private function returning whether a pattern has a '|' outside any group or character class.
+    """
+    depth = 0
+    inClass = False
+    classStart = 0
+    escaped = False
+    for index, character in enumerate(pattern):
+        if escaped:
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        elif inClass:
+            #A ']' straight after the opening '[' (or '[^') is a literal.
+            if character == "]" and index > classStart + 1 and not (index == classStart + 2 and pattern[classStart + 1] == "^"):
+                inClass = False
+        elif character == "[":
+            inClass = True
+            classStart = index
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "|" and depth == 0:
+            return True
+    return False
+
 pages = PageManager()
 
 class PageManagerMetaclass(type):
     """
-    A metaclass for pages which will automatically register classes inherting from PageManager. 
+    A metaclass for pages which will automatically register classes inherting from PageManager.
     """
     def __new__(cls, name, bases, dct):
         global pages
@@ -42,5 +157,4 @@ class PageManagerMetaclass(type):
 
 class PageCollection(object):
     __metaclass__ = PageManagerMetaclass
-    PAGES = [] 
-                    
\ No newline at end of file
+    PAGES = []
@@ -0,0 +1,89 @@
+import collections
+import multiprocessing
+
+import structs
+
+def getPartitions(low, high, partitions):
+    """
+    Splits the inclusive integer range from low to high into up to partitions contiguous (low, high) ranges of near equal size.
+    """
+    size = -(-(high - low + 1) // partitions)
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+def _getKeysetConditional(primary, last):
+    """
+    Private function returning a conditional selecting the rows whose primary key values come after last in primary order,
+    comparing the fields of composite keys lexicographically.
+    """
+    if len(primary) == 1:
+        return structs.Conditional(primary[0], last[primary[0]], structs.Condition.GREATER)
+    alternatives = []
+    for index in range(len(primary)):
+        equalities = [structs.Conditional(x, last[x]) for x in primary[:index]]
+        alternatives.append(structs.ConditionalGroup(equalities + [structs.Conditional(primary[index], last[primary[index]], structs.Condition.GREATER)]))
+    return structs.ConditionalGroup(alternatives, structs.Condition.OR)
+
+def _iterPartition(entityClass, db, keyField, low, high, conditionals, chunkSize):
+    """
+    Private generator streaming the entities of a key range, selected chunkSize at a time by keyset pagination over the whole primary key.
+    Each chunk is dropped from the identity map once the next is selected, so a partition is never held in memory whole.
+    """
+    primary = tuple(entityClass.PRIMARY)
+    ordering = collections.OrderedDict(map(lambda x: (x, structs.Ordering.ASCENDING), primary))
+    last = None
+    while True:
+        bounds = [structs.Conditional(keyField, (low, high), structs.Condition.BETWEEN)]
+        if last is not None:
+            bounds.append(_getKeysetConditional(primary, last))
+        chunk = entityClass.select(db, bounds + list(conditionals or ()), ordering, 0, chunkSize)
+        for obj in chunk:
+            yield obj
+        for obj in chunk:
+            entityClass._removeFromLocalCache(obj)
+        if len(chunk) < chunkSize:
+            return
+        last = chunk[-1]._values
+
+def _scanPartition(task):
+    """
+    Private function run in a worker process, applying the scan function to the entities of one key range on a connection of the worker's own.
+    """
+    entityClass, dbFactory, function, keyField, low, high, conditionals, chunkSize = task
+    #Entities inherited from the parent's identity map would otherwise be shared with the scan.
+    entityClass._ENTITIES.clear()
+    db = dbFactory()
+    try:
+        return function(_iterPartition(entityClass, db, keyField, low, high, conditionals, chunkSize))
+    finally:
+        db.close()
+
+def parallelScan(entityClass, dbFactory, function, partitions=4, combine=None, conditionals=None, chunkSize=1000):
+    """
+    Scans the table of an entity class in parallel, split into partitions ranges of its INT primary key, each scanned by a worker process.
+    See Entity.parallelScan().
+    """
+    if len(entityClass.PRIMARY) == 0 or entityClass.FIELDS[entityClass.PRIMARY[0]].fieldType != structs.Types.INT:
+        raise ValueError("Entity class '%s' needs an INT primary field to be scanned in parallel" % entityClass.__name__)
+    keyField = entityClass.PRIMARY[0]
+    if isinstance(conditionals, (structs.Conditional, structs.ConditionalGroup)):
+        conditionals = [conditionals]
+    db = dbFactory()
+    try:
+        bounds = []
+        for ordering in (structs.Ordering.ASCENDING, structs.Ordering.DESCENDING):
+            rows = entityClass.selectBasic(db, conditionals, {keyField: ordering}, 0, 1, [keyField])
+            bounds.append(rows[0][keyField] if len(rows) > 0 else None)
+    finally:
+        db.close()
+    results = []
+    if bounds[0] is not None:
+        tasks = map(lambda x: (entityClass, dbFactory, function, keyField, x[0], x[1], conditionals, chunkSize), getPartitions(int(bounds[0]), int(bounds[1]), partitions))
+        pool = multiprocessing.Pool(min(partitions, len(tasks)))
+        try:
+            results = pool.map(_scanPartition, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    if combine is None:
+        return results
+    return combine(results)
@@ -0,0 +1,199 @@
+import mmap
+import multiprocessing
+import struct
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_HEADER = struct.Struct("<QI")
+_COUNTER = struct.Struct("<Q")
+
+class SharedEntityCache(object):
+    """
+    A class caching entity values in shared memory, set as an entity class' SHARED_CACHE to share one cache tier between forked worker processes,
+    behind each process' identity map. It must be created before the workers are forked (e.g. at import time in a pre-fork server's master).
+    The cache is a fixed table of slots of slotSize bytes, each holding the pickled values of one entity, placed by a hash of its table and uniqueID;
+    an entity colliding with another replaces it. Values that do not fit in a slot are not cached.
+    Writers serialize on one of lockStripes process-shared locks, and readers take no lock: each slot carries a sequence number which writers make odd
+    while writing, so readers retry (and finally miss) if it was odd or changed while they read.
+    A stripe held for longer than LOCK_TIMEOUT seconds is taken to belong to a worker killed while writing, and is broken; the slot it left odd is
+    rewritten by the next writer.
+    Entities are invalidated when written, and again once the write is committed, as another process may cache the old row in between.
+    Each stripe counts its invalidations, so values selected before an invalidation in their stripe (see getGeneration()) are not cached afterwards.
+    """
+    slots = 0
+    slotSize = 0
+    READ_RETRIES = 3
+    LOCK_TIMEOUT = 1.0
+    def __init__(self, slots=65536, slotSize=1024, lockStripes=64):
+        self.slots = slots
+        self.slotSize = slotSize
+        self._stride = _HEADER.size + slotSize
+        self._counters = slots * self._stride
+        self._memory = mmap.mmap(-1, self._counters + lockStripes * _COUNTER.size)
+        self._locks = [multiprocessing.Lock() for i in range(lockStripes)]
+        self._hits = 0
+        self._misses = 0
+        self._oversized = 0
+        self._stale = 0
+        self._brokenLocks = 0
+
+    @staticmethod
+    def _getKey(entityClass, uniqueID):
+        """
+        Private static method returning the key of an entity.
+        """
+        return "%s\x1f%s" % (entityClass.TABLE, uniqueID)
+
+    def _getSlot(self, key):
+        """
+        Private method returning the offset and lock stripe of the slot for a key.
+        """
+        keyHash = zlib.crc32(key) & 0xffffffff
+        return (keyHash % self.slots) * self._stride, keyHash % len(self._locks)
+
+    def getGeneration(self):
+        """
+        Returns the invalidation counts of every lock stripe, to be taken before selecting values to pass to set().
+        """
+        return self._memory[self._counters:self._counters + len(self._locks) * _COUNTER.size]
+
+    def get(self, entityClass, uniqueID):
+        """
+        Returns the cached values of the entity of entityClass type with a uniqueID, or None if they are not cached.
+        """
+        if len(uniqueID) == 0:
+            return None
+        key = SharedEntityCache._getKey(entityClass, uniqueID)
+        offset = self._getSlot(key)[0]
+        for attempt in range(self.READ_RETRIES):
+            sequence, length = _HEADER.unpack_from(self._memory, offset)
+            if sequence & 1:
+                continue
+            if length == 0:
+                break
+            payload = self._memory[offset + _HEADER.size:offset + _HEADER.size + length]
+            if _HEADER.unpack_from(self._memory, offset)[0] != sequence:
+                continue
+            cachedKey, values = pickle.loads(payload)
+            if cachedKey != key:
+                break
+            self._hits += 1
+            return values
+        self._misses += 1
+        return None
+
+    def set(self, entityClass, values, generation=None):
+        """
+        Caches the values of an entity of entityClass type, as selected from the database.
+        If the generation (see getGeneration()) taken before selecting them is given, the values are not cached if an entity sharing the slot's lock stripe
+        has been invalidated since, as they may predate its change.
+        """
+        uniqueID = entityClass._buildUniqueID(values)
+        if len(uniqueID) == 0:
+            return
+        key = SharedEntityCache._getKey(entityClass, uniqueID)
+        payload = pickle.dumps((key, entityClass._getBinaryBytes(values)), 2)
+        if len(payload) > self.slotSize:
+            self._oversized += 1
+            return
+        self._write(key, payload, generation)
+
+    def invalidate(self, entityClass, uniqueID):
+        """
+        Removes the cached values of the entity of entityClass type with a uniqueID, in every process.
+        """
+        if len(uniqueID) > 0:
+            self._write(SharedEntityCache._getKey(entityClass, uniqueID), "")
+
+    def invalidateEntries(self, entries):
+        """
+        Removes the cached values of each of a list of (entityClass, uniqueID) entries, in every process.
+        """
+        for entityClass, uniqueID in entries:
+            self.invalidate(entityClass, uniqueID)
+
+    def _acquire(self, lock):
+        """
+        Private method acquiring a lock stripe, breaking it if it has been held for LOCK_TIMEOUT seconds, as the worker holding it is presumed killed.
+        Returns whether the lock was acquired.
+        """
+        if lock.acquire(True, self.LOCK_TIMEOUT):
+            return True
+        self._brokenLocks += 1
+        try:
+            lock.release()
+        except ValueError:
+            #Released meanwhile by its holder.
+            pass
+        return lock.acquire(True, self.LOCK_TIMEOUT)
+
+    @staticmethod
+    def _release(lock):
+        """
+        Private static method releasing a lock stripe, which may have been broken and released by another process already.
+        """
+        try:
+            lock.release()
+        except ValueError:
+            pass
+
+    def _write(self, key, payload, generation=None):
+        """
+        Private method writing a payload to the slot of a key, or emptying it (and counting an invalidation) if the payload is empty.
+        A payload is not written if its stripe was invalidated since the generation given, or if the stripe cannot be acquired;
+        an invalidation then still leaves the slot odd, so readers miss until it is rewritten.
+        """
+        offset, stripe = self._getSlot(key)
+        counter = self._counters + stripe * _COUNTER.size
+        lock = self._locks[stripe]
+        if not self._acquire(lock):
+            if len(payload) == 0:
+                sequence = _HEADER.unpack_from(self._memory, offset)[0]
+                _HEADER.pack_into(self._memory, offset, sequence | 1, 0)
+            return
+        try:
+            if len(payload) == 0:
+                _COUNTER.pack_into(self._memory, counter, _COUNTER.unpack_from(self._memory, counter)[0] + 1)
+            elif generation is not None and generation[counter - self._counters:counter - self._counters + _COUNTER.size] != self._memory[counter:counter + _COUNTER.size]:
+                self._stale += 1
+                return
+            #An odd sequence was left by a worker killed while writing the slot, and is moved on to another odd one, then even once written.
+            sequence = _HEADER.unpack_from(self._memory, offset)[0]
+            sequence = sequence + 2 if sequence & 1 else sequence + 1
+            _HEADER.pack_into(self._memory, offset, sequence, 0)
+            self._memory[offset + _HEADER.size:offset + _HEADER.size + len(payload)] = payload
+            _HEADER.pack_into(self._memory, offset, sequence + 1, len(payload))
+        finally:
+            SharedEntityCache._release(lock)
+
+    def clear(self):
+        """
+        Empties every slot.
+        """
+        locks = filter(self._acquire, self._locks)
+        try:
+            for slot in range(self.slots):
+                sequence = _HEADER.unpack_from(self._memory, slot * self._stride)[0]
+                _HEADER.pack_into(self._memory, slot * self._stride, (sequence | 1) + 1, 0)
+            for stripe in range(len(self._locks)):
+                counter = self._counters + stripe * _COUNTER.size
+                _COUNTER.pack_into(self._memory, counter, _COUNTER.unpack_from(self._memory, counter)[0] + 1)
+        finally:
+            for lock in locks:
+                SharedEntityCache._release(lock)
+
+    def getStatistics(self):
+        """
+        Returns a dictionary of this process' cache statistics.
+        """
+        lookups = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "hitRate": float(self._hits) / lookups if lookups > 0 else 0.0,
+                "oversized": self._oversized,
+                "stale": self._stale,
+                "brokenLocks": self._brokenLocks}
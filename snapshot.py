@@ -0,0 +1,133 @@
+import mmap
+import os
+import struct
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import structs
+
+"""
+Enum of the ways a snapshot's rows are checked against the database when loaded:
+HIGH_WATER selects the rows whose VERSION_FIELD exceeds the highest version in the snapshot (one query, for versions that increase across the table,
+such as modification timestamps, but blind to deleted rows), and ROW_VERSION selects the current version of every snapshot row (one query per
+CHECK_CHUNK_SIZE rows, for per-row version counters, and detecting deleted rows).
+"""
+Staleness = structs.enum(HIGH_WATER="highwater", ROW_VERSION="rowversion")
+
+CHECK_CHUNK_SIZE = 500
+
+_MAGIC = "EZDBSNAP1\n"
+_TRAILER = struct.Struct("<Q")
+
+def saveSnapshot(path, entityClasses):
+    """
+    Writes the identity maps of entity classes to a snapshot file, so a restarted process can load them with loadSnapshot().
+    Only entities that are stored and unchanged are written. Each class must set VERSION_FIELD, used to detect rows changed since.
+    The file is written to a temporary name and renamed into place, so readers never see a partial snapshot. Returns the number of entities written per class name.
+    Snapshots are pickled, so must only be loaded from trusted locations.
+    """
+    index = {}
+    temporaryPath = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporaryPath, "wb") as snapshotFile:
+        snapshotFile.write(_MAGIC)
+        for entityClass in entityClasses:
+            if entityClass.VERSION_FIELD is None:
+                raise ValueError("Entity class '%s' must set VERSION_FIELD to be snapshotted" % entityClass.__name__)
+            fields = sorted(entityClass.FIELDS)
+            rows = []
+            highWater = None
+            for obj in entityClass._ENTITIES.values():
+                if obj.isNew() or obj.isDirty() or obj.isDeleted() or obj.isClosed() or len(obj._deferredFields) > 0:
+                    continue
+                values = entityClass._getBinaryBytes(obj._getEncodedValues())
+                rows.append(tuple(map(lambda x: values.get(x), fields)))
+                version = obj._values.get(entityClass.VERSION_FIELD)
+                if version is not None and (highWater is None or version > highWater):
+                    highWater = version
+            block = pickle.dumps(rows, 2)
+            index[entityClass.__name__] = {"table": entityClass.TABLE,
+                                           "fields": fields,
+                                           "versionField": entityClass.VERSION_FIELD,
+                                           "highWater": highWater,
+                                           "offset": snapshotFile.tell(),
+                                           "length": len(block),
+                                           "count": len(rows)}
+            snapshotFile.write(block)
+        indexOffset = snapshotFile.tell()
+        snapshotFile.write(pickle.dumps(index, 2))
+        snapshotFile.write(_TRAILER.pack(indexOffset))
+    os.rename(temporaryPath, path)
+    return dict(map(lambda x: (x[0], x[1]["count"]), index.items()))
+
+def _findChangedHighWater(db, entityClass, entry, rows):
+    """
+    Private function returning the uniqueIDs of the rows changed since the snapshot, by selecting those versioned above its high-water mark.
+    """
+    if entry["highWater"] is None:
+        #Without versions nothing can be trusted.
+        return set(map(lambda x: entityClass._buildUniqueID(dict(zip(entry["fields"], x))), rows))
+    changed = entityClass.selectBasic(db, [structs.Conditional(entry["versionField"], entry["highWater"], structs.Condition.GREATER)], fields=[entry["versionField"]])
+    return set(map(entityClass._buildUniqueID, changed))
+
+def _findChangedRowVersion(db, entityClass, entry, rows):
+    """
+    Private function returning the uniqueIDs of the snapshot rows that have changed or been deleted, by selecting the current version of each.
+    """
+    fieldIndices = dict(map(lambda x: (x[1], x[0]), enumerate(entry["fields"])))
+    versionIndex = fieldIndices[entry["versionField"]]
+    changed = set()
+    for start in range(0, len(rows), CHECK_CHUNK_SIZE):
+        chunk = rows[start:start + CHECK_CHUNK_SIZE]
+        keys = map(lambda row: map(lambda x: structs.Conditional(x, row[fieldIndices[x]]), entityClass.PRIMARY), chunk)
+        if len(entityClass.PRIMARY) == 1:
+            conditionals = [structs.Conditional(entityClass.PRIMARY[0], map(lambda x: x[0].value, keys), structs.Condition.IN)]
+        else:
+            conditionals = [structs.ConditionalGroup(map(structs.ConditionalGroup, keys), structs.Condition.OR)]
+        current = {}
+        for values in entityClass.selectBasic(db, conditionals, fields=[entry["versionField"]]):
+            current[entityClass._buildUniqueID(values)] = values[entry["versionField"]]
+        for row in chunk:
+            uniqueID = entityClass._buildUniqueID(dict(zip(entry["fields"], row)))
+            if uniqueID not in current or current[uniqueID] != row[versionIndex]:
+                changed.add(uniqueID)
+    return changed
+
+_CHANGE_FINDERS = {Staleness.HIGH_WATER: _findChangedHighWater,
+                   Staleness.ROW_VERSION: _findChangedRowVersion}
+
+def loadSnapshot(path, db, entityClasses, staleness=Staleness.HIGH_WATER):
+    """
+    Loads the snapshotted identity maps of entity classes from a snapshot file, reading it through a memory map, and builds their entities for db.
+    Rows found changed in the database (see Staleness) are skipped, to be selected afresh when needed, as are classes whose fields changed since the snapshot.
+    Returns the number of entities loaded per class name.
+    """
+    loaded = {}
+    with open(path, "rb") as snapshotFile:
+        snapshotMap = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if snapshotMap[:len(_MAGIC)] != _MAGIC:
+                raise ValueError("'%s' is not an entity snapshot" % path)
+            indexOffset = _TRAILER.unpack(snapshotMap[-_TRAILER.size:])[0]
+            index = pickle.loads(snapshotMap[indexOffset:-_TRAILER.size])
+            for entityClass in entityClasses:
+                entry = index.get(entityClass.__name__)
+                if entry is None or entry["table"] != entityClass.TABLE or entry["fields"] != sorted(entityClass.FIELDS) or entry["versionField"] != entityClass.VERSION_FIELD:
+                    loaded[entityClass.__name__] = 0
+                    continue
+                rows = pickle.loads(snapshotMap[entry["offset"]:entry["offset"] + entry["length"]])
+                changed = _CHANGE_FINDERS[staleness](db, entityClass, entry, rows)
+                count = 0
+                for row in rows:
+                    values = dict(zip(entry["fields"], row))
+                    if entityClass._buildUniqueID(values) in changed:
+                        continue
+                    obj = entityClass(db, **entityClass._wrapEncodedValues(entityClass._wrapBinaryValues(db, values)))
+                    obj._onLoad()
+                    count += 1
+                loaded[entityClass.__name__] = count
+        finally:
+            snapshotMap.close()
+    return loaded
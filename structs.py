@@ -7,7 +7,7 @@ def enum(**enums):
 """
 Enum of different conditions.
 """    
-Condition = enum(AND="AND", OR="OR", EQUAL="=", NOT_EQUAL="<>", LESS="<", GREATER=">", LESS_OR_EQUAL="<=", GREATER_OR_EQUAL=">=", CONTAINS="LIKE")
+Condition = enum(AND="AND", OR="OR", EQUAL="=", NOT_EQUAL="<>", LESS="<", GREATER=">", LESS_OR_EQUAL="<=", GREATER_OR_EQUAL=">=", CONTAINS="LIKE", IN="IN", NOT_IN="NOT IN", BETWEEN="BETWEEN", IS_NULL="IS NULL", IS_NOT_NULL="IS NOT NULL", MATCH="MATCH")
 
 """
 Enum of different ordering.
@@ -32,16 +32,26 @@ Joins = enum(INNER="INNER JOIN", LEFT_OUTER="LEFT OUTER JOIN", RIGHT_OUTER="RIGH
 class Field(object):
     """
     A class that defines the properties of a field.
+    If a codec is given (see compression.ZlibCodec and compression.LzmaCodec), which suits TEXT and BLOB fields, the field's values are stored
+    compressed in a BLOB column, compressed as entities are inserted and updated, and decompressed on first attribute access.
     """
     fieldType = None
     default = None
     length = None
     attributes = () 
-    def __init__(self, fieldType, default=None, length=None, attributes=()):
+    codec = None
+    def __init__(self, fieldType, default=None, length=None, attributes=(), codec=None):
         self.fieldType = fieldType
         self.default = default
         self.length = length
         self.attributes = attributes               
+        self.codec = codec
+
+    def getStorageType(self):
+        """
+        Returns the type of the field's column, which is BLOB for fields with a codec.
+        """
+        return Types.BLOB if self.codec is not None else self.fieldType
 
 class FieldReference(object):
     """
@@ -66,18 +76,96 @@ class FieldIdentifier(object):
         else:
             self.alias = alias
 
+class FullTextIdentifier(object):
+    """
+    A class that defines the full-text indexed fields of a table, as the field of a Condition.MATCH conditional.
+    """
+    tableName = None
+    fieldNames = ()
+    def __init__(self, tableName, fieldNames):
+        self.tableName = tableName
+        self.fieldNames = tuple(fieldNames)
+
+    def __eq__(self, other):
+        return isinstance(other, FullTextIdentifier) and (self.tableName, self.fieldNames) == (other.tableName, other.fieldNames)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.tableName, self.fieldNames))
+
 class Conditional(object):
     """
     A class that defines a conditional statement.
+    For Condition.IN and Condition.NOT_IN the value is a sequence of values, for Condition.BETWEEN it is a (low, high) pair,
+    and for Condition.IS_NULL and Condition.IS_NOT_NULL it is ignored.
+    For Condition.MATCH the field is a FullTextIdentifier and the value a full-text query, matched through the table's full-text index.
     """
     field = None
     value = None
     argument = Condition.EQUAL
-    def __init__(self, field, value, argument=Condition.EQUAL):
+    def __init__(self, field, value=None, argument=Condition.EQUAL):
         self.field = field
         self.value = value
         self.argument = argument
 
+    def getShape(self):
+        """
+        Returns a hashable description of the SQL this conditional compiles to, independent of its values.
+        """
+        if self.argument in (Condition.IN, Condition.NOT_IN):
+            return (self.field, self.argument, len(self.value))
+        return (self.field, self.argument)
+
+    def getArguments(self):
+        """
+        Returns the list of query arguments this conditional binds, in order.
+        """
+        if self.argument in (Condition.IN, Condition.NOT_IN, Condition.BETWEEN):
+            return list(self.value)
+        if self.argument in (Condition.IS_NULL, Condition.IS_NOT_NULL):
+            return []
+        return [self.value]
+
+class ConditionalGroup(object):
+    """
+    A class that defines a group of conditional statements joined by Condition.AND or Condition.OR.
+    Groups may contain other groups, allowing arbitrarily nested condition trees.
+    """
+    conditionals = ()
+    condition = Condition.AND
+    def __init__(self, conditionals, condition=Condition.AND):
+        self.conditionals = conditionals
+        self.condition = condition
+
+    def getShape(self):
+        """
+        Returns a hashable description of the SQL this group compiles to, independent of its values.
+        """
+        return (self.condition, getConditionalShape(self.conditionals))
+
+    def getArguments(self):
+        """
+        Returns the list of query arguments this group binds, in order.
+        """
+        return getConditionalArguments(self.conditionals)
+
+def getConditionalShape(conditionals):
+    """
+    Returns a hashable description of a list of conditionals, used to cache the SQL compiled for it.
+    """
+    return tuple(map(lambda x: x.getShape(), conditionals))
+
+def getConditionalArguments(conditionals):
+    """
+    Returns the flattened list of query arguments bound by a list of conditionals, in order.
+    """
+    arguments = []
+    for conditional in conditionals:
+        arguments.extend(conditional.getArguments())
+    return arguments
+
 class TableJoin(object):
     """
     A class that defines a table join.
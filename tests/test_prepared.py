@@ -0,0 +1,71 @@
+"""
+Tests of the MySQL backend's server-side prepared statements, run against the fake mysql.connector driver, which counts the statements it prepares and executes.
+"""
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    #The package relies on Python 2 semantics (e.g. map() returning lists).
+    raise unittest.SkipTest("EZDB runs on Python 2")
+
+from .. import structs
+from ..impl import mysqldb
+from ..benchmarks import fakemysql
+from ..benchmarks.fakemysql import connector
+
+class PreparedStatementTest(unittest.TestCase):
+    def _open(self, preparedCacheSize):
+        db = mysqldb.MySQL(":memory:", "test", implementation=connector.__name__, preparedCacheSize=preparedCacheSize)
+        db.buildTable("item", {"id": structs.Field(structs.Types.INT), "name": structs.Field(structs.Types.VARCHAR, length=20)}, ("id",), None)
+        self.addCleanup(db.close)
+        return db
+
+    def _selectByID(self, db, itemID):
+        return db.select("item", None, [structs.Conditional("id", itemID)])
+
+    def _selectByName(self, db, name):
+        return db.select("item", None, [structs.Conditional("name", name)])
+
+    def testRepeatedShapesArePreparedOnce(self):
+        db = self._open(8)
+        connection = db._dbConnector
+        for i in range(100):
+            db.insert("item", {"id": i, "name": "item%d" % i})
+        for i in range(100):
+            self.assertEqual(self._selectByID(db, i), [{"id": i, "name": "item%d" % i}])
+        self.assertEqual(connection.prepareCount, 2)
+        self.assertTrue(connection.executeCount >= 200)
+
+    def testLeastRecentlyUsedStatementIsEvicted(self):
+        db = self._open(2)
+        connection = db._dbConnector
+        db.insert("item", {"id": 1, "name": "a"})
+        self._selectByID(db, 1)
+        self.assertEqual(connection.prepareCount, 2)
+        #The insert is used again, so the select by id is the least recently used statement when a third one is prepared.
+        db.insert("item", {"id": 2, "name": "b"})
+        self._selectByName(db, "a")
+        self.assertEqual(connection.prepareCount, 3)
+        db.insert("item", {"id": 3, "name": "c"})
+        self.assertEqual(connection.prepareCount, 3)
+        self._selectByID(db, 1)
+        self.assertEqual(connection.prepareCount, 4)
+        self.assertEqual(len(db._preparedCursors[id(connection)]), 2)
+
+    def testEvictedCursorsAreClosed(self):
+        db = self._open(1)
+        connection = db._dbConnector
+        db.insert("item", {"id": 1, "name": "a"})
+        insertCursor = db._preparedCursors[id(connection)].values()[0]
+        self._selectByID(db, 1)
+        self.assertTrue(insertCursor.closed)
+        selectCursor = db._preparedCursors[id(connection)].values()[0]
+        self.assertFalse(selectCursor.closed)
+        db.close()
+        self.assertTrue(selectCursor.closed)
+
+    def testPreparedModeRequiresDriverSupport(self):
+        self.assertRaises(ValueError, mysqldb.MySQL, ":memory:", "test", implementation=fakemysql.__name__, preparedCacheSize=8)
+
+if __name__ == "__main__":
+    unittest.main()
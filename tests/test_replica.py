@@ -0,0 +1,114 @@
+"""
+Tests of ReplicaRouter, routing between a primary and replica kept in two local SQLite files. Nothing replicates between them,
+so each holds a row naming it, and reads show which database served them.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+if sys.version_info[0] > 2:
+    #The package relies on Python 2 semantics (e.g. map() returning lists).
+    raise unittest.SkipTest("EZDB runs on Python 2")
+
+from .. import instrumentation
+from .. import structs
+from ..impl import replicadb
+from ..impl import sqlitedb
+
+class CountingHook(instrumentation.QueryHook):
+    """
+    A query hook counting the statements run on a database, calling onQuery (if set) before each.
+    """
+    def __init__(self, onQuery=None):
+        self.count = 0
+        self.onQuery = onQuery
+
+    def beforeQuery(self, record):
+        self.count += 1
+        if self.onQuery is not None:
+            onQuery = self.onQuery
+            self.onQuery = None
+            onQuery()
+
+class ReplicaRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.primary = self._openDatabase("primary")
+        self.replicas = [self._openDatabase("replica"), sqlitedb.SQLite(os.path.join(self.directory, "replica.db"))]
+        self.addCleanup(self.replicas[1].close)
+        self.hooks = [CountingHook() for replica in self.replicas]
+        for replica, hook in zip(self.replicas, self.hooks):
+            replica.registerQueryHook(hook)
+
+    def _openDatabase(self, name):
+        db = sqlitedb.SQLite(os.path.join(self.directory, "%s.db" % name))
+        db.buildTable("node", {"id": structs.Field(structs.Types.INT), "name": structs.Field(structs.Types.VARCHAR, length=20)}, ("id",), None)
+        db.insert("node", {"id": 1, "name": name})
+        db.refresh()
+        self.addCleanup(db.close)
+        return db
+
+    def _readName(self, router):
+        return router.select("node", None, [structs.Conditional("id", 1)])[0]["name"]
+
+    def _getNames(self, db):
+        return sorted(map(lambda x: x["name"], db.select("node")))
+
+    def testReadsGoToReplicasRoundRobin(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas)
+        for i in range(4):
+            self.assertEqual(self._readName(router), "replica")
+        self.assertEqual(map(lambda x: x.count, self.hooks), [2, 2])
+
+    def testReadsGoToLeastLoadedReplica(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas, replicadb.Selection.LEAST_LOADED)
+        nested = []
+        #A read issued while the first replica is serving one goes to the other.
+        self.hooks[0].onQuery = lambda: nested.append(self._readName(router))
+        self.assertEqual(self._readName(router), "replica")
+        self.assertEqual(nested, ["replica"])
+        self.assertEqual(map(lambda x: x.count, self.hooks), [1, 1])
+        self._readName(router)
+        self.assertEqual(map(lambda x: x.count, self.hooks), [2, 1])
+
+    def testWritesGoToPrimary(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas)
+        router.insert("node", {"id": 2, "name": "written"})
+        router.update("node", {"name": "updated"}, [structs.Conditional("id", 2)])
+        router.refresh()
+        self.assertEqual(self._getNames(self.primary), ["primary", "updated"])
+        self.assertEqual(self._getNames(self.replicas[0]), ["replica"])
+        router.delete("node", [structs.Conditional("id", 2)])
+        router.refresh()
+        self.assertEqual(self._getNames(self.primary), ["primary"])
+
+    def testReadYourWritesWindow(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas, readYourWritesWindow=0.2)
+        self.assertEqual(self._readName(router), "replica")
+        router.update("node", {"name": "primary"}, [structs.Conditional("id", 1)])
+        self.assertEqual(self._readName(router), "primary")
+        time.sleep(0.3)
+        self.assertEqual(self._readName(router), "replica")
+
+    def testForgetWrites(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas, readYourWritesWindow=None)
+        router.update("node", {"name": "primary"}, [structs.Conditional("id", 1)])
+        self.assertEqual(self._readName(router), "primary")
+        router.forgetWrites()
+        self.assertEqual(self._readName(router), "replica")
+
+    def testUsePrimary(self):
+        router = replicadb.ReplicaRouter(self.primary, self.replicas)
+        with router.usePrimary():
+            self.assertEqual(self._readName(router), "primary")
+            with router.usePrimary():
+                self.assertEqual(self._readName(router), "primary")
+            self.assertEqual(self._readName(router), "primary")
+        self.assertEqual(self._readName(router), "replica")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,31 +1,236 @@
+import collections
 import os
+import threading
 
 Template = None
 moduleDirectory = os.path.dirname(__file__) + "/cache"
 
+"""
+If set, cached templates are recompiled when their file's modification time changes, at the cost of a stat per render.
+"""
+checkModified = False
+
+_templateCache = {}
+_templateLock = threading.Lock()
+
+def getTemplate(filename):
+    """
+    Returns the compiled template for a filename, compiling it on first use and caching it for the life of the process.
+    """
+    global Template
+    entry = _templateCache.get(filename)
+    if entry is not None:
+        if not checkModified or os.path.getmtime(filename) == entry[1]:
+            return entry[0]
+    with _templateLock:
+        if Template is None:
+            Template = __import__('mako.template', fromlist=['Template']).Template
+        mtime = os.path.getmtime(filename)
+        template = Template(filename=filename, module_directory=moduleDirectory)
+        _templateCache[filename] = (template, mtime)
+    return template
+
+def preloadTemplates(filenames):
+    """
+    Compiles and caches the given templates, e.g. at startup so the first renders do not pay for compilation.
+    """
+    for filename in filenames:
+        getTemplate(filename)
+
+def clearTemplateCache():
+    """
+    Empties the template cache.
+    """
+    with _templateLock:
+        _templateCache.clear()
+
+class FragmentCache(object):
+    """
+    A class caching rendered entity views, keyed by entity class, uniqueID and view mode.
+    Entries are evicted least recently used first once their total size exceeds maxSize characters.
+    Entities without a uniqueID, or that have not yet been stored in the database, are never cached.
+    """
+    maxSize = 0
+    def __init__(self, maxSize=16 * 1024 * 1024):
+        self.maxSize = maxSize
+        self._fragments = collections.OrderedDict()
+        self._viewModes = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _getEntityKey(obj):
+        """
+        Private static method returning the key identifying an entity, or None if it cannot be cached.
+        """
+        if obj.isNew():
+            return None
+        uniqueID = obj.uniqueID
+        if len(uniqueID) == 0:
+            return None
+        return (type(obj), uniqueID)
+
+    def get(self, obj, viewMode):
+        """
+        Returns the cached view of an entity, or None if it is not cached.
+        """
+        entityKey = FragmentCache._getEntityKey(obj)
+        with self._lock:
+            fragment = self._fragments.get((entityKey, viewMode)) if entityKey is not None else None
+            if fragment is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            del self._fragments[(entityKey, viewMode)]
+            self._fragments[(entityKey, viewMode)] = fragment
+            return fragment
+
+    def set(self, obj, viewMode, fragment):
+        """
+        Caches the view of an entity.
+        """
+        entityKey = FragmentCache._getEntityKey(obj)
+        if entityKey is None or len(fragment) > self.maxSize:
+            return
+        with self._lock:
+            key = (entityKey, viewMode)
+            if key in self._fragments:
+                self._size -= len(self._fragments.pop(key))
+            self._fragments[key] = fragment
+            self._viewModes.setdefault(entityKey, set()).add(viewMode)
+            self._size += len(fragment)
+            while self._size > self.maxSize:
+                oldKey, oldFragment = self._fragments.popitem(False)
+                self._removeViewMode(oldKey)
+                self._size -= len(oldFragment)
+                self._evictions += 1
+
+    def render(self, obj, viewMode, renderFunction):
+        """
+        Returns the cached view of an entity, calling renderFunction and caching its result on a miss.
+        """
+        fragment = self.get(obj, viewMode)
+        if fragment is None:
+            fragment = renderFunction()
+            self.set(obj, viewMode, fragment)
+        return fragment
+
+    def evict(self, obj):
+        """
+        Removes every cached view of an entity.
+        """
+        uniqueID = obj.uniqueID
+        if len(uniqueID) == 0:
+            return
+        entityKey = (type(obj), uniqueID)
+        with self._lock:
+            viewModes = self._viewModes.pop(entityKey, ())
+            for viewMode in viewModes:
+                self._size -= len(self._fragments.pop((entityKey, viewMode)))
+                self._invalidations += 1
+
+    def _removeViewMode(self, key):
+        """
+        Private method removing a key from the index of view modes cached per entity.
+        """
+        viewModes = self._viewModes.get(key[0])
+        if viewModes is not None:
+            viewModes.discard(key[1])
+            if len(viewModes) == 0:
+                del self._viewModes[key[0]]
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._fragments.clear()
+            self._viewModes.clear()
+            self._size = 0
+
+    def getStatistics(self):
+        """
+        Returns a dictionary of cache statistics.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"hits": self._hits,
+                    "misses": self._misses,
+                    "hitRate": float(self._hits) / lookups if lookups > 0 else 0.0,
+                    "evictions": self._evictions,
+                    "invalidations": self._invalidations,
+                    "entries": len(self._fragments),
+                    "size": self._size}
+
 class View(object):
     viewCallbacks = []
     def __init__(self, viewCallbacks):
         self.viewCallbacks = viewCallbacks
-        
-    def invoke(self, obj):
-        global moduleDirectory
-        global Template
-        result = ""
+
+    def getTemplateNames(self):
+        """
+        Returns the filenames of the templates used by this view.
+        """
+        return filter(lambda x: isinstance(x, str), self.viewCallbacks)
+
+    def _resolveCallbacks(self):
+        """
+        Private method returning a list of callables rendering each view callback, with templates resolved once.
+        """
+        renderers = []
         for viewCallback in self.viewCallbacks:
             if isinstance(viewCallback, str):
-                if Template is None:
-                    Template = __import__('mako.template', fromlist=['Template'])
-                template = Template(filename=viewCallback, moduleDirectory=moduleDirectory)
-                result = result + template.render(obj=obj)
+                renderers.append(getTemplate(viewCallback).render)
             elif hasattr(viewCallback, '__call__'):
-                result = result + viewCallback(obj)
-        return result
-    
-    @staticmethod    
+                renderers.append(lambda obj, viewCallback=viewCallback: viewCallback(obj))
+        return renderers
+
+    @staticmethod
+    def _invokeRenderers(renderers, obj):
+        """
+        Private static method rendering an object through resolved callbacks.
+        """
+        return "".join(map(lambda x: x(obj=obj), renderers))
+
+    def invoke(self, obj):
+        return View._invokeRenderers(self._resolveCallbacks(), obj)
+
+    def invokeMany(self, objs, cache=None, viewMode=None):
+        """
+        Renders a sequence of objects, resolving the view callbacks once for the whole batch.
+        """
+        return "".join(self.iterInvokeMany(objs, None, cache, viewMode))
+
+    def iterInvokeMany(self, objs, chunkSize=None, cache=None, viewMode=None):
+        """
+        Renders a sequence of objects lazily, resolving the view callbacks once for the whole batch.
+        Yields the output of each object, or if chunkSize is given, chunks of at least chunkSize characters, so large pages can be streamed.
+        If a FragmentCache is given, cached output for viewMode is reused and rendered output is cached.
+        """
+        renderers = self._resolveCallbacks()
+        buffer = []
+        size = 0
+        for obj in objs:
+            if cache is None:
+                output = View._invokeRenderers(renderers, obj)
+            else:
+                output = cache.render(obj, viewMode, lambda: View._invokeRenderers(renderers, obj))
+            if chunkSize is None:
+                yield output
+                continue
+            buffer.append(output)
+            size += len(output)
+            if size >= chunkSize:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if len(buffer) > 0:
+            yield "".join(buffer)
+
+    @staticmethod
     def render(obj, templateName):
-        global Template
-        if Template is None:
-            Template = __import__('mako.template', fromlist=['Template'])
-        template = Template(filename=viewCallback, moduleDirectory=moduleDirectory)
-        return template.render(obj=obj)            
\ No newline at end of file
+        return getTemplate(templateName).render(obj=obj)
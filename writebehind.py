@@ -0,0 +1,201 @@
+import atexit
+import collections
+import logging
+import threading
+import weakref
+
+import instrumentation
+
+_logger = logging.getLogger("ezdb.writebehind")
+
+@instrumentation.entityScoped
+def _writeEntity(obj, db):
+    """
+    Private function writing an entity's current values to a database, returning a copy of the values written.
+    The values are copied under the entity's change lock, as its owning thread may be changing it; references were resolved by Entity.update().
+    """
+    with obj._getChangeLock():
+        values = dict(obj._values)
+        storageValues = dict(obj._getStorageValues(True))
+        conditionals = obj._getPrimaryConditionals()
+    db.update(obj.TABLE, storageValues, conditionals)
+    return values
+
+class WriteBehindBuffer(object):
+    """
+    A class buffering entity updates, set as an entity class' WRITE_BEHIND, so Entity.update() returns without writing and entities stay DIRTY until flushed.
+    Repeated updates of the same entity are coalesced into one write of its latest values. A background thread flushes every flushInterval seconds,
+    writing each database's batch on a pooled connection (see DBInterface.gather) with one commit. If updates have waited maxLag seconds, or maxPending
+    entities are pending, the updating thread flushes itself. As the background thread needs pooled connections, databases that cannot open them
+    (e.g. in-memory SQLite) are rejected. Updates made within a transaction() are not buffered, but written as part of it.
+    Pending updates are flushed when close() is called, which happens at interpreter exit at the latest.
+    Update callbacks run once an entity's write has been flushed, and errors writing a batch are logged to the 'ezdb.writebehind' logger and retried.
+    An entity changed again while its write was being flushed stays DIRTY with the fields changed since. Entities' changes and the completion of their writes
+    (on the flushing thread) are serialized by entityLock, so a change made while a write completes is never lost.
+    """
+    flushInterval = 0.1
+    maxLag = 1.0
+    maxPending = 10000
+    def __init__(self, flushInterval=0.1, maxLag=1.0, maxPending=10000):
+        self.flushInterval = flushInterval
+        self.maxLag = maxLag
+        self.maxPending = maxPending
+        self._pending = collections.OrderedDict()
+        self._oldest = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.entityLock = threading.RLock()
+        self._flushLock = threading.Lock()
+        self._poolable = weakref.WeakKeyDictionary()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ezdb-write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _getKey(obj):
+        """
+        Private static method returning the key identifying an entity's row.
+        """
+        return (type(obj), tuple(sorted(obj._getPrimaries().items())))
+
+    def add(self, obj):
+        """
+        Buffers an update of an entity. Raises ValueError if its database cannot open pooled connections.
+        """
+        poolable = self._poolable.get(obj._db)
+        if poolable is None:
+            poolable = obj._db._runPooled(lambda: None)
+            self._poolable[obj._db] = poolable
+        if not poolable:
+            raise ValueError("Write-behind requires a database that can open pooled connections, which %r cannot" % obj._db)
+        now = instrumentation.timer()
+        with self._lock:
+            if self._closed:
+                overdue = None
+            else:
+                key = WriteBehindBuffer._getKey(obj)
+                if key not in self._pending:
+                    self._pending[key] = (obj, now)
+                    if self._oldest is None:
+                        self._oldest = now
+                overdue = now - self._oldest >= self.maxLag or len(self._pending) >= self.maxPending
+        if overdue is None:
+            self._completed([obj], self._write(obj._db, [obj], False))
+        elif overdue:
+            self.flush()
+
+    def discard(self, obj):
+        """
+        Drops a buffered update of an entity, e.g. as it is being deleted.
+        """
+        with self._lock:
+            self._pending.pop(WriteBehindBuffer._getKey(obj), None)
+
+    def isPending(self, obj):
+        """
+        Returns whether an update of an entity is waiting to be flushed.
+        """
+        with self._lock:
+            return WriteBehindBuffer._getKey(obj) in self._pending
+
+    def getPendingCount(self):
+        """
+        Returns the number of entities waiting to be flushed.
+        """
+        return len(self._pending)
+
+    def flush(self):
+        """
+        Writes every pending update on the calling thread, returning once they have been committed.
+        """
+        self._flush(False)
+
+    def close(self):
+        """
+        Stops the background thread and flushes pending updates. Later updates are written immediately.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._flush(False)
+
+    def _run(self):
+        """
+        Private method run by the background thread, flushing pending updates every flushInterval seconds.
+        """
+        while not self._stop.wait(self.flushInterval):
+            try:
+                self._flush(True)
+            except Exception:
+                _logger.exception("Error flushing buffered updates")
+
+    def _flush(self, pooled):
+        """
+        Private method writing the pending updates, one batch and commit per database. If pooled is set, batches are written on pooled connections,
+        and batches for databases without them are left pending.
+        """
+        with self._flushLock:
+            with self._lock:
+                batch = self._pending
+                self._pending = collections.OrderedDict()
+                self._oldest = None
+            databases = collections.OrderedDict()
+            for key, entry in batch.items():
+                databases.setdefault(entry[0]._db, []).append((key, entry))
+            for db, entries in databases.items():
+                objs = map(lambda x: x[1][0], entries)
+                try:
+                    written = self._write(db, objs, pooled)
+                except Exception:
+                    _logger.exception("Error writing %d buffered updates", len(objs))
+                    written = None
+                if written is not None:
+                    with self._lock:
+                        written = filter(lambda x: WriteBehindBuffer._getKey(x[0]) not in self._pending, zip(objs, written))
+                    self._completed(map(lambda x: x[0], written), map(lambda x: x[1], written))
+                else:
+                    self._requeue(entries)
+
+    def _requeue(self, entries):
+        """
+        Private method putting unwritten entries back, unless the entity has been updated again since.
+        """
+        with self._lock:
+            for key, entry in entries:
+                if key not in self._pending:
+                    self._pending[key] = entry
+                    if self._oldest is None or entry[1] < self._oldest:
+                        self._oldest = entry[1]
+
+    @staticmethod
+    def _write(db, objs, pooled):
+        """
+        Private static method writing entities to a database with one commit, returning the list of values written for each,
+        or None if pooled is set but the database has no pooled connections.
+        """
+        if not pooled:
+            written = map(lambda x: _writeEntity(x, db), objs)
+            db.refresh()
+            return written
+        written = []
+        if not db._runPooled(lambda: written.extend(map(lambda x: _writeEntity(x, db), objs))):
+            return None
+        return written
+
+    @staticmethod
+    def _completed(objs, written):
+        """
+        Private static method marking written entities as updated with the values written, which runs their update callbacks
+        and clears their DIRTY flag unless they have been changed since.
+        """
+        for obj, values in zip(objs, written):
+            try:
+                obj._onWritten(values)
+            except Exception:
+                _logger.exception("Error in update callbacks for %r", obj)